@@ -2,7 +2,8 @@ from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.models import User
 from django.contrib.admin.utils import flatten_fieldsets
-from api import models, forms
+from django.db.models import Count
+from api import models, forms, search
 from pprint import pprint
 
 
@@ -51,6 +52,7 @@ class TableColumnInline(admin.TabularInline):
         "slug",
         "required",
         "unique",
+        "indexed",
         "choices",
         "help_text",
     )
@@ -105,7 +107,14 @@ class EntryAdmin(admin.ModelAdmin):
     # readonly_fields = ('table', )
     # form = EntryAdminForm
     list_filter = ("table__name",)
-    search_fields = ['data']
+    # shows the search box; get_search_results does the lookup
+    search_fields = ("search_vector",)
+
+    def get_search_results(self, request, queryset, search_term):
+        # served by the search vector index instead of a text cast of data
+        if not search_term:
+            return queryset, False
+        return queryset.filter(search_vector=search.query(search_term)), False
     # def get_form(self, request, obj=None, **kwargs):
     #     # By passing 'fields', we prevent ModelAdmin.get_form from
     #     # looking up the fields itself by calling self.get_fieldsets()
@@ -139,20 +148,55 @@ class TableAdmin(admin.ModelAdmin):
         "last_edit_user",
         "active",
     )
-    list_filter = ("database__name",)
+    list_filter = ("database__name", "typed_projection")
+    list_select_related = ("database", "last_edit_user")
     search_fields = ("name",)
     inlines = (TableColumnInline, CsvFieldMapInline)
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(columns_count=Count("fields"))
+
     def columns(self, obj):
-        return obj.fields.count()
+        return obj.columns_count
 
     def entries(self, obj):
-        return obj.entries.count()
+        return obj.entries_count
 
     def save_model(self, request, obj, form, change):
         obj.last_edit_user = request.user
         super().save_model(request, obj, form, change)
 
+    def delete_queryset(self, request, queryset):
+        # Table.delete drops the entries partition
+        for obj in queryset:
+            obj.delete()
+
+
+@admin.register(models.ColumnIndex)
+class ColumnIndexAdmin(admin.ModelAdmin):
+    list_display = ("name", "table_column", "kind", "key", "status", "date_updated")
+    list_filter = ("status", "kind")
+    search_fields = ("name", "table_column__table__name")
+    readonly_fields = ("name", "table_column", "kind", "key", "status", "error", "date_updated")
+
+
+@admin.register(models.EnumValue)
+class EnumValueAdmin(admin.ModelAdmin):
+    list_display = ("value", "code", "table_column")
+    search_fields = ("value", "table_column__name", "table_column__table__name")
+    list_select_related = ("table_column__table",)
+    readonly_fields = ("table_column", "value", "code")
+
+
+@admin.register(models.SchemaChange)
+class SchemaChangeAdmin(admin.ModelAdmin):
+    list_display = ("table", "kind", "old_name", "new_name", "status", "rows_done", "rows_total", "date_created")
+    list_filter = ("status", "kind")
+    search_fields = ("table__name", "old_name", "new_name")
+    readonly_fields = (
+        "table", "table_column", "kind", "old_name", "new_name", "old_type", "new_type",
+        "rows_total", "rows_done", "rows_failed", "error", "owner", "date_created", "date_updated")
+
 
 @admin.register(models.FilterJoinTable)
 class FilterJoinTableAdmin(admin.ModelAdmin):
@@ -204,8 +248,9 @@ class FilterAdmin(admin.ModelAdmin):
 
 @admin.register(models.CsvImport)
 class CsvImportAdmin(admin.ModelAdmin):
-    list_display = ("table", "file", "import_count_created", "import_count_updated", "errors_count", "errors")
-    list_filter = ()
+    list_display = (
+        "table", "file", "status", "rows_processed", "import_count_created", "import_count_updated", "errors_count")
+    list_filter = ("status",)
     search_fields = ("table__name",)
     inlines = (CsvFieldMapInline,)
 
@@ -0,0 +1,55 @@
+"""
+Distinct values of a column, for the suggestions of the filter inputs.
+
+Prefix lookups use ``LIKE 'PREFIX%'`` and fuzzy lookups the pg_trgm word
+similarity operator, both on ``UPPER(data ->> 'column')``, so they are
+served by the trigram index ``indexes.track_value_lookups`` keeps for the
+column.
+"""
+
+from django.db import connection
+
+from api import models
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 100
+
+
+def escape_like(value):
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def top_values(column, prefix="", fuzzy=False, limit=DEFAULT_LIMIT):
+    """
+    Return the most frequent distinct values of a column as (value, count)
+    pairs, starting with ``prefix`` or, when ``fuzzy`` is set, similar to it
+    and ordered by similarity first.
+    """
+    limit = max(1, min(limit, MAX_LIMIT))
+    params = {"key": column.name, "table_id": column.table_id, "prefix": prefix, "limit": limit}
+    condition = "data ->> %(key)s IS NOT NULL AND data ->> %(key)s <> ''"
+    order = "count(*) DESC, value"
+    if prefix and fuzzy:
+        condition += " AND upper(%(prefix)s) <%% upper(data ->> %(key)s)"
+        order = "max(word_similarity(%(prefix)s, data ->> %(key)s)) DESC, " + order
+    elif prefix:
+        condition += " AND upper(data ->> %(key)s) LIKE upper(%(pattern)s)"
+        params["pattern"] = escape_like(prefix) + "%"
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT data ->> %(key)s AS value, count(*)
+            FROM {entries}
+            WHERE table_id = %(table_id)s AND {condition}
+            GROUP BY 1
+            ORDER BY {order}
+            LIMIT %(limit)s
+            """.format(
+                entries=connection.ops.quote_name(models.Entry._meta.db_table),
+                condition=condition,
+                order=order,
+            ),
+            params,
+        )
+        return cursor.fetchall()
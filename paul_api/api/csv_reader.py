@@ -0,0 +1,211 @@
+"""
+Streaming reader of uploaded CSV files.
+
+Uploads are read from the storage backend in chunks and decoded as they
+are read, so an import holds one buffer of the file at a time instead of
+the whole file as bytes, text and a list of lines. The encoding is guessed
+from the first bytes: UTF-8 when they decode, windows-1252 otherwise.
+Stray windows-1252 bytes further down a UTF-8 file are decoded as
+windows-1252 instead of failing the import halfway.
+
+Files are read line by line as bytes, so the reader knows the byte offset
+of the end of the last record it returned: imports checkpoint it and
+resume from it. Large files can be split by ``plan`` into byte ranges that
+start and end on record boundaries, read independently with
+``range_reader``.
+"""
+
+import codecs
+import csv
+import io
+
+CHUNK_SIZE = 64 * 1024
+SAMPLE_SIZE = 64 * 1024
+SNIFF_SIZE = 2000
+UTF8 = "utf-8-sig"
+FALLBACK_ENCODING = "windows-1252"
+FALLBACK_ERRORS = "api_windows_1252_fallback"
+
+
+def windows_1252_fallback(error):
+    if not isinstance(error, UnicodeDecodeError):
+        raise error
+    return error.object[error.start : error.end].decode(FALLBACK_ENCODING, "replace"), error.end
+
+
+codecs.register_error(FALLBACK_ERRORS, windows_1252_fallback)
+
+
+class StorageStream(io.RawIOBase):
+    """
+    Raw stream over a Django file, leaving the file open when closed.
+    """
+
+    def __init__(self, file, limit=None):
+        self.file = file
+        self.limit = limit
+        self.bytes_read = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = len(buffer)
+        if self.limit is not None:
+            size = min(size, self.limit - self.bytes_read)
+        data = self.file.read(size) if size > 0 else b""
+        buffer[: len(data)] = data
+        self.bytes_read += len(data)
+        return len(data)
+
+
+class LineReader:
+    """
+    Decoded lines of a Django file from a byte offset, keeping the offset of
+    the end of the last line read. The csv reader joins the lines of
+    multi-line records back.
+    """
+
+    def __init__(self, file, encoding, start=0, end=None):
+        file.seek(start)
+        self.stream = io.BufferedReader(StorageStream(file, None if end is None else end - start), CHUNK_SIZE)
+        self.decoder = codecs.getincrementaldecoder(encoding)(decode_errors(encoding))
+        self.start = start
+        self.offset = start
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self.stream.readline()
+        if not line:
+            raise StopIteration
+        self.offset += len(line)
+        return self.decoder.decode(line)
+
+
+class StreamingDictReader(csv.DictReader):
+    """
+    DictReader over a LineReader, reporting how far in the file it has read.
+    """
+
+    def __init__(self, lines, **kwargs):
+        super().__init__(lines, **kwargs)
+        self.lines = lines
+
+    @property
+    def offset(self):
+        return self.lines.offset
+
+    @property
+    def bytes_read(self):
+        return self.lines.offset - self.lines.start
+
+
+def detect_encoding(sample):
+    try:
+        # a multi-byte character cut at the end of the sample is not an error
+        codecs.getincrementaldecoder(UTF8)().decode(sample, final=False)
+    except UnicodeDecodeError:
+        return FALLBACK_ENCODING
+    return UTF8
+
+
+def decode_errors(encoding):
+    return FALLBACK_ERRORS if encoding == UTF8 else "replace"
+
+
+def dialect(file, delimiter=None):
+    """
+    Return the encoding of a Django file and its delimiter, sniffed from
+    the start of the file when not given.
+    """
+    file.seek(0)
+    sample = file.read(SAMPLE_SIZE)
+    encoding = detect_encoding(sample)
+    if not delimiter:
+        delimiter = csv.Sniffer().sniff(sample.decode(encoding, decode_errors(encoding))[:SNIFF_SIZE]).delimiter
+    return encoding, delimiter
+
+
+def dict_reader(file, delimiter=None):
+    """
+    Return a csv.DictReader over the rows of a Django file, read lazily.
+    The delimiter is sniffed from the start of the file when not given.
+    """
+    encoding, delimiter = dialect(file, delimiter)
+    return StreamingDictReader(LineReader(file, encoding), delimiter=delimiter)
+
+
+def record_boundaries(file, offsets, quoted=True):
+    """
+    Return, for each of the sorted byte ``offsets``, the offset right after
+    the first line break at or after it that is not inside a quoted field.
+    Quotes and line breaks are single bytes in the supported encodings, so
+    counting quote bytes from the start of the file is enough to know if a
+    line break is quoted. Without ``quoted``, every line break ends a record.
+    """
+    file.seek(0)
+    offsets = list(offsets)
+    boundaries = []
+    position = 0
+    quotes = 0
+    while offsets:
+        block = file.read(CHUNK_SIZE)
+        if not block:
+            break
+        while offsets:
+            start = max(offsets[0] - position, 0)
+            if start >= len(block):
+                break
+            index = block.find(b"\n", start)
+            while quoted and index != -1 and (quotes + block.count(b'"', 0, index)) % 2:
+                index = block.find(b"\n", index + 1)
+            if index == -1:
+                # carry on in the next block
+                offsets[0] = position + len(block)
+                break
+            boundary = position + index + 1
+            boundaries.append(boundary)
+            offsets = [max(x, boundary) for x in offsets[1:]]
+        quotes += block.count(b'"')
+        position += len(block)
+    # offsets past the last line break end at the end of the file
+    return boundaries + [position] * len(offsets)
+
+
+class Plan:
+    """
+    A file split into byte ranges of whole records, after the header.
+    """
+
+    def __init__(self, encoding, delimiter, fieldnames, ranges):
+        self.encoding = encoding
+        self.delimiter = delimiter
+        self.fieldnames = fieldnames
+        self.ranges = ranges
+
+
+def plan(file, parts, delimiter=None):
+    """
+    Split a Django file in up to ``parts`` ranges of about the same size.
+    """
+    encoding, delimiter = dialect(file, delimiter)
+    size = file.size
+    boundaries = record_boundaries(file, [0] + [size * i // parts for i in range(1, parts)])
+    header_end = boundaries[0]
+    file.seek(0)
+    header = file.read(header_end).decode(encoding, decode_errors(encoding))
+    fieldnames = next(csv.reader(io.StringIO(header, newline=""), delimiter=delimiter), [])
+
+    ends = boundaries[1:] + [size]
+    ranges = [(start, end) for start, end in zip(boundaries, ends) if end > start]
+    return Plan(encoding, delimiter, fieldnames, ranges)
+
+
+def range_reader(file, start, end, fieldnames, encoding, delimiter):
+    """
+    Return a DictReader over the records between two record boundaries,
+    e.g. the ranges of a plan or a checkpoint and the end of its range.
+    """
+    return StreamingDictReader(LineReader(file, encoding, start, end), fieldnames=fieldnames, delimiter=delimiter)
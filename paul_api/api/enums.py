@@ -0,0 +1,186 @@
+"""
+Dictionary encoding of enum columns.
+
+Every value of an enum column gets an integer code in EnumValue, so value
+lookups are dictionary lookups instead of scans of ``TableColumn.choices``
+and charts of tables with ``typed_projection`` group on the codes kept in
+TypedValue instead of on the JSON strings. Entry.data keeps the values
+themselves, which the API, the filters and the exports read.
+
+Writers collect the new values of a batch in an EnumDictionary and register
+them with one ``flush``, which also appends them to the choices of the
+column with a single update. Values longer than ``MAX_VALUE_LENGTH`` fit
+neither EnumValue nor the choices and are not registered, the import
+reports them as row errors with ``check_length``.
+"""
+
+from django.db import connection, transaction
+from django.db.models import Max
+
+from api import models
+
+BATCH_SIZE = 1000
+# max_length of EnumValue.value and of the items of TableColumn.choices
+MAX_VALUE_LENGTH = 255
+# times register retries the codes taken by a concurrent writer
+REGISTER_ATTEMPTS = 5
+
+
+class ValueTooLong(ValueError):
+    pass
+
+
+def check_length(value):
+    if len(str(value)) > MAX_VALUE_LENGTH:
+        raise ValueTooLong("Valoarea depășește {} de caractere".format(MAX_VALUE_LENGTH))
+
+
+def load(column):
+    """
+    Return the value to code map of an enum column.
+    """
+    return dict(models.EnumValue.objects.filter(table_column=column).values_list("value", "code"))
+
+
+def register(column, values):
+    """
+    Give a code to the values of a column that do not have one yet.
+    Concurrent writers may take the same codes, in which case the values
+    that lost are retried with the next free codes.
+    """
+    values = list(dict.fromkeys(str(x) for x in values if x is not None and x != ""))
+    for attempt in range(REGISTER_ATTEMPTS):
+        known = set()
+        for start in range(0, len(values), BATCH_SIZE):
+            known.update(
+                models.EnumValue.objects.filter(
+                    table_column=column, value__in=values[start : start + BATCH_SIZE]
+                ).values_list("value", flat=True)
+            )
+        missing = [x for x in values if x not in known]
+        if not missing:
+            return
+
+        last_code = models.EnumValue.objects.filter(table_column=column).aggregate(code=Max("code"))["code"] or 0
+        models.EnumValue.objects.bulk_create(
+            [
+                models.EnumValue(table_column=column, value=value, code=last_code + i)
+                for i, value in enumerate(missing, 1)
+            ],
+            batch_size=BATCH_SIZE,
+            ignore_conflicts=True,
+        )
+        values = missing
+
+
+def register_column(column):
+    """
+    Register the values stored in the entries and the choices of a column
+    with one set based statement.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            INSERT INTO {enum_values} (table_column_id, value, code)
+            SELECT %(column_id)s, value,
+                (SELECT coalesce(max(code), 0) FROM {enum_values} WHERE table_column_id = %(column_id)s)
+                + row_number() OVER (ORDER BY value)
+            FROM (
+                SELECT DISTINCT data ->> %(key)s AS value
+                FROM {entries}
+                WHERE table_id = %(table_id)s AND data ? %(key)s
+            ) AS distinct_values
+            WHERE value IS NOT NULL AND value <> '' AND NOT EXISTS (
+                SELECT 1 FROM {enum_values}
+                WHERE table_column_id = %(column_id)s AND value = distinct_values.value
+            )
+            ON CONFLICT DO NOTHING
+            """.format(
+                enum_values=connection.ops.quote_name(models.EnumValue._meta.db_table),
+                entries=connection.ops.quote_name(models.Entry._meta.db_table),
+            ),
+            {"column_id": column.pk, "table_id": column.table_id, "key": column.name},
+        )
+    register(column, column.choices or [])
+
+
+def add_choices(column, values):
+    """
+    Append values to the choices of a column with a single update.
+    """
+    with transaction.atomic():
+        choices = (
+            models.TableColumn.objects.select_for_update().values_list("choices", flat=True).get(pk=column.pk) or []
+        )
+        known = set(choices)
+        new_choices = [x for x in values if x not in known]
+        if new_choices:
+            choices = choices + new_choices
+            models.TableColumn.objects.filter(pk=column.pk).update(choices=choices)
+    column.choices = choices
+
+
+class EnumDictionary:
+    """
+    Value to code maps of the enum columns of a table, with the values not
+    seen before queued until ``flush``.
+    """
+
+    def __init__(self, table, columns=None):
+        if columns is None:
+            columns = table.fields.all()
+        self.columns = {x.name: x for x in columns if x.field_type == "enum"}
+        self.codes = {name: {} for name in self.columns}
+        self.pending = {name: {} for name in self.columns}
+
+        names = {x.pk: x.name for x in self.columns.values()}
+        if names:
+            enum_values = models.EnumValue.objects.filter(table_column__in=list(names)).values_list(
+                "table_column_id", "value", "code"
+            )
+            for column_id, value, code in enum_values:
+                self.codes[names[column_id]][value] = code
+        # choices edited by hand may not have codes yet
+        for name, column in self.columns.items():
+            self.add_many(name, column.choices or [])
+
+    def add(self, name, value):
+        """
+        Queue a value of an enum column if it has no code yet.
+        """
+        if name not in self.columns or value is None or value == "":
+            return
+        value = str(value)
+        if len(value) > MAX_VALUE_LENGTH:
+            return
+        if value not in self.codes[name]:
+            self.pending[name][value] = None
+
+    def add_many(self, name, values):
+        for value in values:
+            self.add(name, value)
+
+    def code(self, name, value):
+        if value is None or name not in self.codes:
+            return None
+        return self.codes[name].get(str(value))
+
+    def labels(self, name):
+        """
+        Return the code to value map of a column.
+        """
+        return {code: value for value, code in self.codes.get(name, {}).items()}
+
+    def flush(self):
+        """
+        Register the queued values and add them to the choices of their
+        columns, one statement per column instead of one save per value.
+        """
+        for name, pending in self.pending.items():
+            if not pending:
+                continue
+            column = self.columns[name]
+            register(column, pending)
+            add_choices(column, list(pending))
+            self.codes[name] = load(column)
+            self.pending[name] = {}
@@ -0,0 +1,146 @@
+"""
+Exports written to the default storage in the background.
+
+Large exports outlive a request, so clients ask for an export job and poll
+it until the file is in the storage, then download it from its URL. A job
+is identified by a fingerprint of what it exports: the table or filter,
+the file format, the query parameters, the columns of the filter and the
+revisions of the tables it reads. Every change of the entries or columns
+of a table bumps its revision, so a job with the same fingerprint exports
+the same rows and its file is handed out again instead of being written
+anew. Relative date filters (``__relative=current_week``) select other
+rows from one day to the next, so their jobs are only reused on the day
+they were created.
+
+Jobs and their files are deleted ``EXPORT_JOB_RETENTION_DAYS`` after they
+were created by ``delete_expired``, which celery beat runs daily.
+"""
+
+import hashlib
+import json
+import tempfile
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from api import exports, models
+
+# query parameters that do not change what is exported
+IGNORED_PARAMS = {"token", "format", "file_format"}
+# queued or running jobs older than this are not waited for
+STALLED_AFTER = timedelta(hours=1)
+
+
+def export_params(query):
+    return {key: query.get(key) for key in sorted(query) if key not in IGNORED_PARAMS}
+
+
+def tables(kind, obj):
+    if kind == "table":
+        return [obj]
+    return [x.table for x in [obj.primary_table] + list(obj.join_tables.all())]
+
+
+def fingerprint(kind, obj, params, file_format="csv"):
+    """
+    Hash of everything the file of an export depends on.
+    """
+    table_ids = [table.pk for table in tables(kind, obj)]
+    revisions = dict(models.Table.objects.filter(pk__in=table_ids).values_list("pk", "revision"))
+    source = {
+        "kind": kind,
+        "id": obj.pk,
+        "params": params,
+        "file_format": file_format,
+        "revisions": [[pk, revisions.get(pk)] for pk in table_ids],
+    }
+    if any(key.endswith("__relative") for key in params):
+        # the period a relative lookup selects depends on the current day
+        source["date"] = timezone.now().date().isoformat()
+    if kind == "filter":
+        source["default_fields"] = sorted(obj.default_fields.values_list("pk", flat=True))
+        source["join_fields"] = [x.join_field_id for x in [obj.primary_table] + list(obj.join_tables.all())]
+    return hashlib.sha256(json.dumps(source, sort_keys=True).encode()).hexdigest()
+
+
+def request(kind, obj, query, owner=None, file_format="csv"):
+    """
+    Return the job of an identical export, done or still running, or queue
+    a new one once the current transaction commits. The second value tells
+    if the job was created.
+    """
+    from api import tasks
+
+    params = export_params(query)
+    key = fingerprint(kind, obj, params, file_format)
+    recent = timezone.now() - STALLED_AFTER
+    job = (
+        models.ExportJob.objects.filter(fingerprint=key)
+        .filter(Q(status="done") | Q(status__in=["queued", "running"], date_created__gte=recent))
+        .first()
+    )
+    if job:
+        return job, False
+
+    job = models.ExportJob.objects.create(
+        kind=kind,
+        table=obj if kind == "table" else None,
+        filter=obj if kind == "filter" else None,
+        params=params,
+        file_format=file_format,
+        fingerprint=key,
+        owner=owner,
+    )
+    job_id = job.pk
+    transaction.on_commit(lambda: tasks.run_export_job.delay(job_id))
+    return job, True
+
+
+def run(job_id):
+    """
+    Write the file of a queued export job to the storage.
+    """
+    claimed = models.ExportJob.objects.filter(pk=job_id, status="queued").update(
+        status="running", date_started=timezone.now()
+    )
+    if not claimed:
+        return
+    job = models.ExportJob.objects.select_related("table", "filter").get(pk=job_id)
+    jobs = models.ExportJob.objects.filter(pk=job_id)
+
+    try:
+        if job.kind == "table":
+            obj = job.table
+            export = exports.table_export(obj, job.params)
+        else:
+            obj = models.Filter.objects.prefetch_related("primary_table", "join_tables").get(pk=job.filter_id)
+            export = exports.filter_export(obj, job.params)
+        # the entries may have changed since the job was queued
+        key = fingerprint(job.kind, obj, job.params, job.file_format)
+        with tempfile.TemporaryFile() as file:
+            export.write(file, job.file_format)
+            file.seek(0)
+            # a random directory keeps the stored file from being guessed
+            # from the table name and date while keeping its download name
+            name = "{}/{}".format(uuid.uuid4().hex, export.file_name(job.file_format))
+            job.file.save(name, File(file), save=False)
+    except Exception as e:
+        jobs.update(status="failed", error=str(e), date_finished=timezone.now())
+        return
+
+    jobs.update(status="done", file=job.file.name, fingerprint=key, date_finished=timezone.now())
+
+
+def delete_expired():
+    """
+    Delete the jobs older than the retention period, along with their files.
+    """
+    expired = timezone.now() - timedelta(days=settings.EXPORT_JOB_RETENTION_DAYS)
+    # one by one, so the post_delete receiver removes each file
+    for job in models.ExportJob.objects.filter(date_created__lt=expired).iterator():
+        job.delete()
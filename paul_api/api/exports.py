@@ -0,0 +1,581 @@
+"""
+Streamed exports of entries.
+
+Exports are written to a StreamingHttpResponse as their rows are read with
+``.iterator(chunk_size=EXPORT_BATCH_SIZE)``, which fetches the rows from a
+named server-side cursor on PostgreSQL. The first bytes are sent right
+away and the memory used stays the same whatever the size of the export.
+
+Exports of entry data columns skip the ORM: ``copy_sql`` compiles the
+queryset and the columns into one ``COPY (SELECT data ->> 'a', ...) TO
+STDOUT WITH CSV HEADER`` statement, and ``copy_stream`` yields the bytes
+PostgreSQL writes as they come. COPY only writes to a file, so it runs in
+a thread of its own, on its own connection, feeding a bounded queue.
+
+Filters joining two tables walk the secondary table in batches, by keyset
+on the id unless they are sorted on a data key, and fetch the primary
+entries of each batch with a predicate bounded by the batch, so the time
+of an export grows linearly with its rows. The keyset batches do not
+repeat the semi-join on the filtered primary entries in every query: the
+secondary entries the primary lookup of their batch does not match are
+dropped instead.
+
+``table_export`` and ``filter_export`` turn the query parameters of an
+export into an ``Export``, which is either streamed as a response or
+written to a file by the background export jobs, as CSV, as NDJSON or as
+Parquet. Parquet columns get the arrow type of the field type of their
+column (enums are dictionary encoded) and are written a batch of rows at
+a time to a temporary file, since the file ends with its metadata.
+"""
+
+import csv
+import itertools
+import json
+import queue
+import tempfile
+import threading
+from datetime import date, datetime
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+from django.db.models import Q
+from django.http import FileResponse, StreamingHttpResponse
+
+from api import models, projections, utils
+
+EXPORT_BATCH_SIZE = 2000
+COPY_BUFFER_SIZE = 64 * 1024
+COPY_QUEUE_SIZE = 16
+BOM = "\ufeff"
+INT64_MIN = -(2**63)
+INT64_MAX = 2**63 - 1
+
+
+class Echo:
+    """
+    File-like object returning what is written to it, for streaming the
+    lines of a csv writer.
+    """
+
+    def write(self, value):
+        return value
+
+
+def batches(rows, size=EXPORT_BATCH_SIZE):
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def csv_lines(fieldnames, rows):
+    """
+    The header and the rows of a CSV file, a batch of rows at a time. The
+    BOM lets Excel read the file as UTF-8.
+    """
+    writer = csv.DictWriter(
+        Echo(), delimiter=",", quoting=csv.QUOTE_MINIMAL, fieldnames=fieldnames, extrasaction="ignore"
+    )
+    yield BOM + writer.writeheader()
+    for batch in batches(rows):
+        yield "".join(writer.writerow(row) for row in batch)
+
+
+def csv_response(file_name, fieldnames, rows):
+    response = StreamingHttpResponse(csv_lines(fieldnames, rows), content_type="application/vnd.ms-excel")
+    response["Content-Disposition"] = 'attachment; filename="{}"'.format(file_name)
+    return response
+
+
+def quote_name(name):
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+def copy_sql(queryset, columns):
+    """
+    Compile a COPY statement writing, as CSV with a header, the data keys
+    of the entries of a queryset. ``columns`` are (header, key) pairs.
+    """
+    sql, params = queryset.values("data").query.sql_with_params()
+    select = ", ".join("entries.data ->> %s AS {}".format(quote_name(header)) for header, key in columns)
+    with connection.cursor() as cursor:
+        query = cursor.mogrify(
+            "SELECT {} FROM ({}) AS entries".format(select or "NULL", sql),
+            [key for header, key in columns] + list(params),
+        )
+    return "COPY ({}) TO STDOUT WITH CSV HEADER".format(query.decode())
+
+
+def copy_to(sql, file):
+    with connection.cursor() as cursor:
+        cursor.copy_expert(sql, file)
+
+
+class CopyCancelled(Exception):
+    pass
+
+
+class CopyWriter:
+    """
+    File the COPY thread writes to, putting blocks of COPY_BUFFER_SIZE
+    bytes on a queue until the reader goes away.
+    """
+
+    def __init__(self, chunks, cancelled):
+        self.chunks = chunks
+        self.cancelled = cancelled
+        self.buffer = bytearray()
+
+    def put(self, item):
+        while not self.cancelled.is_set():
+            try:
+                self.chunks.put(item, timeout=1)
+                return
+            except queue.Full:
+                pass
+        raise CopyCancelled()
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= COPY_BUFFER_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.put(bytes(self.buffer))
+            self.buffer = bytearray()
+
+
+def copy_stream(sql):
+    """
+    Yield the output of a COPY ... TO STDOUT statement while it runs.
+    """
+    chunks = queue.Queue(maxsize=COPY_QUEUE_SIZE)
+    cancelled = threading.Event()
+    writer = CopyWriter(chunks, cancelled)
+
+    def run():
+        try:
+            copy_to(sql, writer)
+            writer.flush()
+            writer.put(None)
+        except CopyCancelled:
+            pass
+        except Exception as e:
+            try:
+                writer.put(e)
+            except CopyCancelled:
+                pass
+        finally:
+            connection.close()
+
+    threading.Thread(target=run, daemon=True).start()
+    try:
+        while True:
+            item = chunks.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        cancelled.set()
+
+
+def copy_response(file_name, queryset, columns):
+    """
+    Stream the data keys of the entries of a queryset as a CSV file with
+    COPY. ``columns`` are (header, key) pairs.
+    """
+    sql = copy_sql(queryset, columns)
+    response = StreamingHttpResponse(
+        itertools.chain([BOM.encode()], copy_stream(sql)), content_type="application/vnd.ms-excel"
+    )
+    response["Content-Disposition"] = 'attachment; filename="{}"'.format(file_name)
+    return response
+
+
+def keyset_batches(queryset, size=EXPORT_BATCH_SIZE):
+    """
+    Batches of the values of a queryset of entries, which must include the
+    id, in id order. Each batch is its own ``id > last id`` query on the
+    primary key, so the export neither scans the rows it skipped like
+    OFFSET nor holds a cursor open for its whole length.
+    """
+    queryset = queryset.order_by("id")
+    last_id = None
+    while True:
+        page = queryset if last_id is None else queryset.filter(id__gt=last_id)
+        batch = list(page[:size])
+        if batch:
+            yield batch
+        if len(batch) < size:
+            return
+        last_id = batch[-1]["id"]
+
+
+def join_rows(
+    secondary_batches,
+    primary_entries,
+    primary_join_field,
+    secondary_join_field,
+    primary_slug,
+    secondary_slug,
+    matched_only=False,
+):
+    """
+    Merge batches of secondary entry values with the primary entries they
+    join. The primary entries of a batch are fetched in one query, filtered
+    by the distinct join values of that batch only. With ``matched_only``
+    the secondary entries no primary entry joins are left out.
+    """
+    secondary_join_key = "data__{}".format(secondary_join_field)
+    for batch in secondary_batches:
+        join_values = list({entry[secondary_join_key] for entry in batch})
+        primary_values = {
+            data[primary_join_field]: data
+            for data in primary_entries.filter(**{"data__{}__in".format(primary_join_field): join_values})
+            .exclude(data=None)
+            .values_list("data", flat=True)
+        }
+
+        for entry in batch:
+            if matched_only and entry[secondary_join_key] not in primary_values:
+                continue
+            row = {
+                key.replace("data__", "{}__".format(secondary_slug)): value
+                for key, value in entry.items()
+                if key != "id"
+            }
+            row.update(
+                {
+                    "{}__{}".format(primary_slug, key): value
+                    for key, value in primary_values.get(entry[secondary_join_key], {}).items()
+                }
+            )
+            yield row
+
+
+def lenient(convert):
+    """
+    Wrap a converter so that empty values and values it fails on are null.
+    """
+
+    def wrapper(value):
+        if value is None or value == "":
+            return None
+        try:
+            return convert(value)
+        except (TypeError, ValueError):
+            return None
+
+    return wrapper
+
+
+def to_text(value):
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    return str(value)
+
+
+def to_int(value):
+    """
+    The integer of a whole number, from an int, a float or their text.
+    Fractions and numbers out of the int64 range are not integers.
+    """
+    if isinstance(value, str):
+        try:
+            value = int(value)
+        except ValueError:
+            value = float(value)
+    if isinstance(value, float):
+        if not value.is_integer():
+            raise ValueError("Not a whole number: {}".format(value))
+        value = int(value)
+    value = int(value)
+    if not INT64_MIN <= value <= INT64_MAX:
+        raise ValueError("Out of the int64 range: {}".format(value))
+    return value
+
+
+def to_date(value):
+    return date.fromisoformat(str(value)[:10])
+
+
+# arrow type and value converter of every field type
+PARQUET_TYPES = {
+    "int": (pa.int64(), lenient(to_int)),
+    "float": (pa.float64(), lenient(float)),
+    "date": (pa.date32(), lenient(to_date)),
+    "enum": (pa.dictionary(pa.int32(), pa.string()), lenient(to_text)),
+    "text": (pa.string(), lenient(to_text)),
+}
+
+
+def parquet_schema(fieldnames, types):
+    return pa.schema([(name, PARQUET_TYPES.get(types.get(name), PARQUET_TYPES["text"])[0]) for name in fieldnames])
+
+
+def parquet_batch(schema, types, rows):
+    """
+    A record batch of rows, their values converted to the types of the
+    schema. Enum columns are dictionary encoded.
+    """
+    arrays = []
+    for field in schema:
+        convert = PARQUET_TYPES.get(types.get(field.name), PARQUET_TYPES["text"])[1]
+        values = [convert(row.get(field.name)) for row in rows]
+        if pa.types.is_dictionary(field.type):
+            arrays.append(pa.array(values, type=pa.string()).dictionary_encode())
+        else:
+            arrays.append(pa.array(values, type=field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def ndjson_lines(rows):
+    for batch in batches(rows):
+        yield "".join(json.dumps(row, ensure_ascii=False, cls=DjangoJSONEncoder) + "\n" for row in batch)
+
+
+class Export:
+    """
+    An export: the entries of a queryset and the (header, key) pairs of the
+    data keys COPY writes, or fieldnames and an iterable of row dicts. The
+    field types of the headers give the column types of Parquet files.
+    """
+
+    def __init__(self, name, queryset=None, columns=None, fieldnames=None, rows=None, types=None):
+        self.name = name
+        self.queryset = queryset
+        self.columns = columns
+        self.fieldnames = fieldnames if fieldnames is not None else [header for header, key in columns]
+        self.rows = rows
+        self.types = types or {}
+
+    def file_name(self, file_format="csv"):
+        return "{}.{}".format(self.name, file_format)
+
+    def records(self):
+        """
+        The exported rows as dicts keyed by header.
+        """
+        if self.queryset is None:
+            return self.rows
+        entries = self.queryset.values_list("data", flat=True).iterator(chunk_size=EXPORT_BATCH_SIZE)
+        return ({header: (data or {}).get(key) for header, key in self.columns} for data in entries)
+
+    def response(self, file_format="csv"):
+        if file_format == "ndjson":
+            response = StreamingHttpResponse(ndjson_lines(self.records()), content_type="application/x-ndjson")
+            response["Content-Disposition"] = 'attachment; filename="{}"'.format(self.file_name(file_format))
+            return response
+        if file_format == "parquet":
+            file = tempfile.TemporaryFile()
+            self.write(file, file_format)
+            file.seek(0)
+            return FileResponse(
+                file,
+                as_attachment=True,
+                filename=self.file_name(file_format),
+                content_type="application/vnd.apache.parquet",
+            )
+        if self.queryset is not None:
+            return copy_response(self.file_name(), self.queryset, self.columns)
+        return csv_response(self.file_name(), self.fieldnames, self.rows)
+
+    def write(self, file, file_format="csv"):
+        """
+        Write the file to a binary file.
+        """
+        if file_format == "ndjson":
+            for lines in ndjson_lines(self.records()):
+                file.write(lines.encode())
+        elif file_format == "parquet":
+            schema = parquet_schema(self.fieldnames, self.types)
+            with pq.ParquetWriter(file, schema) as writer:
+                for batch in batches(self.records()):
+                    writer.write_batch(parquet_batch(schema, self.types, batch))
+        elif self.queryset is None:
+            for lines in csv_lines(self.fieldnames, self.rows):
+                file.write(lines.encode())
+        else:
+            file.write(BOM.encode())
+            copy_to(copy_sql(self.queryset, self.columns), file)
+
+
+def table_export(table, params):
+    """
+    Export of the entries of a table matching the filters in ``params``.
+    """
+    table_fields = {x.name: x for x in table.fields.all()}
+
+    filter_dict = utils.request_get_to_filter(params, table_fields, Q(), False)
+
+    name = "{}__{}".format(table.name, datetime.now().strftime("%d.%m.%Y"))
+    columns = [(field_name, field_name) for field_name in table.fields.values_list("name", flat=True)]
+    types = {x.name: x.field_type for x in table_fields.values()}
+    return Export(name, queryset=table.entries.filter(filter_dict), columns=columns, types=types)
+
+
+def filter_export(obj, params):
+    """
+    Export of the entries of a filter matching the filters in ``params``,
+    with the ``__fields`` and ``__order`` it gives.
+    """
+    str_fields = params.get("__fields", "")
+    str_order = params.get("__order", "")
+
+    primary_table = obj.primary_table
+    primary_table_slug = primary_table.table.slug
+
+    is_two_tables_filter = False
+
+    if obj.join_tables.all():
+        primary_table_join_field = primary_table.join_field.name
+        secondary_table = obj.join_tables.all()[0]
+        secondary_table_slug = secondary_table.table.slug
+        secondary_table_join_field = secondary_table.join_field.name
+        is_two_tables_filter = True
+
+    # Get all fields and display fields
+    all_fields = []
+    field_types = {}
+    for field in primary_table.fields.all().order_by("id"):
+        if obj.default_fields.all():
+            if field in obj.default_fields.all():
+                field_key = "{}__{}".format(primary_table.table.slug, field.name)
+                all_fields.append(field_key)
+                field_types[field_key] = field.field_type
+        else:
+            field_key = "{}__{}".format(primary_table.table.slug, field.name)
+            all_fields.append(field_key)
+            field_types[field_key] = field.field_type
+
+    if is_two_tables_filter:
+        for field in secondary_table.fields.all().order_by("id"):
+            if obj.default_fields.all():
+                if field in obj.default_fields.all():
+                    field_key = "{}__{}".format(secondary_table.table.slug, field.name)
+                    all_fields.append(field_key)
+                    field_types[field_key] = field.field_type
+            else:
+                field_key = "{}__{}".format(secondary_table.table.slug, field.name)
+                all_fields.append(field_key)
+                field_types[field_key] = field.field_type
+
+    fields = all_fields
+    if str_fields:
+        if str_fields == "ALL":
+            fields = all_fields
+        else:
+            fields = str_fields.split(",") if str_fields else None
+
+    primary_table_fields = []
+    secondary_table_fields = []
+
+    for field in fields:
+        if field.startswith(primary_table_slug):
+            primary_table_fields.append(field.replace(primary_table_slug + "__", "data__"))
+        else:
+            secondary_table_fields.append(field.replace(secondary_table_slug + "__", "data__"))
+
+    if is_two_tables_filter:
+        secondary_table_fields.append("data__{}".format(secondary_table_join_field))
+
+    order_table = str_order.split("__")[0]
+    str_order = str_order.replace(order_table + "__", "")
+
+    if str_order:
+        if str_order.startswith("-"):
+            order_by = "-data__{}".format(str_order[1:])
+        else:
+            order_by = "data__{}".format(str_order)
+    else:
+        order_by = "id"
+
+    table_order_by = "id"
+
+    if order_table == primary_table_slug:
+        table_order_by = order_by
+
+    # Create filters dict
+    filter_dict = {
+        primary_table_slug: Q(),
+    }
+    if is_two_tables_filter:
+        filter_dict[secondary_table_slug] = Q()
+
+    typed_columns = {
+        "{}__{}".format(primary_table_slug, key): column
+        for key, column in projections.projected_columns(primary_table.table).items()
+    }
+    if is_two_tables_filter:
+        typed_columns.update(
+            {
+                "{}__{}".format(secondary_table_slug, key): column
+                for key, column in projections.projected_columns(secondary_table.table).items()
+            }
+        )
+
+    filter_dict = utils.request_get_to_filter(params, field_types, filter_dict, True, typed_columns)
+
+    name = "{}__{}".format(obj.slug, datetime.now().strftime("%d_%m_%Y__%H_%M"))
+
+    # If filter has only primary_table
+    if not is_two_tables_filter:
+        queryset = (
+            models.Entry.objects.filter(table=primary_table.table)
+            .filter(filter_dict[primary_table_slug])
+            .order_by(table_order_by)
+        )
+
+        if not fields:
+            fields = [x.replace("data__", "{}__".format(primary_table_slug)) for x in primary_table_fields]
+
+        prefix = "{}__".format(primary_table_slug)
+        columns = [(field, field[len(prefix) :] if field.startswith(prefix) else field) for field in fields]
+        return Export(name, queryset=queryset, columns=columns, types=field_types)
+
+    join_values = (
+        models.Entry.objects.filter(table=primary_table.table)
+        .filter(filter_dict[primary_table_slug])
+        .values("data__{}".format(primary_table.join_field.name))
+        .order_by()
+    )
+
+    table_order_by = "id"
+    if order_table == secondary_table_slug:
+        table_order_by = order_by
+
+    queryset = (
+        models.Entry.objects.filter(table=secondary_table.table)
+        .filter(filter_dict[secondary_table_slug])
+        .values("id", *secondary_table_fields)
+    )
+    if not fields:
+        fields = [x.replace("data__", "{}__".format(primary_table_slug)) for x in primary_table_fields]
+        fields += [x.replace("data__", "{}__".format(secondary_table_slug)) for x in secondary_table_fields]
+
+    # the sorted export is a single query, which runs the semi-join once,
+    # the keyset batches leave the matching to the lookups of join_rows
+    matched_only = table_order_by == "id"
+    if matched_only:
+        secondary_batches = keyset_batches(queryset)
+    else:
+        queryset = queryset.filter(**{"data__{}__in".format(secondary_table_join_field): join_values})
+        secondary_batches = batches(queryset.order_by(table_order_by, "id").iterator(chunk_size=EXPORT_BATCH_SIZE))
+    primary_entries = models.Entry.objects.filter(table=primary_table.table).filter(filter_dict[primary_table_slug])
+    rows = join_rows(
+        secondary_batches,
+        primary_entries,
+        primary_table_join_field,
+        secondary_table_join_field,
+        primary_table_slug,
+        secondary_table_slug,
+        matched_only,
+    )
+    return Export(name, fieldnames=fields, rows=rows, types=field_types)
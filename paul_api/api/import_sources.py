@@ -0,0 +1,229 @@
+"""
+Import sources other than CSV files.
+
+XLSX uploads are read with openpyxl in read-only mode, one row at a time,
+and converted to a CSV file in the storage when their import starts, so
+they are imported like CSV files, with byte offset checkpoints and parallel
+parts. NDJSON uploads hold one JSON object per line and are read directly,
+a line at a time, the keys of the objects taking the place of the header.
+The header of an upload is the union of the keys of its sampled lines, so
+the upload request does not read the whole file; the import task reads
+every line once to plan its parts and imports the union of all the keys.
+Lines that are not JSON objects are rows holding the line under
+``INVALID_LINE``, which the import reports as errors.
+"""
+
+import csv
+import datetime
+import io
+import itertools
+import json
+import os
+import tempfile
+import zipfile
+
+import openpyxl
+from django.core.files import File
+from openpyxl.utils.exceptions import InvalidFileException
+
+from api import csv_reader
+
+EXTENSIONS = {
+    ".xlsx": "xlsx",
+    ".ndjson": "ndjson",
+    ".jsonl": "ndjson",
+}
+# NDJSON lines that are not JSON objects are reported under this column
+INVALID_LINE = "_line"
+INVALID_LINE_ERROR = "Linia nu este un obiect JSON"
+# lines whose keys make the header of an upload, at least
+SAMPLE_LINES = 2000
+
+
+class SourceError(Exception):
+    pass
+
+
+class InvalidLine(dict):
+    """
+    Row of an NDJSON line that is not a JSON object, with the error the
+    import reports for it.
+    """
+
+    error = INVALID_LINE_ERROR
+
+
+def detect_format(name):
+    return EXTENSIONS.get(os.path.splitext(name or "")[1].lower(), "csv")
+
+
+def sample(file, file_format, delimiter=None, size=0):
+    """
+    Return the column names of an uploaded file and up to ``size`` of its
+    first rows, as dicts.
+    """
+    try:
+        if file_format == "xlsx":
+            workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+            try:
+                rows = xlsx_rows(workbook.worksheets[0])
+                names = next(rows, [])
+                return names, [dict(zip(names, row)) for row in itertools.islice(rows, size)]
+            finally:
+                workbook.close()
+        if file_format == "ndjson":
+            names = ndjson_fieldnames(file, max(size, SAMPLE_LINES))
+            file.seek(0)
+            encoding = csv_reader.detect_encoding(file.read(csv_reader.SAMPLE_SIZE))
+            reader = NdjsonReader(csv_reader.LineReader(file, encoding), names)
+        else:
+            reader = csv_reader.dict_reader(file, delimiter)
+        rows = list(itertools.islice(reader, size))
+        return reader.fieldnames or [], rows
+    except (csv.Error, ValueError, KeyError, IndexError, zipfile.BadZipFile, InvalidFileException) as e:
+        raise SourceError(str(e))
+
+
+def fieldnames(file, file_format, delimiter=None):
+    """
+    Return the column names of an uploaded file.
+    """
+    return sample(file, file_format, delimiter)[0]
+
+
+def cell_text(value):
+    if value is None:
+        return ""
+    if isinstance(value, datetime.datetime) and value.time() == datetime.time():
+        return value.date().isoformat()
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    return str(value)
+
+
+def xlsx_rows(sheet):
+    """
+    The non-empty rows of a sheet as lists of text, cut to the width of the
+    header.
+    """
+    width = None
+    for row in sheet.iter_rows(values_only=True):
+        if all(value is None for value in row):
+            continue
+        row = [cell_text(value) for value in row]
+        if width is None:
+            while row and row[-1] == "":
+                row.pop()
+            width = len(row)
+        yield row[:width] + [""] * (width - len(row))
+
+
+def xlsx_to_csv(csv_import):
+    """
+    Replace the XLSX file of an import with a CSV file of its first sheet.
+    """
+    storage = csv_import.file.storage
+    xlsx_name = csv_import.file.name
+    workbook = openpyxl.load_workbook(csv_import.file, read_only=True, data_only=True)
+    try:
+        with tempfile.TemporaryFile() as converted:
+            text = io.TextIOWrapper(converted, encoding="utf-8", newline="")
+            writer = csv.writer(text, delimiter=",")
+            for row in xlsx_rows(workbook.worksheets[0]):
+                writer.writerow(row)
+            text.detach()
+            converted.seek(0)
+            csv_name = storage.save(os.path.splitext(xlsx_name)[0] + ".csv", File(converted))
+    finally:
+        workbook.close()
+
+    # the field file keeps the open XLSX file, a new one opens the CSV file
+    csv_import.file.close()
+    csv_import.file = csv_name
+    csv_import.file_format = "csv"
+    csv_import.delimiter = ","
+    csv_import.bytes_total = csv_import.file.size
+    csv_import.save(update_fields=["file", "file_format", "delimiter", "bytes_total"])
+    storage.delete(xlsx_name)
+
+
+def ndjson_fieldnames(file, limit=None):
+    """
+    The keys of the objects of the first ``limit`` lines of an NDJSON file,
+    of all of them by default, in the order they first appear. Lines that
+    are not JSON objects are skipped, the import reports them.
+    """
+    file.seek(0)
+    encoding = csv_reader.detect_encoding(file.read(csv_reader.SAMPLE_SIZE))
+    keys = {}
+    objects = 0
+    lines = (line for line in csv_reader.LineReader(file, encoding) if line.strip())
+    for line in itertools.islice(lines, limit):
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if isinstance(record, dict):
+            objects += 1
+            keys.update(dict.fromkeys(record))
+    if not objects:
+        raise ValueError("No JSON object in the file")
+    return list(keys)
+
+
+class NdjsonReader:
+    """
+    Rows of an NDJSON file as dicts of text values, from a LineReader. The
+    ``offset`` and ``bytes_read`` of the lines are those of the reader.
+    """
+
+    def __init__(self, lines, fieldnames):
+        self.lines = lines
+        self.fieldnames = fieldnames
+
+    @property
+    def offset(self):
+        return self.lines.offset
+
+    @property
+    def bytes_read(self):
+        return self.lines.offset - self.lines.start
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = next(self.lines)
+        while not line.strip():
+            line = next(self.lines)
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        if not isinstance(record, dict):
+            return InvalidLine({INVALID_LINE: line.rstrip("\r\n")})
+        return {name: cell_text(record.get(name)) for name in self.fieldnames}
+
+
+def plan(file, file_format, parts, delimiter=None):
+    """
+    Split an uploaded file in up to ``parts`` ranges of whole records.
+    """
+    if file_format != "ndjson":
+        return csv_reader.plan(file, parts, delimiter)
+    names = ndjson_fieldnames(file)
+    file.seek(0)
+    encoding = csv_reader.detect_encoding(file.read(csv_reader.SAMPLE_SIZE))
+    size = file.size
+    starts = [0] + csv_reader.record_boundaries(file, [size * i // parts for i in range(1, parts)], quoted=False)
+    ends = starts[1:] + [size]
+    ranges = [(start, end) for start, end in zip(starts, ends) if end > start]
+    return csv_reader.Plan(encoding, "", names, ranges)
+
+
+def range_reader(file, file_format, start, end, fieldnames, encoding, delimiter):
+    if file_format == "ndjson":
+        return NdjsonReader(csv_reader.LineReader(file, encoding, start, end), fieldnames)
+    return csv_reader.range_reader(file, start, end, fieldnames, encoding, delimiter)
@@ -0,0 +1,741 @@
+"""
+Import of CSV rows into the entries of a table.
+
+Rows are converted into entry data as they are read and written in chunks
+of ``CSV_IMPORT_CHUNK_SIZE`` rows, one transaction per chunk: new entries
+with a single bulk insert, and the chunk's enum values, typed projections,
+search vectors and entries count with one statement each. A failed chunk
+is rolled back and its rows reported as errors, the chunks before it stay
+imported.
+
+XLSX and NDJSON uploads are read through ``import_sources`` and go through
+the same mapping and chunks.
+
+Imports run as ``tasks.run_csv_import`` jobs started by ``start``, which
+record their progress on the CsvImport after every chunk. Files of at least
+``CSV_IMPORT_PARALLEL_MIN_BYTES`` are split in ``CSV_IMPORT_WORKERS`` byte
+ranges of whole records, imported by a chord of ``run_csv_import_part``
+tasks whose counts and errors are merged by ``finish_csv_import``.
+
+Rows of tables with unique columns are upserted on their unique key with
+one ``INSERT ... ON CONFLICT`` per chunk. When only the CSV mapping marks
+columns as unique, the keys of the existing entries are computed once per
+import and matched rows are bulk updated.
+
+Parts of a parallel import can hold rows with the same unique key. Each
+part claims the keys of its chunk in CsvImportKey with the position of its
+rows in the file, and only writes the rows still holding the last position
+of their key, so the last row of the file wins as in a sequential import.
+Imports matching on mapping-only unique fields are not split.
+
+The field mapping is compiled once per import into a tuple of converters,
+so converting a row is a loop over plain callables. Dates already in ISO
+format skip strptime and converted date strings are remembered, since
+most files repeat the same dates.
+
+Rows that fail are written to CsvImportError after every chunk, the
+CsvImport only keeps the first ``ERRORS_SAMPLE_SIZE`` of them inline.
+
+Every part of an import, a single one for most files, has a
+CsvImportCheckpoint moved to the byte offset after the last row read in
+the transaction of each chunk, along with the chunk's errors and counts.
+``resume`` continues a failed or stalled import from its checkpoints, so
+a crash only costs the chunk that was being written.
+
+A stalled task may still be alive when its import is resumed. Every run
+of an import bumps ``CsvImport.run`` and each part task takes over its
+checkpoint for that run. A chunk only commits while its checkpoint still
+belongs to the run that wrote it, so the task of an earlier run rolls
+back its chunk and stops, and ``finish`` ignores the results of earlier
+runs.
+"""
+
+from datetime import date, datetime, timedelta
+from functools import partial
+
+from celery import chord
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, Q, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from psycopg2.extras import Json
+
+from api import enums, models, projections, search, unique_keys, utils
+
+REQUIRED_ERROR = "Acest câmp este obligatoriu"
+ERRORS_SAMPLE_SIZE = 20
+RESUME_STALLED_AFTER = timedelta(minutes=10)
+ISO_DATE = "%Y-%m-%d"
+DATE_MEMO_SIZE = 10000
+SUPERSEDED_ERROR = "The import was resumed by another run"
+# column of the exported error rows holding their errors
+ERRORS_COLUMN = "_errors"
+
+
+class Superseded(Exception):
+    """
+    The checkpoint of an importer was taken over by a later run.
+    """
+
+
+def dumps(value):
+    return DjangoJSONEncoder().encode(value)
+
+
+def parse_date(value, field_format):
+    if field_format == ISO_DATE and len(value) == 10 and value[4] == "-" and value[7] == "-":
+        try:
+            return date.fromisoformat(value).isoformat()
+        except ValueError:
+            pass
+    return datetime.strptime(value, field_format).strftime(ISO_DATE)
+
+
+def date_converter(field_format):
+    """
+    Return a function converting dates in ``field_format`` to ISO dates,
+    remembering up to DATE_MEMO_SIZE converted values.
+    """
+    memo = {}
+
+    def convert(value):
+        result = memo.get(value)
+        if result is None:
+            result = parse_date(value, field_format)
+            if len(memo) < DATE_MEMO_SIZE:
+                memo[value] = result
+        return result
+
+    return convert
+
+
+class CsvImporter:
+    """
+    Import the rows of a csv.DictReader into a table. ``progress`` is
+    called with the importer after every chunk.
+
+    With a ``checkpoint``, the importer continues from its counts, writes
+    the failed rows as errors of its import and moves it forward with every
+    chunk. Otherwise the failed rows are kept in ``errors``. ``parallel``
+    is set for the parts of a split file, which claim their unique keys.
+    """
+
+    def __init__(self, table, csv_import=None, chunk_size=None, progress=None, checkpoint=None, parallel=False):
+        self.table = table
+        self.csv_import = csv_import
+        self.chunk_size = chunk_size or settings.CSV_IMPORT_CHUNK_SIZE
+        self.progress = progress
+        self.checkpoint = checkpoint
+        self.parallel = parallel
+        self.reader = None
+
+        if csv_import:
+            self.field_mapping = {
+                x.original_name: x
+                for x in csv_import.csv_field_mapping.exclude(table_column=None).select_related("table_column")
+            }
+        else:
+            self.field_mapping = {x.original_name: x for x in table.csv_field_mapping.all()}
+        self.table_fields = {x.name: x for x in table.fields.all()}
+        # column name -> csv column of the unique fields of the mapping
+        self.unique_fields = {
+            field_map.table_column.name: field_map.original_name
+            for field_map in self.field_mapping.values()
+            if field_map.unique and field_map.table_column
+        }
+        # with unique table columns, rows are matched on the stored unique key
+        self.unique_columns = unique_keys.unique_columns(table, self.table_fields.values())
+        self.enum_dictionary = enums.EnumDictionary(table, self.table_fields.values())
+        # unique key -> entry id of the existing entries, when only the
+        # mapping has unique fields
+        self.mapping_keys = None
+        self.converters = self.compile_converters()
+
+        self.errors = []
+        self.pending_errors = []
+        self.errors_count = checkpoint.errors_count if checkpoint else 0
+        self.created = checkpoint.created if checkpoint else 0
+        self.updated = checkpoint.updated if checkpoint else 0
+        self.rows = checkpoint.rows if checkpoint else 0
+
+    def run(self, reader):
+        self.reader = reader
+        chunk = []
+        for row in reader:
+            self.rows += 1
+            # rows the reader could not parse, e.g. NDJSON lines that are not objects
+            source_error = getattr(row, "error", None)
+            if source_error:
+                self.add_error(row, {"": source_error})
+                continue
+            try:
+                data, row_errors = self.convert(row)
+            except Exception:
+                self.errors_count += 1
+                continue
+            if row_errors:
+                self.add_error(row, row_errors)
+                continue
+            chunk.append((self.rows, row, data))
+            if len(chunk) >= self.chunk_size:
+                self.flush(chunk)
+                chunk = []
+        self.flush(chunk)
+        return self.errors, self.errors_count, self.created, self.updated
+
+    @property
+    def part(self):
+        return self.checkpoint.part if self.checkpoint else 0
+
+    def position(self, row_number):
+        """
+        Position of a row in the file, ordered across the parts.
+        """
+        return (self.part << 32) + row_number
+
+    @property
+    def splittable(self):
+        return not self.unique_fields or bool(self.unique_columns)
+
+    def add_error(self, row, row_errors, row_number=None):
+        self.errors_count += 1
+        if not self.checkpoint:
+            self.errors.append({"row": row, "errors": row_errors})
+            return
+        if len(self.errors) < ERRORS_SAMPLE_SIZE:
+            self.errors.append({"row": row, "errors": row_errors})
+        self.pending_errors.append(
+            models.CsvImportError(
+                csv_import_id=self.checkpoint.csv_import_id,
+                part=self.part,
+                row_number=row_number or self.rows,
+                row=row,
+                errors=row_errors,
+            )
+        )
+
+    def column(self, field_map):
+        """
+        Return the name and type of the column a CSV column is imported to.
+        """
+        if self.csv_import:
+            return field_map.table_column.name, field_map.table_column.field_type
+        return utils.snake_case(field_map.display_name), field_map.field_type
+
+    def compile_converters(self):
+        """
+        Return a (csv column, column name, converter, required) tuple per
+        mapped CSV column. A converter of None keeps the text value.
+        """
+        converters = []
+        for key, field_map in self.field_mapping.items():
+            field_name, field_type = self.column(field_map)
+            column = self.table_fields.get(field_name)
+            required = bool((column and column.required) or field_map.required)
+            if field_type == "int":
+                converter = int
+            elif field_type == "float":
+                converter = float
+            elif field_type == "date":
+                converter = date_converter(field_map.field_format)
+            elif field_type == "enum" and field_name in self.enum_dictionary.columns:
+                converter = partial(self.add_enum, field_name)
+            else:
+                converter = None
+            converters.append((key, field_name, converter, required))
+        return tuple(converters)
+
+    def add_enum(self, name, value):
+        enums.check_length(value)
+        self.enum_dictionary.add(name, value)
+        return value
+
+    def convert(self, row):
+        """
+        Convert a CSV row into entry data. Returns the data and the errors
+        of the row, keyed by CSV column.
+        """
+        data = {}
+        row_errors = {}
+        for key, field_name, converter, required in self.converters:
+            try:
+                value = row[key]
+                if not value:
+                    if required:
+                        row_errors[key] = REQUIRED_ERROR
+                    data[field_name] = None
+                elif converter is None:
+                    data[field_name] = value
+                else:
+                    data[field_name] = converter(value)
+            except enums.ValueTooLong as e:
+                row_errors[key] = str(e)
+            except Exception as e:
+                row_errors[key] = e.__class__.__name__
+        return data, row_errors
+
+    def flush(self, chunk):
+        created = updated = 0
+        try:
+            with transaction.atomic():
+                if chunk:
+                    entries, created, updated = self.write(chunk)
+                    self.enum_dictionary.flush()
+                    projections.sync_entries(self.table, entries, self.table_fields.values())
+                    search.sync_entries(self.table, entries, self.table_fields.values())
+                    if entries:
+                        self.table.bump_revision(entries_delta=created)
+                self.save_checkpoint(created, updated)
+        except Superseded:
+            raise
+        except Exception as e:
+            if not chunk:
+                raise
+            row_errors = {"": e.__class__.__name__}
+            if isinstance(e, IntegrityError) and self.unique_columns:
+                # the unique key was taken by a concurrent writer
+                row_errors = {name: unique_keys.error_message(self.unique_columns) for name in self.unique_columns}
+            for row_number, row, data in chunk:
+                self.add_error(row, row_errors, row_number)
+            # codes and keys registered by the rolled back chunk are gone
+            self.enum_dictionary = enums.EnumDictionary(self.table, self.table_fields.values())
+            self.mapping_keys = None
+            created = updated = 0
+            with transaction.atomic():
+                self.save_checkpoint(created, updated)
+        self.created += created
+        self.updated += updated
+        self.pending_errors = []
+        if self.progress:
+            self.progress(self)
+
+    def save_checkpoint(self, created, updated):
+        """
+        Write the pending errors and move the checkpoint past the rows read,
+        in the transaction of the chunk. Raises Superseded, rolling back the
+        chunk, when a later run took the checkpoint over.
+        """
+        if not self.checkpoint:
+            return
+        moved = models.CsvImportCheckpoint.objects.filter(pk=self.checkpoint.pk, run=self.checkpoint.run).update(
+            offset=self.reader.offset,
+            rows=self.rows,
+            errors_count=self.errors_count,
+            created=self.created + created,
+            updated=self.updated + updated,
+        )
+        if not moved:
+            raise Superseded()
+        models.CsvImportError.objects.bulk_create(self.pending_errors, batch_size=self.chunk_size)
+        self.checkpoint.offset = self.reader.offset
+        self.checkpoint.rows = self.rows
+        self.checkpoint.errors_count = self.errors_count
+        self.checkpoint.created = self.created + created
+        self.checkpoint.updated = self.updated + updated
+
+    def write(self, chunk):
+        """
+        Write the entries of a chunk. Returns the written entries and the
+        created and updated counts.
+        """
+        if self.unique_columns:
+            return self.upsert(chunk)
+        if self.unique_fields:
+            return self.match_mapping_keys(chunk)
+        entries = models.Entry.objects.bulk_create(
+            [models.Entry(table=self.table, data=data) for row_number, row, data in chunk], batch_size=self.chunk_size
+        )
+        return entries, len(entries), 0
+
+    def upsert(self, chunk):
+        entries = []
+        keyed = {}
+        duplicates = 0
+        for row_number, row, data in chunk:
+            unique_key = unique_keys.compute(data, self.unique_columns)
+            if not unique_key:
+                entries.append(models.Entry(table=self.table, data=data))
+            elif unique_key in keyed:
+                # a later row of the file updates the earlier one
+                keyed[unique_key] = (self.position(row_number), data)
+                duplicates += 1
+            else:
+                keyed[unique_key] = (self.position(row_number), data)
+        entries = models.Entry.objects.bulk_create(entries, batch_size=self.chunk_size)
+        created = len(entries)
+        updated = duplicates
+        keys = sorted(keyed)
+        if self.parallel and keys:
+            owned = self.claim_keys(keys, [keyed[key][0] for key in keys])
+            # rows of keys claimed by a later row of another part are
+            # updates overwritten by that row
+            updated += len(keys) - len(owned)
+            keys = [key for key in keys if key in owned]
+        if not keys:
+            return entries, created, updated
+
+        # keys already stored are updates; partitioned tables can not
+        # return xmax, so they are looked up first in the chunk transaction
+        existing = set(self.table.entries.filter(unique_key__in=keys).values_list("unique_key", flat=True))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO {entries} (table_id, data, date_created, unique_key)
+                SELECT %s, chunk.data, now(), chunk.unique_key
+                FROM unnest(%s::jsonb[], %s::varchar[]) AS chunk (data, unique_key)
+                ORDER BY chunk.unique_key
+                ON CONFLICT (table_id, unique_key) DO UPDATE SET data = EXCLUDED.data
+                RETURNING id, unique_key
+                """.format(entries=connection.ops.quote_name(models.Entry._meta.db_table)),
+                [self.table.pk, [Json(keyed[key][1], dumps=dumps) for key in keys], keys],
+            )
+            for entry_id, unique_key in cursor.fetchall():
+                entries.append(
+                    models.Entry(pk=entry_id, table=self.table, data=keyed[unique_key][1], unique_key=unique_key)
+                )
+                if unique_key in existing:
+                    updated += 1
+                else:
+                    created += 1
+        return entries, created, updated
+
+    def claim_keys(self, keys, positions):
+        """
+        Record the positions of the rows of sorted unique keys, keeping the
+        last one of every key. Returns the keys whose last row is ours. The
+        claimed keys stay locked until the chunk commits, so the owner of a
+        key always writes after the rows it took the key from.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO {keys} AS claimed (csv_import_id, unique_key, position)
+                SELECT %s, chunk.unique_key, chunk.position
+                FROM unnest(%s::varchar[], %s::bigint[]) AS chunk (unique_key, position)
+                ORDER BY chunk.unique_key
+                ON CONFLICT (csv_import_id, unique_key)
+                DO UPDATE SET position = GREATEST(claimed.position, EXCLUDED.position)
+                RETURNING unique_key, position
+                """.format(keys=connection.ops.quote_name(models.CsvImportKey._meta.db_table)),
+                [self.checkpoint.csv_import_id, keys, positions],
+            )
+            claimed = dict(cursor.fetchall())
+        return {key for key, position in zip(keys, positions) if claimed[key] == position}
+
+    def load_mapping_keys(self):
+        names = list(self.unique_fields)
+        self.mapping_keys = {}
+        for entry_id, data in self.table.entries.values_list("id", "data").iterator(
+            chunk_size=unique_keys.REBUILD_BATCH_SIZE
+        ):
+            key = unique_keys.compute(data, names)
+            if key is not None:
+                self.mapping_keys.setdefault(key, entry_id)
+
+    def match_mapping_keys(self, chunk):
+        if self.mapping_keys is None:
+            self.load_mapping_keys()
+        names = list(self.unique_fields)
+        new_entries = []
+        # entries created by this chunk and existing entries matched by it
+        created_keys = {}
+        matched = {}
+        updated = 0
+        for row_number, row, data in chunk:
+            key = unique_keys.compute(data, names)
+            if key is None:
+                new_entries.append(models.Entry(table=self.table, data=data))
+            elif key in created_keys:
+                created_keys[key].data = data
+                updated += 1
+            elif key in self.mapping_keys:
+                matched[key] = models.Entry(pk=self.mapping_keys[key], table=self.table, data=data)
+                updated += 1
+            else:
+                created_keys[key] = models.Entry(table=self.table, data=data)
+                new_entries.append(created_keys[key])
+
+        new_entries = models.Entry.objects.bulk_create(new_entries, batch_size=self.chunk_size)
+        for key, entry in created_keys.items():
+            self.mapping_keys[key] = entry.pk
+        models.Entry.objects.bulk_update(list(matched.values()), ["data"], batch_size=self.chunk_size)
+        return new_entries + list(matched.values()), len(new_entries), updated
+
+
+def error_export(csv_import):
+    """
+    Return the header and the rows of the errors of an import: the columns
+    of the file, then the errors of each row.
+    """
+    from api import import_sources
+
+    checkpoint = csv_import.checkpoints.first()
+    if checkpoint:
+        fieldnames = list(checkpoint.fieldnames)
+    else:
+        fieldnames = list(csv_import.csv_field_mapping.values_list("original_name", flat=True))
+    if csv_import.file_format == "ndjson":
+        fieldnames.append(import_sources.INVALID_LINE)
+    fieldnames.append(ERRORS_COLUMN)
+
+    def rows():
+        error_rows = csv_import.error_rows.order_by("part", "row_number").values_list("row", "errors")
+        for row, errors in error_rows.iterator(chunk_size=settings.CSV_IMPORT_CHUNK_SIZE):
+            yield dict(
+                row,
+                **{
+                    ERRORS_COLUMN: "; ".join(
+                        "{}: {}".format(key, error) if key else str(error) for key, error in errors.items()
+                    )
+                },
+            )
+
+    return fieldnames, rows()
+
+
+def start(csv_import, table, use_table_mapping=False):
+    """
+    Queue the import of an uploaded file into a table once the current
+    transaction commits. ``use_table_mapping`` imports with the field
+    mapping of the table instead of the one of the upload.
+    """
+    from api import tasks
+
+    csv_import.error_rows.all().delete()
+    csv_import.checkpoints.all().delete()
+    csv_import.keys.all().delete()
+    csv_import.table = table
+    csv_import.use_table_mapping = use_table_mapping
+    csv_import.status = "queued"
+    csv_import.error = None
+    csv_import.errors = []
+    csv_import.errors_count = 0
+    csv_import.import_count_created = 0
+    csv_import.import_count_updated = 0
+    csv_import.rows_processed = 0
+    csv_import.bytes_read = 0
+    csv_import.bytes_total = csv_import.file.size
+    csv_import.date_started = None
+    csv_import.date_updated = None
+    csv_import.date_finished = None
+    csv_import.parts_total = 0
+    csv_import.parts_done = 0
+    csv_import.save()
+
+    csv_import_id = csv_import.pk
+    transaction.on_commit(lambda: tasks.run_csv_import.delay(csv_import_id))
+
+
+def resume(csv_import):
+    """
+    Queue a failed import, or one whose tasks stopped reporting progress,
+    to continue from its checkpoints. Returns False when the import cannot
+    be resumed.
+    """
+    from api import tasks
+
+    stalled = Q(status="running", date_updated__lt=timezone.now() - RESUME_STALLED_AFTER)
+    queued = (
+        models.CsvImport.objects.filter(Q(status="failed") | stalled, pk=csv_import.pk)
+        .exclude(table=None)
+        .update(status="queued", error=None, date_finished=None)
+    )
+    if not queued:
+        return False
+    csv_import.refresh_from_db()
+
+    csv_import_id = csv_import.pk
+    transaction.on_commit(lambda: tasks.run_csv_import.delay(csv_import_id))
+    return True
+
+
+def counts(checkpoint):
+    return {
+        "rows_processed": checkpoint.rows,
+        "bytes_read": checkpoint.offset - checkpoint.start,
+        "errors_count": checkpoint.errors_count,
+        "import_count_created": checkpoint.created,
+        "import_count_updated": checkpoint.updated,
+    }
+
+
+def merge_counts(checkpoints):
+    merged = dict.fromkeys(
+        ["rows_processed", "bytes_read", "errors_count", "import_count_created", "import_count_updated"], 0
+    )
+    for checkpoint in checkpoints:
+        for name, value in counts(checkpoint).items():
+            merged[name] += value
+    return merged
+
+
+def create_checkpoints(csv_import, importer):
+    """
+    Split the file of an import in the ranges read by its tasks: several
+    for large files whose import can be split, a single one otherwise.
+    XLSX files are converted to CSV first.
+    """
+    from api import import_sources
+
+    if csv_import.file_format == "xlsx":
+        import_sources.xlsx_to_csv(csv_import)
+    parts = 1
+    if (
+        importer.splittable
+        and settings.CSV_IMPORT_WORKERS > 1
+        and csv_import.file.size >= settings.CSV_IMPORT_PARALLEL_MIN_BYTES
+    ):
+        parts = settings.CSV_IMPORT_WORKERS
+    plan = import_sources.plan(csv_import.file, csv_import.file_format, parts, csv_import.delimiter)
+    return models.CsvImportCheckpoint.objects.bulk_create(
+        [
+            models.CsvImportCheckpoint(
+                csv_import=csv_import,
+                part=part,
+                encoding=plan.encoding,
+                delimiter=plan.delimiter,
+                fieldnames=plan.fieldnames,
+                start=start,
+                end=end,
+                offset=start,
+            )
+            for part, (start, end) in enumerate(plan.ranges)
+        ]
+    )
+
+
+def run(csv_import_id):
+    """
+    Run a queued import, from its checkpoints when it is resumed. Files
+    split in several parts are handed over to parallel part tasks.
+    """
+    from api import tasks
+
+    now = timezone.now()
+    claimed = models.CsvImport.objects.filter(pk=csv_import_id, status="queued").update(
+        status="running", run=F("run") + 1, date_started=Coalesce("date_started", Value(now)), date_updated=now
+    )
+    if not claimed:
+        return
+    csv_import = models.CsvImport.objects.select_related("table").get(pk=csv_import_id)
+    imports = models.CsvImport.objects.filter(pk=csv_import_id, run=csv_import.run)
+
+    try:
+        checkpoints = list(csv_import.checkpoints.all())
+        if not checkpoints:
+            importer = CsvImporter(csv_import.table, None if csv_import.use_table_mapping else csv_import)
+            checkpoints = create_checkpoints(csv_import, importer)
+    except Exception as e:
+        now = timezone.now()
+        imports.update(status="failed", error=str(e), date_updated=now, date_finished=now)
+        return
+
+    pending = [checkpoint for checkpoint in checkpoints if not checkpoint.done]
+    imports.update(
+        parts_total=len(checkpoints) if len(checkpoints) > 1 else 0,
+        parts_done=len(checkpoints) - len(pending),
+        **merge_counts(checkpoints),
+    )
+
+    if len(checkpoints) > 1 and pending:
+        chord(tasks.run_csv_import_part.si(checkpoint.pk, csv_import.run) for checkpoint in pending)(
+            tasks.finish_csv_import.s(csv_import_id, csv_import.run)
+        )
+        return
+    results = [run_part(checkpoint.pk, csv_import.run) for checkpoint in pending]
+    finish(results, csv_import_id, csv_import.run)
+
+
+def run_part(checkpoint_id, run=0):
+    """
+    Import the rest of the byte range of a checkpoint for a run of its
+    import, adding its progress to the CsvImport. Returns the error that
+    stopped it, if any.
+    """
+    from api import import_sources
+
+    # the task of an earlier run still reading the range stops at its next chunk
+    claimed = models.CsvImportCheckpoint.objects.filter(pk=checkpoint_id, run__lte=run).update(run=run)
+    if not claimed:
+        return {"error": SUPERSEDED_ERROR}
+    checkpoint = models.CsvImportCheckpoint.objects.select_related("csv_import", "csv_import__table").get(
+        pk=checkpoint_id
+    )
+    csv_import = checkpoint.csv_import
+    imports = models.CsvImport.objects.filter(pk=csv_import.pk, run=run)
+    reported = counts(checkpoint)
+
+    def progress(importer):
+        current = counts(checkpoint)
+        imports.update(
+            date_updated=timezone.now(), **{name: F(name) + value - reported[name] for name, value in current.items()}
+        )
+        reported.update(current)
+
+    try:
+        reader = import_sources.range_reader(
+            csv_import.file,
+            csv_import.file_format,
+            checkpoint.offset,
+            checkpoint.end,
+            checkpoint.fieldnames,
+            checkpoint.encoding,
+            checkpoint.delimiter,
+        )
+        importer = CsvImporter(
+            csv_import.table,
+            None if csv_import.use_table_mapping else csv_import,
+            progress=progress,
+            checkpoint=checkpoint,
+            parallel=csv_import.checkpoints.count() > 1,
+        )
+        importer.run(reader)
+    except Superseded:
+        return {"error": SUPERSEDED_ERROR}
+    except Exception as e:
+        # the chunks committed before the failure are resumed from
+        return {"error": str(e)}
+
+    imports.update(parts_done=F("parts_done") + 1, date_updated=timezone.now())
+    return {}
+
+
+def finish(results, csv_import_id, run=0):
+    """
+    Merge the counts of the checkpoints of an import once the tasks of a
+    run are done, and number its errors in file order. The results of a
+    run that was superseded by a later one are ignored.
+    """
+    imports = models.CsvImport.objects.filter(pk=csv_import_id, run=run, status="running")
+    if not imports.exists():
+        return
+    failed = [result["error"] for result in results if "error" in result]
+    checkpoints = list(models.CsvImportCheckpoint.objects.filter(csv_import_id=csv_import_id))
+    error_rows = models.CsvImportError.objects.filter(csv_import_id=csv_import_id)
+
+    if not failed:
+        # number the errors of every part after the rows of the parts before it
+        offset = 0
+        for checkpoint in checkpoints:
+            if checkpoint.part and offset:
+                error_rows.filter(part=checkpoint.part).update(part=0, row_number=F("row_number") + offset)
+            offset += checkpoint.rows
+        # the keys claimed by the parts are kept for resuming a failed import
+        models.CsvImportKey.objects.filter(csv_import_id=csv_import_id).delete()
+
+    now = timezone.now()
+    imports.update(
+        status="failed" if failed else "done",
+        error="\n".join(failed) or None,
+        errors=[
+            {"row": row, "errors": errors}
+            for row, errors in error_rows.order_by("part", "row_number").values_list("row", "errors")[
+                :ERRORS_SAMPLE_SIZE
+            ]
+        ],
+        date_updated=now,
+        date_finished=now,
+        **merge_counts(checkpoints),
+    )
@@ -0,0 +1,171 @@
+"""
+Partial expression indexes on Entry.data, one per table column that is used
+to filter, sort, join or enforce uniqueness.
+
+All entries share the api_entry table, so every index is scoped to a single
+table with a ``WHERE table_id = N`` predicate. The indexed expression is the
+one the ORM emits for ``data__<column>`` lookups and orderings
+(``data -> 'column'``), so the planner can use the index for the queries
+built by ``utils.request_get_to_filter`` and the entries views.
+
+That expression serves the exact, range and ordering lookups of number,
+date and text values, which compare jsonb. Substring lookups such as
+``data__<column>__icontains`` compare ``UPPER((data ->> 'column')::text)``
+instead, so text and enum columns filtered that way, or whose values are
+looked up by prefix or similarity (see ``api.column_values``), get a
+pg_trgm GIN index on ``UPPER(data ->> 'column')``, the same expression.
+
+Once api_entry is partitioned (see ``api.partitions``) the index is built on
+the partition of the table instead and needs no predicate.
+"""
+
+from django.db import connection, transaction
+
+from api import models, partitions
+
+INDEX_DEFINITIONS = {
+    "btree": "CREATE INDEX CONCURRENTLY {name} ON {relation} USING btree ((data -> %s))",
+    "trigram": "CREATE INDEX CONCURRENTLY {name} ON {relation} USING gin (upper(data ->> %s) gin_trgm_ops)",
+}
+TABLE_PREDICATE = " WHERE table_id = %s"
+TRIGRAM_TYPES = ("text", "enum")
+# lookups of request_get_to_filter served by the trigram index
+TRIGRAM_LOOKUPS = ("icontains", "istartswith", "iendswith")
+
+
+def index_name(column, kind):
+    return "api_entry_t{}_c{}_{}".format(column.table_id, column.pk, kind)
+
+
+def column_needs_index(column):
+    if column.indexed or column.unique:
+        return True
+    return models.FilterJoinTable.objects.filter(join_field=column).exists()
+
+
+def sync_column_indexes(column_id):
+    """
+    Bring the indexes of a column in line with how the column is used.
+    Builds and drops run in the task queue.
+    """
+    from api import tasks
+
+    column = models.TableColumn.objects.filter(pk=column_id).first()
+    if not column:
+        return
+
+    if column.field_type not in TRIGRAM_TYPES:
+        for index in column.indexes.filter(kind="trigram"):
+            index.delete()
+    else:
+        for index in column.indexes.filter(kind="trigram").exclude(key=column.name):
+            rekey_index(index, column.name)
+
+    if not column_needs_index(column):
+        for index in column.indexes.filter(kind="btree"):
+            index.delete()
+        return
+
+    index, created = models.ColumnIndex.objects.get_or_create(
+        table_column=column,
+        kind="btree",
+        defaults={"name": index_name(column, "btree"), "key": column.name},
+    )
+    if not created:
+        if index.key != column.name:
+            rekey_index(index, column.name)
+        return
+
+    index_id = index.pk
+    transaction.on_commit(lambda: tasks.build_column_index.delay(index_id))
+
+
+def rekey_index(index, key):
+    """
+    Rebuild the index of a renamed column on the new key.
+    """
+    from api import tasks
+
+    index.key = key
+    index.status = "pending"
+    index.error = None
+    index.save()
+    index_id = index.pk
+    transaction.on_commit(lambda: tasks.build_column_index.delay(index_id))
+
+
+def track_usage(columns, substring_columns=()):
+    """
+    Flag columns that were used to filter or sort so they get an index, and
+    give the ``substring_columns`` filtered by substring a trigram index.
+    This runs on read requests, so a column is only written once, with an
+    UPDATE that fires no signals, and its index sync is queued here.
+    """
+    for column in columns:
+        if column.indexed:
+            continue
+        if models.TableColumn.objects.filter(pk=column.pk, indexed=False).update(indexed=True):
+            transaction.on_commit(lambda column_id=column.pk: sync_column_indexes(column_id))
+        column.indexed = True
+    for column in substring_columns:
+        track_value_lookups(column)
+
+
+def track_value_lookups(column):
+    """
+    Give a text or enum column whose values are looked up by prefix or
+    similarity a trigram index.
+    """
+    from api import tasks
+
+    if column.field_type not in TRIGRAM_TYPES:
+        return
+    index, created = models.ColumnIndex.objects.get_or_create(
+        table_column=column,
+        kind="trigram",
+        defaults={"name": index_name(column, "trigram"), "key": column.name},
+    )
+    if created:
+        index_id = index.pk
+        transaction.on_commit(lambda: tasks.build_column_index.delay(index_id))
+
+
+def build_index(column_index_id):
+    index = models.ColumnIndex.objects.select_related("table_column").filter(pk=column_index_id).first()
+    if not index:
+        return
+
+    models.ColumnIndex.objects.filter(pk=index.pk).update(status="building", error=None)
+    table_id = index.table_column.table_id
+    quoted_name = connection.ops.quote_name(index.name)
+    statement = INDEX_DEFINITIONS[index.kind]
+    params = [index.key]
+    if partitions.is_partitioned() and partitions.partition_exists(table_id):
+        relation = partitions.partition_name(table_id)
+    else:
+        # shared heap, or rows still waiting in the default partition
+        relation = partitions.DEFAULT_PARTITION if partitions.is_partitioned() else models.Entry._meta.db_table
+        statement += TABLE_PREDICATE
+        params.append(table_id)
+    try:
+        with connection.cursor() as cursor:
+            # CONCURRENTLY can not run inside a transaction block, so this
+            # relies on the task running in autocommit mode
+            cursor.execute("DROP INDEX CONCURRENTLY IF EXISTS {}".format(quoted_name))
+            cursor.execute(
+                statement.format(name=quoted_name, relation=connection.ops.quote_name(relation)),
+                params,
+            )
+    except Exception as e:
+        # a failed concurrent build leaves an invalid index behind
+        with connection.cursor() as cursor:
+            cursor.execute("DROP INDEX CONCURRENTLY IF EXISTS {}".format(quoted_name))
+        models.ColumnIndex.objects.filter(pk=index.pk).update(status="failed", error=str(e))
+        return
+
+    models.ColumnIndex.objects.filter(pk=index.pk).update(status="ready")
+
+
+def drop_index(name):
+    with connection.cursor() as cursor:
+        cursor.execute("DROP INDEX CONCURRENTLY IF EXISTS {}".format(connection.ops.quote_name(name)))
@@ -0,0 +1,87 @@
+import time
+from datetime import date, datetime, timedelta
+
+from django.core.management.base import BaseCommand
+
+from api import imports, models
+
+
+def legacy_convert(importer, row):
+    """
+    Row conversion as it was before the converters were compiled, branching
+    on the field type of every cell.
+    """
+    data = {}
+    row_errors = {}
+    for key, field_map in importer.field_mapping.items():
+        field_name, field_type = importer.column(field_map)
+        try:
+            value = row[key]
+            if not value:
+                column = importer.table_fields.get(field_name)
+                if (column and column.required) or field_map.required:
+                    row_errors[key] = imports.REQUIRED_ERROR
+                data[field_name] = None
+            elif field_type == "int":
+                data[field_name] = int(value)
+            elif field_type == "float":
+                data[field_name] = float(value)
+            elif field_type == "date":
+                data[field_name] = datetime.strptime(value, field_map.field_format).strftime("%Y-%m-%d")
+            elif field_type == "enum":
+                importer.enum_dictionary.add(field_name, value)
+                data[field_name] = value
+            else:
+                data[field_name] = value
+        except Exception as e:
+            row_errors[key] = e.__class__.__name__
+    return data, row_errors
+
+
+def sample_value(importer, field_map, i):
+    field_name, field_type = importer.column(field_map)
+    if field_type == "int":
+        return str(i)
+    if field_type == "float":
+        return "{}.5".format(i)
+    if field_type == "date":
+        return (date(2020, 1, 1) + timedelta(days=i % 1000)).strftime(field_map.field_format or imports.ISO_DATE)
+    if field_type == "enum":
+        column = importer.table_fields.get(field_name)
+        choices = (column.choices if column else None) or ["a", "b", "c"]
+        return choices[i % len(choices)]
+    return "text {}".format(i)
+
+
+class Command(BaseCommand):
+    help = "Time the conversion of generated rows with the CSV field mapping of a table, without writing them"
+
+    def add_arguments(self, parser):
+        parser.add_argument("table_id", type=int)
+        parser.add_argument("--rows", type=int, default=100000)
+        parser.add_argument("--repeat", type=int, default=3)
+
+    def handle(self, *args, **options):
+        table = models.Table.objects.get(pk=options["table_id"])
+        importer = imports.CsvImporter(table)
+        if not importer.field_mapping:
+            print("Table", table, "has no CSV field mapping")
+            return
+        rows = [
+            {key: sample_value(importer, field_map, i) for key, field_map in importer.field_mapping.items()}
+            for i in range(options["rows"])
+        ]
+
+        timings = {}
+        for name, convert in [("legacy", lambda row: legacy_convert(importer, row)), ("compiled", importer.convert)]:
+            best = None
+            for _ in range(options["repeat"]):
+                started = time.perf_counter()
+                for row in rows:
+                    convert(row)
+                elapsed = time.perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+            timings[name] = best
+            print("{:<10} {:>8.3f}s {:>12.0f} rows/s".format(name, best, len(rows) / best))
+
+        print("speedup    {:.2f}x".format(timings["legacy"] / timings["compiled"]))
@@ -0,0 +1,207 @@
+import re
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from api import models, partitions, tasks
+
+NEW_TABLE = "api_entry_partitioned"
+OLD_TABLE = "api_entry_unpartitioned"
+MIRROR_FUNCTION = "api_entry_mirror"
+UNIQUE_KEY_CONSTRAINT = "api_entry_unique_key"
+# start of the definitions returned by pg_get_indexdef
+INDEX_TARGET = re.compile(r"^CREATE INDEX \S+ ON (ONLY )?\S+ ")
+
+
+def new_name(name):
+    return "{}_new".format(name[:59])
+
+
+def old_name(name):
+    return "{}_old".format(name[:59])
+
+
+def entry_indexes(cursor, relation):
+    """
+    Names and definitions of the plain indexes of a relation: not the
+    primary key, the unique constraints or the per column indexes, which
+    are built on the partitions by the index tasks.
+    """
+    cursor.execute(
+        """
+        SELECT i.relname, pg_get_indexdef(i.oid)
+        FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid
+        WHERE x.indrelid = to_regclass(%s) AND NOT x.indisprimary AND NOT x.indisunique
+        ORDER BY i.relname
+        """,
+        [relation],
+    )
+    column_indexes = set(models.ColumnIndex.objects.values_list("name", flat=True))
+    return [(name, definition) for name, definition in cursor.fetchall() if name not in column_indexes]
+
+
+def constraint_name(cursor, relation, kind):
+    cursor.execute(
+        "SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(%s) AND contype = %s", [relation, kind]
+    )
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+class Command(BaseCommand):
+    help = "Move api_entry to a table list partitioned by table_id, copying the entries online in chunks"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=10000, help="Number of entry ids copied per transaction")
+        parser.add_argument(
+            "--keep-old", action="store_true", help="Keep the unpartitioned table as {}".format(OLD_TABLE)
+        )
+
+    def handle(self, *args, **options):
+        if partitions.is_partitioned():
+            print("api_entry is already partitioned")
+            return
+
+        self.prepare()
+        self.copy(options["chunk_size"])
+        self.swap()
+
+        if not options["keep_old"]:
+            with connection.cursor() as cursor:
+                cursor.execute("DROP TABLE {}".format(OLD_TABLE))
+
+        # the per column indexes lived on the old heap, build them on the partitions
+        for index in models.ColumnIndex.objects.all():
+            index.status = "pending"
+            index.save()
+            tasks.build_column_index.delay(index.pk)
+        print("done")
+
+    def prepare(self):
+        """
+        Create the partitioned table and mirror every write on api_entry
+        into it while the existing rows are copied.
+        """
+        entry_table = partitions.entry_table()
+        columns = [field.column for field in models.Entry._meta.concrete_fields]
+        updated_columns = ", ".join(
+            "{0} = EXCLUDED.{0}".format(connection.ops.quote_name(column))
+            for column in columns
+            if column not in ("id", "table_id")
+        )
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute("""
+                CREATE TABLE {new} (LIKE {old} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)
+                PARTITION BY LIST (table_id)
+                """.format(new=NEW_TABLE, old=entry_table))
+            cursor.execute("ALTER TABLE {new} ADD PRIMARY KEY (id, table_id)".format(new=NEW_TABLE))
+            # the same indexes as api_entry, renamed to their names in swap
+            for name, definition in entry_indexes(cursor, entry_table):
+                cursor.execute(
+                    INDEX_TARGET.sub(
+                        "CREATE INDEX {} ON {} ".format(connection.ops.quote_name(new_name(name)), NEW_TABLE),
+                        definition,
+                    )
+                )
+            cursor.execute(
+                "ALTER TABLE {new} ADD CONSTRAINT {new}_unique_key UNIQUE (table_id, unique_key)".format(new=NEW_TABLE)
+            )
+            cursor.execute("""
+                ALTER TABLE {new} ADD CONSTRAINT {new}_table_id_fk
+                FOREIGN KEY (table_id) REFERENCES {table} (id) DEFERRABLE INITIALLY DEFERRED
+                """.format(new=NEW_TABLE, table=models.Table._meta.db_table))
+            cursor.execute(
+                "CREATE TABLE {default} PARTITION OF {new} DEFAULT".format(
+                    default=partitions.DEFAULT_PARTITION, new=NEW_TABLE
+                )
+            )
+            for table_id in models.Table.objects.values_list("id", flat=True):
+                partitions.create_partition(table_id, NEW_TABLE)
+
+            cursor.execute("""
+                CREATE FUNCTION {function}() RETURNS trigger AS $$
+                BEGIN
+                    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                        DELETE FROM {new} WHERE id = OLD.id AND table_id = OLD.table_id;
+                    END IF;
+                    IF TG_OP = 'DELETE' THEN
+                        RETURN OLD;
+                    END IF;
+                    INSERT INTO {new} SELECT NEW.*
+                    ON CONFLICT (id, table_id) DO UPDATE SET {updated_columns};
+                    RETURN NEW;
+                END;
+                $$ LANGUAGE plpgsql
+                """.format(function=MIRROR_FUNCTION, new=NEW_TABLE, updated_columns=updated_columns))
+            cursor.execute("""
+                CREATE TRIGGER {function} AFTER INSERT OR UPDATE OR DELETE ON {old}
+                FOR EACH ROW EXECUTE PROCEDURE {function}()
+                """.format(function=MIRROR_FUNCTION, old=entry_table))
+
+    def copy(self, chunk_size):
+        entry_table = partitions.entry_table()
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT coalesce(max(id), 0) FROM {}".format(entry_table))
+            max_id = cursor.fetchone()[0]
+
+        # rows written from now on are mirrored by the trigger; locking the
+        # copied rows keeps a concurrent delete from racing the copy
+        for start in range(0, max_id + 1, chunk_size):
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(
+                    """
+                    INSERT INTO {new}
+                    SELECT * FROM {old} WHERE id >= %s AND id < %s FOR SHARE
+                    ON CONFLICT (id, table_id) DO NOTHING
+                    """.format(new=NEW_TABLE, old=entry_table),
+                    [start, start + chunk_size],
+                )
+            print("copied ids up to {} of {}".format(min(start + chunk_size - 1, max_id), max_id))
+
+    def swap(self):
+        entry_table = partitions.entry_table()
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute("LOCK TABLE {} IN ACCESS EXCLUSIVE MODE".format(entry_table))
+
+            # tables created while copying have their rows in the default partition
+            for table_id in models.Table.objects.values_list("id", flat=True):
+                partitions.ensure_partition(table_id, NEW_TABLE)
+
+            cursor.execute("DROP TRIGGER {function} ON {old}".format(function=MIRROR_FUNCTION, old=entry_table))
+            cursor.execute("DROP FUNCTION {}()".format(MIRROR_FUNCTION))
+
+            cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [entry_table])
+            sequence = cursor.fetchone()[0]
+            cursor.execute("ALTER TABLE {} RENAME TO {}".format(entry_table, OLD_TABLE))
+            cursor.execute("ALTER TABLE {} RENAME TO {}".format(NEW_TABLE, entry_table))
+
+            # keep the index and constraint names the migrations know about
+            quote = connection.ops.quote_name
+            for name, definition in entry_indexes(cursor, OLD_TABLE):
+                cursor.execute("ALTER INDEX {} RENAME TO {}".format(quote(name), quote(old_name(name))))
+                cursor.execute("ALTER INDEX {} RENAME TO {}".format(quote(new_name(name)), quote(name)))
+            cursor.execute(
+                "ALTER TABLE {old} RENAME CONSTRAINT {name} TO {old}_unique_key".format(
+                    old=OLD_TABLE, name=UNIQUE_KEY_CONSTRAINT
+                )
+            )
+            cursor.execute(
+                "ALTER TABLE {entry} RENAME CONSTRAINT {new}_unique_key TO {name}".format(
+                    entry=entry_table, new=NEW_TABLE, name=UNIQUE_KEY_CONSTRAINT
+                )
+            )
+            for kind in ("p", "f"):
+                name = constraint_name(cursor, OLD_TABLE, kind)
+                current = constraint_name(cursor, entry_table, kind)
+                if name and current:
+                    cursor.execute(
+                        "ALTER TABLE {} RENAME CONSTRAINT {} TO {}".format(
+                            OLD_TABLE, quote(name), quote(old_name(name))
+                        )
+                    )
+                    cursor.execute(
+                        "ALTER TABLE {} RENAME CONSTRAINT {} TO {}".format(entry_table, quote(current), quote(name))
+                    )
+            if sequence:
+                cursor.execute("ALTER SEQUENCE {} OWNED BY {}.id".format(sequence, entry_table))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from api import indexes, models, tasks
+
+
+class Command(BaseCommand):
+    help = "Create or drop the Entry.data indexes of every table column based on how it is used"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--retry-failed", action="store_true", help="Rebuild indexes whose last build failed")
+        parser.add_argument(
+            "--rebuild",
+            choices=[kind for kind, _ in models.index_kinds],
+            help="Rebuild every index of a kind, e.g. after its definition changed",
+        )
+
+    def handle(self, *args, **options):
+        for column in models.TableColumn.objects.all().order_by("id"):
+            indexes.sync_column_indexes(column.pk)
+
+        if options["retry_failed"]:
+            for index in models.ColumnIndex.objects.filter(status="failed"):
+                tasks.build_column_index.delay(index.pk)
+
+        if options["rebuild"]:
+            for index in models.ColumnIndex.objects.filter(kind=options["rebuild"]):
+                tasks.build_column_index.delay(index.pk)
+
+        for status, _ in models.index_statuses:
+            print(status, models.ColumnIndex.objects.filter(status=status).count())
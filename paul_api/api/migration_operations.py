@@ -0,0 +1,77 @@
+"""
+Migration operations for tables that may have been partitioned.
+
+``manage.py partition-entries`` turns api_entry into a partitioned table
+outside of the migrations, and PostgreSQL can not build an index
+concurrently on a partitioned table. ``AddPartitionedIndexConcurrently``
+builds such an index the way PostgreSQL allows it: an index on the parent
+only, an index built concurrently on every partition, each of them then
+attached to the parent index, which becomes valid once all partitions
+have theirs. On a plain table it is ``AddIndexConcurrently``.
+"""
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+
+
+def is_partitioned(connection, table):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)", [table])
+        return cursor.fetchone() is not None
+
+
+def relation_exists(connection, name):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s)", [name])
+        return cursor.fetchone()[0] is not None
+
+
+def partitions(connection, table):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT inhrelid::regclass::text FROM pg_inherits WHERE inhparent = to_regclass(%s) ORDER BY 1",
+            [table],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def partition_index_name(partition, name):
+    return "{}_{}".format(partition, name)[:63]
+
+
+class AddPartitionedIndexConcurrently(AddIndexConcurrently):
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+        connection = schema_editor.connection
+        table = model._meta.db_table
+        if not is_partitioned(connection, table):
+            return super().database_forwards(app_label, schema_editor, from_state, to_state)
+        # partition-entries creates the indexes the migrations know about
+        if relation_exists(connection, self.index.name):
+            return
+
+        parent = self.index.create_sql(model, schema_editor)
+        parent.template = parent.template.replace(" ON %(table)s", " ON ONLY %(table)s")
+        schema_editor.execute(parent)
+        for partition in partitions(connection, table):
+            name = partition_index_name(partition, self.index.name)
+            child = self.index.create_sql(model, schema_editor, concurrently=True)
+            child.template = child.template.replace("%(name)s", "IF NOT EXISTS %(name)s")
+            child.parts["name"] = schema_editor.quote_name(name)
+            child.parts["table"] = schema_editor.quote_name(partition)
+            schema_editor.execute(child)
+            schema_editor.execute(
+                "ALTER INDEX {} ATTACH PARTITION {}".format(
+                    schema_editor.quote_name(self.index.name), schema_editor.quote_name(name)
+                )
+            )
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+        if not is_partitioned(schema_editor.connection, model._meta.db_table):
+            return super().database_backwards(app_label, schema_editor, from_state, to_state)
+        # the index of a partitioned table can not be dropped concurrently
+        schema_editor.execute("DROP INDEX IF EXISTS {}".format(schema_editor.quote_name(self.index.name)))
@@ -0,0 +1,36 @@
+# Generated by Django 3.2.14 on 2026-10-18 09:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0050_auto_20220730_1410'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tablecolumn',
+            name='indexed',
+            field=models.BooleanField(default=False, help_text='Keep an index on this column. Set automatically when the column is used to filter or sort.'),
+        ),
+        migrations.CreateModel(
+            name='ColumnIndex',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('btree', 'btree')], default='btree', max_length=20)),
+                ('name', models.CharField(max_length=63, unique=True)),
+                ('key', models.CharField(max_length=50)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('building', 'Building'), ('ready', 'Ready'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('date_updated', models.DateTimeField(auto_now=True)),
+                ('table_column', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='indexes', to='api.tablecolumn')),
+            ],
+            options={
+                'verbose_name_plural': 'Column indexes',
+                'unique_together': {('table_column', 'kind')},
+            },
+        ),
+    ]
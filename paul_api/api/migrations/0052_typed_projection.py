@@ -0,0 +1,65 @@
+# Generated by Django 3.2.14 on 2026-10-18 10:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+TRY_CAST_FUNCTIONS = """
+CREATE OR REPLACE FUNCTION api_try_float(value text) RETURNS double precision AS $$
+BEGIN
+    RETURN value::double precision;
+EXCEPTION WHEN others THEN
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION api_try_timestamptz(value text) RETURNS timestamptz AS $$
+BEGIN
+    RETURN value::timestamptz;
+EXCEPTION WHEN others THEN
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql STABLE;
+"""
+
+DROP_TRY_CAST_FUNCTIONS = """
+DROP FUNCTION IF EXISTS api_try_float(text);
+DROP FUNCTION IF EXISTS api_try_timestamptz(text);
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0051_columnindex'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='table',
+            name='typed_projection',
+            field=models.BooleanField(default=False, help_text='Keep native copies of int, float and date values for faster filters and aggregations.'),
+        ),
+        migrations.CreateModel(
+            name='TypedValue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.FloatField(blank=True, null=True)),
+                ('date', models.DateTimeField(blank=True, null=True)),
+                ('entry', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='typed_values', to='api.entry')),
+                ('table_column', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='typed_values', to='api.tablecolumn')),
+            ],
+            options={
+                'unique_together': {('entry', 'table_column')},
+            },
+        ),
+        migrations.AddIndex(
+            model_name='typedvalue',
+            index=models.Index(fields=['table_column', 'number'], name='api_typedvalue_number_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='typedvalue',
+            index=models.Index(fields=['table_column', 'date'], name='api_typedvalue_date_idx'),
+        ),
+        migrations.RunSQL(TRY_CAST_FUNCTIONS, DROP_TRY_CAST_FUNCTIONS),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.2.14 on 2026-10-18 11:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0052_typed_projection'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='typedvalue',
+            name='entry',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='typed_values', to='api.entry'),
+        ),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 3.2.14 on 2026-10-18 12:02
+
+import hashlib
+
+from django.db import migrations, models
+
+
+# frozen copy of api.unique_keys at the time of this migration
+SEPARATOR = "\x1f"
+BATCH_SIZE = 2000
+
+
+def normalize(value):
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+
+def compute(data, column_names):
+    values = [normalize((data or {}).get(name)) for name in column_names]
+    if not any(values):
+        return None
+    return hashlib.md5(SEPARATOR.join(values).encode("utf-8")).hexdigest()
+
+
+def fill_unique_keys(apps, schema_editor):
+    Table = apps.get_model("api", "Table")
+    TableColumn = apps.get_model("api", "TableColumn")
+    Entry = apps.get_model("api", "Entry")
+
+    for table in Table.objects.filter(fields__unique=True).distinct():
+        column_names = list(TableColumn.objects.filter(table=table, unique=True).order_by("pk").values_list(
+            "name", flat=True))
+        seen = set()
+        batch = []
+        for entry in Entry.objects.filter(table=table).only("id", "data").order_by("id").iterator():
+            key = compute(entry.data, column_names)
+            if key is None or key in seen:
+                # duplicates left over from the unindexed checks keep no key
+                continue
+            seen.add(key)
+            entry.unique_key = key
+            batch.append(entry)
+            if len(batch) >= BATCH_SIZE:
+                Entry.objects.bulk_update(batch, ["unique_key"])
+                batch = []
+        Entry.objects.bulk_update(batch, ["unique_key"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0053_typedvalue_entry_db_constraint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='entry',
+            name='unique_key',
+            field=models.CharField(blank=True, editable=False, max_length=32, null=True),
+        ),
+        migrations.RunPython(fill_unique_keys, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='entry',
+            constraint=models.UniqueConstraint(fields=('table', 'unique_key'), name='api_entry_unique_key'),
+        ),
+    ]
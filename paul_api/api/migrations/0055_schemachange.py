@@ -0,0 +1,48 @@
+# Generated by Django 3.2.14 on 2026-10-18 13:40
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+from api.migration_operations import AddPartitionedIndexConcurrently
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0054_entry_unique_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SchemaChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('rename', 'Rename'), ('delete', 'Delete'), ('retype', 'Change type')], max_length=20)),
+                ('old_name', models.CharField(max_length=50)),
+                ('new_name', models.CharField(blank=True, max_length=50, null=True)),
+                ('old_type', models.CharField(blank=True, choices=[('text', 'text'), ('int', 'int'), ('float', 'float'), ('date', 'date'), ('enum', 'enum')], max_length=20, null=True)),
+                ('new_type', models.CharField(blank=True, choices=[('text', 'text'), ('int', 'int'), ('float', 'float'), ('date', 'date'), ('enum', 'enum')], max_length=20, null=True)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('rows_total', models.IntegerField(default=0)),
+                ('rows_done', models.IntegerField(default=0)),
+                ('rows_failed', models.IntegerField(default=0)),
+                ('date_created', models.DateTimeField(auto_now_add=True)),
+                ('date_updated', models.DateTimeField(auto_now=True)),
+                ('owner', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+                ('table', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='schema_changes', to='api.table')),
+                ('table_column', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='schema_changes', to='api.tablecolumn')),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+        AddPartitionedIndexConcurrently(
+            model_name='entry',
+            index=models.Index(fields=['table', 'id'], name='api_entry_table_id_id_idx'),
+        ),
+    ]
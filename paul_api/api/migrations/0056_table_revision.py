@@ -0,0 +1,18 @@
+# Generated by Django 3.2.14 on 2026-10-18 14:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0055_schemachange'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='table',
+            name='revision',
+            field=models.BigIntegerField(default=0, editable=False, help_text='Incremented on every change of the entries or columns of the table.'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 3.2.14 on 2026-10-18 15:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0056_table_revision'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='table',
+            name='entries_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunSQL(
+            """
+            UPDATE api_table SET entries_count = counts.entries_count
+            FROM (SELECT table_id, count(*) AS entries_count FROM api_entry GROUP BY table_id) AS counts
+            WHERE counts.table_id = api_table.id
+            """,
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 3.2.14 on 2026-10-18 16:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_enum_values(apps, schema_editor):
+    TableColumn = apps.get_model("api", "TableColumn")
+    EnumValue = apps.get_model("api", "EnumValue")
+
+    for column in TableColumn.objects.filter(field_type="enum").exclude(choices=None).iterator():
+        values = list(dict.fromkeys(x for x in column.choices if x))
+        EnumValue.objects.bulk_create(
+            [EnumValue(table_column=column, value=value, code=code) for code, value in enumerate(values, 1)],
+            batch_size=1000,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0057_table_entries_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EnumValue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.CharField(max_length=255)),
+                ('code', models.IntegerField()),
+                ('table_column', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='enum_values', to='api.tablecolumn')),
+            ],
+            options={
+                'ordering': ['table_column', 'code'],
+                'unique_together': {('table_column', 'value'), ('table_column', 'code')},
+            },
+        ),
+        migrations.AddField(
+            model_name='typedvalue',
+            name='code',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='typedvalue',
+            index=models.Index(fields=['table_column', 'code'], name='api_typedvalue_code_idx'),
+        ),
+        migrations.RunPython(fill_enum_values, migrations.RunPython.noop),
+        migrations.RunSQL(
+            """
+            INSERT INTO api_typedvalue (entry_id, table_column_id, code)
+            SELECT api_entry.id, api_tablecolumn.id, api_enumvalue.code
+            FROM api_tablecolumn
+            JOIN api_table ON api_table.id = api_tablecolumn.table_id AND api_table.typed_projection
+            JOIN api_entry ON api_entry.table_id = api_tablecolumn.table_id
+            JOIN api_enumvalue ON api_enumvalue.table_column_id = api_tablecolumn.id
+                AND api_enumvalue.value = api_entry.data ->> api_tablecolumn.name
+            WHERE api_tablecolumn.field_type = 'enum'
+            ON CONFLICT DO NOTHING
+            """,
+            migrations.RunSQL.noop,
+        ),
+    ]
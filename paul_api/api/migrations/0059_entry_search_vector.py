@@ -0,0 +1,48 @@
+# Generated by Django 3.2.14 on 2026-10-18 17:20
+
+from django.conf import settings
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+from api.migration_operations import AddPartitionedIndexConcurrently
+
+
+def fill_search_vectors(apps, schema_editor):
+    Table = apps.get_model("api", "Table")
+    TableColumn = apps.get_model("api", "TableColumn")
+
+    for table_id in Table.objects.values_list("id", flat=True):
+        names = list(
+            TableColumn.objects.filter(table_id=table_id, field_type__in=["text", "enum"])
+            .order_by("id").values_list("name", flat=True))
+        if not names:
+            continue
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute(
+                "UPDATE api_entry SET search_vector = to_tsvector(%s::regconfig, concat_ws(' ', {})) "
+                "WHERE table_id = %s".format(", ".join("data ->> %s" for x in names)),
+                [settings.SEARCH_CONFIG] + names + [table_id],
+            )
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('api', '0058_enumvalue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='entry',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(fill_search_vectors, migrations.RunPython.noop),
+        AddPartitionedIndexConcurrently(
+            model_name='entry',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='api_entry_search_vector_idx'),
+        ),
+    ]
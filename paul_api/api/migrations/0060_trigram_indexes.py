@@ -0,0 +1,20 @@
+# Generated by Django 3.2.14 on 2026-10-18 18:10
+
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0059_entry_search_vector'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AlterField(
+            model_name='columnindex',
+            name='kind',
+            field=models.CharField(choices=[('btree', 'btree'), ('trigram', 'trigram')], default='btree', max_length=20),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 3.2.14 on 2026-10-18 19:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0060_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='csvimport',
+            name='status',
+            field=models.CharField(choices=[('uploaded', 'Uploaded'), ('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='uploaded', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='csvimport',
+            name='error',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='csvimport',
+            name='rows_processed',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='csvimport',
+            name='bytes_total',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='csvimport',
+            name='bytes_read',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='csvimport',
+            name='date_started',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='csvimport',
+            name='date_updated',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='csvimport',
+            name='date_finished',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        # imports made before this migration ran inside the request
+        migrations.RunSQL(
+            "UPDATE api_csvimport SET status = 'done' WHERE table_id IS NOT NULL",
+            migrations.RunSQL.noop,
+        ),
+    ]
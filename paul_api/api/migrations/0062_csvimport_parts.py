@@ -0,0 +1,36 @@
+# Generated by Django 3.2.14 on 2026-10-18 19:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0061_csvimport_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='csvimport',
+            name='parts_total',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='csvimport',
+            name='parts_done',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='CsvImportKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('unique_key', models.CharField(max_length=32)),
+                ('position', models.BigIntegerField()),
+                ('csv_import', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='keys', to='api.csvimport')),
+            ],
+            options={
+                'unique_together': {('csv_import', 'unique_key')},
+            },
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 3.2.14 on 2026-10-18 20:15
+
+import django.core.serializers.json
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+ERRORS_SAMPLE_SIZE = 20
+BATCH_SIZE = 2000
+
+
+def move_errors(apps, schema_editor):
+    CsvImport = apps.get_model("api", "CsvImport")
+    CsvImportError = apps.get_model("api", "CsvImportError")
+    for csv_import in CsvImport.objects.exclude(errors=None).exclude(errors=[]).iterator():
+        CsvImportError.objects.bulk_create(
+            [
+                CsvImportError(csv_import=csv_import, row_number=number, row=error["row"], errors=error["errors"])
+                for number, error in enumerate(csv_import.errors, 1)
+            ],
+            batch_size=BATCH_SIZE,
+        )
+        csv_import.errors = csv_import.errors[:ERRORS_SAMPLE_SIZE]
+        csv_import.save(update_fields=["errors"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0062_csvimport_parts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CsvImportError',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('part', models.IntegerField(default=0)),
+                ('row_number', models.IntegerField()),
+                ('row', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('errors', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('csv_import', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='error_rows', to='api.csvimport')),
+            ],
+            options={
+                'ordering': ['csv_import', 'part', 'row_number'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='csvimporterror',
+            index=models.Index(fields=['csv_import', 'part', 'row_number'], name='api_csvimporterror_row_idx'),
+        ),
+        migrations.RunPython(move_errors, migrations.RunPython.noop),
+    ]
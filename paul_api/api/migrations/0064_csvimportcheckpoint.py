@@ -0,0 +1,41 @@
+# Generated by Django 3.2.14 on 2026-10-18 20:50
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0063_csvimporterror'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='csvimport',
+            name='use_table_mapping',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='CsvImportCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('part', models.IntegerField(default=0)),
+                ('encoding', models.CharField(max_length=20)),
+                ('delimiter', models.CharField(max_length=2)),
+                ('fieldnames', models.JSONField(default=list)),
+                ('start', models.BigIntegerField()),
+                ('end', models.BigIntegerField()),
+                ('offset', models.BigIntegerField()),
+                ('rows', models.IntegerField(default=0)),
+                ('errors_count', models.IntegerField(default=0)),
+                ('created', models.IntegerField(default=0)),
+                ('updated', models.IntegerField(default=0)),
+                ('csv_import', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='checkpoints', to='api.csvimport')),
+            ],
+            options={
+                'ordering': ['csv_import', 'part'],
+                'unique_together': {('csv_import', 'part')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.14 on 2026-10-18 21:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0064_csvimportcheckpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='csvimport',
+            name='file_format',
+            field=models.CharField(choices=[('csv', 'CSV'), ('xlsx', 'XLSX'), ('ndjson', 'NDJSON')], default='csv', max_length=10),
+        ),
+    ]
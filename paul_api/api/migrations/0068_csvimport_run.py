@@ -0,0 +1,23 @@
+# Generated by Django 3.2.14 on 2026-10-18 23:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0067_exportjob_file_format'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='csvimport',
+            name='run',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='csvimportcheckpoint',
+            name='run',
+            field=models.IntegerField(default=0),
+        ),
+    ]
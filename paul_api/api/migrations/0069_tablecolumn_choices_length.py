@@ -0,0 +1,19 @@
+# Generated by Django 3.2.14 on 2026-10-18 23:55
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0068_csvimport_run'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='tablecolumn',
+            name='choices',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=255), blank=True, null=True, size=None),
+        ),
+    ]
@@ -1,8 +1,12 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete, post_save
 from django.utils.text import slugify
 from django.utils import timezone
 from django.contrib.auth.models import User
 from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.core.serializers.json import DjangoJSONEncoder
 from django.core.exceptions import ValidationError
 from django.contrib.auth.models import Group
@@ -67,6 +71,84 @@ chart_timeline_periods = (
     ("month", "Month"),
     ("year", "Year"))
 
+index_kinds = (
+    ("btree", "btree"),
+    ("trigram", "trigram"),
+)
+
+index_statuses = (
+    ("pending", "Pending"),
+    ("building", "Building"),
+    ("ready", "Ready"),
+    ("failed", "Failed"))
+
+schema_change_kinds = (
+    ("rename", "Rename"),
+    ("delete", "Delete"),
+    ("retype", "Change type"),
+)
+
+csv_import_statuses = (
+    ("uploaded", "Uploaded"),
+    ("queued", "Queued"),
+    ("running", "Running"),
+    ("done", "Done"),
+    ("failed", "Failed"))
+
+import_formats = (
+    ("csv", "CSV"),
+    ("xlsx", "XLSX"),
+    ("ndjson", "NDJSON"))
+
+export_kinds = (
+    ("table", "Table"),
+    ("filter", "Filter"))
+
+export_formats = (
+    ("csv", "CSV"),
+    ("ndjson", "NDJSON"),
+    ("parquet", "Parquet"))
+
+export_statuses = (
+    ("queued", "Queued"),
+    ("running", "Running"),
+    ("done", "Done"),
+    ("failed", "Failed"))
+
+schema_change_statuses = (
+    ("pending", "Pending"),
+    ("running", "Running"),
+    ("done", "Done"),
+    ("failed", "Failed"))
+
+
+class LoadedValuesMixin:
+    """
+    Remember the values a row was loaded with, so post_save handlers can
+    tell which fields changed.
+    """
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def save(self, *args, **kwargs):
+        # post_save handlers run inside save and still see the loaded values
+        super().save(*args, **kwargs)
+        self.reset_loaded_values()
+
+    def has_changed(self, field_name):
+        loaded_values = getattr(self, "_loaded_values", {})
+        if field_name not in loaded_values:
+            return True
+        return loaded_values[field_name] != getattr(self, field_name)
+
+    def reset_loaded_values(self):
+        self._loaded_values = {
+            field.attname: getattr(self, field.attname) for field in self._meta.concrete_fields}
+
 
 class Userprofile(models.Model):
     """
@@ -133,16 +215,25 @@ class Database(models.Model):
         super().save(*args, **kwargs)
 
     def active_tables(self):
-        return self.tables.filter(active=True).order_by("id")
+        return self.tables.filter(active=True).select_related("owner", "last_edit_user").order_by("id")
 
     def archived_tables(self):
-        return self.tables.filter(active=False).order_by("id")
+        return self.tables.filter(active=False).select_related("owner", "last_edit_user").order_by("id")
 
     def tables_count(self):
         return self.tables.count()
 
+    def delete(self, *args, **kwargs):
+        from api import partitions
+
+        with transaction.atomic():
+            # see Table.delete
+            for table_id in self.tables.values_list("id", flat=True):
+                partitions.discard_entries(table_id)
+            return super().delete(*args, **kwargs)
 
-class Table(models.Model):
+
+class Table(LoadedValuesMixin, models.Model):
     """
     Description: Model Description
     """
@@ -169,6 +260,16 @@ class Table(models.Model):
 
     filters = models.JSONField(
         encoder=DjangoJSONEncoder, null=True, blank=True)
+    typed_projection = models.BooleanField(
+        default=False,
+        help_text="Keep native copies of int, float and date values for faster filters and aggregations.")
+    revision = models.BigIntegerField(
+        default=0, editable=False,
+        help_text="Incremented on every change of the entries or columns of the table.")
+    entries_count = models.IntegerField(default=0, editable=False)
+
+    # maintained with atomic updates, never written back from memory
+    counter_fields = ["revision", "entries_count"]
 
     class Meta:
         permissions = (
@@ -185,13 +286,75 @@ class Table(models.Model):
         value = re.sub('_+', '_', self.name)
         self.slug = slugify(value, allow_unicode=True)
         self.last_edit_date = timezone.now()
+        if not self._state.adding and not kwargs.get("update_fields") and not kwargs.get("force_insert"):
+            kwargs["update_fields"] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.counter_fields
+            ]
         super().save(*args, **kwargs)
 
-    def entries_count(self):
-        return self.entries.count()
+    def bump_revision(self, entries_delta=0):
+        """
+        Record a change of the table, adjusting the entries count by the
+        number of entries created minus the number deleted.
+        """
+        updates = {"revision": models.F("revision") + 1}
+        if entries_delta:
+            updates["entries_count"] = models.F("entries_count") + entries_delta
+        Table.objects.filter(pk=self.pk).update(**updates)
 
+    def refresh_entries_count(self):
+        """
+        Recount the entries, for writers that do not keep track of how many
+        entries they created.
+        """
+        Table.objects.filter(pk=self.pk).update(entries_count=Coalesce(
+            models.Subquery(
+                Entry.objects.filter(table=models.OuterRef("pk"))
+                .values("table")
+                .annotate(count=models.Count("id"))
+                .values("count")
+            ),
+            0,
+        ))
 
-class TableColumn(models.Model):
+    def delete(self, *args, **kwargs):
+        from api import partitions
+
+        with transaction.atomic():
+            # the entries go in one statement, so the cascade below finds
+            # none left to delete one by one
+            partitions.discard_entries(self.pk)
+            return super().delete(*args, **kwargs)
+
+
+@receiver(post_save, sender=Table)
+def create_table_partition(sender, instance, created, **kwargs):
+    from api import partitions
+
+    if created and partitions.is_partitioned():
+        partitions.create_partition(instance.pk)
+
+
+@receiver(post_delete, sender=Table)
+def drop_table_partition(sender, instance, **kwargs):
+    from api import partitions
+
+    # also reached by queryset and cascade deletes, which skip Table.delete
+    table_id = instance.pk
+    transaction.on_commit(lambda: partitions.drop_partition(table_id))
+
+
+@receiver(post_save, sender=Table)
+def sync_table_projection(sender, instance, created, **kwargs):
+    from api import tasks
+
+    if not created and instance.has_changed("typed_projection"):
+        table_id = instance.pk
+        transaction.on_commit(lambda: tasks.rebuild_table_projection.delay(table_id))
+
+
+class TableColumn(LoadedValuesMixin, models.Model):
     """
     Description: Model Description
     """
@@ -204,9 +367,12 @@ class TableColumn(models.Model):
     field_type = models.CharField(max_length=20, choices=datatypes)
     help_text = models.CharField(max_length=255, null=True, blank=True)
     choices = ArrayField(
-        models.CharField(max_length=100), null=True, blank=True)
+        models.CharField(max_length=255), null=True, blank=True)
     required = models.BooleanField(default=False)
     unique = models.BooleanField(default=False)
+    indexed = models.BooleanField(
+        default=False,
+        help_text="Keep an index on this column. Set automatically when the column is used to filter or sort.")
 
     class Meta:
         unique_together = ["table", "name"]
@@ -221,6 +387,146 @@ class TableColumn(models.Model):
         super().save(*args, **kwargs)
 
 
+class ColumnIndex(models.Model):
+    """
+    Description: Expression index on Entry.data kept for a table column
+    """
+
+    table_column = models.ForeignKey(
+        "TableColumn", on_delete=models.CASCADE, related_name="indexes")
+    kind = models.CharField(
+        max_length=20, choices=index_kinds, default=index_kinds[0][0])
+    name = models.CharField(max_length=63, unique=True)
+    key = models.CharField(max_length=50)
+    status = models.CharField(
+        max_length=20, choices=index_statuses, default=index_statuses[0][0])
+    error = models.TextField(null=True, blank=True)
+    date_updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = "Column indexes"
+        unique_together = ["table_column", "kind"]
+
+    def __str__(self):
+        return "{} ({}, {})".format(self.name, self.kind, self.status)
+
+
+class EnumValue(models.Model):
+    """
+    Description: Integer code of a value of an enum column
+    """
+
+    table_column = models.ForeignKey(
+        "TableColumn", on_delete=models.CASCADE, related_name="enum_values")
+    value = models.CharField(max_length=255)
+    code = models.IntegerField()
+
+    class Meta:
+        unique_together = [["table_column", "value"], ["table_column", "code"]]
+        ordering = ["table_column", "code"]
+
+    def __str__(self):
+        return "{} = {}".format(self.value, self.code)
+
+
+@receiver(post_save, sender=TableColumn)
+def sync_table_column_indexes(sender, instance, **kwargs):
+    from api import indexes
+
+    column_id = instance.pk
+    transaction.on_commit(lambda: indexes.sync_column_indexes(column_id))
+
+
+@receiver(post_save, sender=TableColumn)
+def sync_table_column_projection(sender, instance, **kwargs):
+    from api import tasks
+
+    if instance.has_changed("field_type") and instance.table.typed_projection:
+        column_id = instance.pk
+        transaction.on_commit(lambda: tasks.rebuild_column_projection.delay(column_id))
+
+
+@receiver(post_save, sender=TableColumn)
+def sync_table_column_unique_keys(sender, instance, created, **kwargs):
+    from api import tasks
+
+    if (created and instance.unique) or (not created and instance.has_changed("unique")):
+        table_id = instance.table_id
+        transaction.on_commit(lambda: tasks.rebuild_unique_keys.delay(table_id))
+
+
+@receiver(post_delete, sender=TableColumn)
+def drop_table_column_unique_key(sender, instance, **kwargs):
+    from api import tasks
+
+    if instance.unique:
+        table_id = instance.table_id
+        transaction.on_commit(lambda: tasks.rebuild_unique_keys.delay(table_id))
+
+
+@receiver(post_save, sender=TableColumn)
+def sync_table_column_search(sender, instance, created, **kwargs):
+    from api import tasks
+
+    # a new column has no values yet
+    if not created and (instance.has_changed("name") or instance.has_changed("field_type")):
+        table_id = instance.table_id
+        transaction.on_commit(lambda: tasks.rebuild_search_vectors.delay(table_id))
+
+
+@receiver(post_delete, sender=TableColumn)
+def drop_table_column_search(sender, instance, **kwargs):
+    from api import search, tasks
+
+    if instance.field_type in search.SEARCHED_TYPES:
+        table_id = instance.table_id
+        transaction.on_commit(lambda: tasks.rebuild_search_vectors.delay(table_id))
+
+
+@receiver(post_delete, sender=ColumnIndex)
+def drop_column_index(sender, instance, **kwargs):
+    from api import tasks
+
+    name = instance.name
+    transaction.on_commit(lambda: tasks.drop_column_index.delay(name))
+
+
+class SchemaChange(models.Model):
+    """
+    Description: Background migration of the entries of a table after a column change
+    """
+
+    table = models.ForeignKey(
+        "Table", on_delete=models.CASCADE, related_name="schema_changes")
+    table_column = models.ForeignKey(
+        "TableColumn",
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name="schema_changes",
+    )
+    kind = models.CharField(max_length=20, choices=schema_change_kinds)
+    old_name = models.CharField(max_length=50)
+    new_name = models.CharField(max_length=50, null=True, blank=True)
+    old_type = models.CharField(max_length=20, choices=datatypes, null=True, blank=True)
+    new_type = models.CharField(max_length=20, choices=datatypes, null=True, blank=True)
+    status = models.CharField(
+        max_length=20, choices=schema_change_statuses, default=schema_change_statuses[0][0])
+    error = models.TextField(null=True, blank=True)
+    rows_total = models.IntegerField(default=0)
+    rows_done = models.IntegerField(default=0)
+    rows_failed = models.IntegerField(default=0)
+    owner = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL)
+    date_created = models.DateTimeField(auto_now_add=True)
+    date_updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["id"]
+
+    def __str__(self):
+        return "{} {} ({})".format(self.kind, self.old_name, self.status)
+
+
 class CsvFieldMap(models.Model):
     """
     Description: Model Description
@@ -277,9 +583,114 @@ class CsvImport(models.Model):
     import_count_updated = models.IntegerField(default=0)
     date_created = models.DateTimeField(auto_now_add=True)
 
+    status = models.CharField(
+        max_length=20, choices=csv_import_statuses, default=csv_import_statuses[0][0])
+    error = models.TextField(null=True, blank=True)
+    rows_processed = models.IntegerField(default=0)
+    bytes_total = models.BigIntegerField(null=True, blank=True)
+    bytes_read = models.BigIntegerField(default=0)
+    date_started = models.DateTimeField(null=True, blank=True)
+    date_updated = models.DateTimeField(null=True, blank=True)
+    date_finished = models.DateTimeField(null=True, blank=True)
+    parts_total = models.IntegerField(default=0)
+    parts_done = models.IntegerField(default=0)
+    # bumped by every run, the tasks of earlier runs stop writing
+    run = models.IntegerField(default=0)
+    use_table_mapping = models.BooleanField(default=False)
+    file_format = models.CharField(max_length=10, choices=import_formats, default=import_formats[0][0])
+
     class Meta:
         pass
 
+    def elapsed_seconds(self):
+        if not self.date_started:
+            return None
+        end = self.date_finished or self.date_updated or self.date_started
+        return (end - self.date_started).total_seconds()
+
+    def rows_per_second(self):
+        elapsed = self.elapsed_seconds()
+        if not elapsed:
+            return None
+        return round(self.rows_processed / elapsed, 1)
+
+    def eta_seconds(self):
+        """
+        Estimated seconds left, from the share of the file read so far.
+        """
+        if self.status == "done":
+            return 0
+        elapsed = self.elapsed_seconds()
+        if self.status != "running" or not elapsed or not self.bytes_total or not self.bytes_read:
+            return None
+        return round(elapsed * (self.bytes_total - self.bytes_read) / self.bytes_read)
+
+
+class CsvImportError(models.Model):
+    """
+    Description: A row of an imported file that failed, with its errors
+    by CSV column
+    """
+
+    csv_import = models.ForeignKey(
+        "CsvImport", on_delete=models.CASCADE, related_name="error_rows")
+    part = models.IntegerField(default=0)
+    row_number = models.IntegerField()
+    row = models.JSONField(encoder=DjangoJSONEncoder)
+    errors = models.JSONField(encoder=DjangoJSONEncoder)
+
+    class Meta:
+        ordering = ["csv_import", "part", "row_number"]
+        indexes = [
+            models.Index(fields=["csv_import", "part", "row_number"], name="api_csvimporterror_row_idx"),
+        ]
+
+
+class CsvImportCheckpoint(models.Model):
+    """
+    Description: Byte range of an imported file read by one task, with the
+    offset and counts of its last committed chunk
+    """
+
+    csv_import = models.ForeignKey(
+        "CsvImport", on_delete=models.CASCADE, related_name="checkpoints")
+    part = models.IntegerField(default=0)
+    encoding = models.CharField(max_length=20)
+    delimiter = models.CharField(max_length=2)
+    fieldnames = models.JSONField(default=list)
+    start = models.BigIntegerField()
+    end = models.BigIntegerField()
+    offset = models.BigIntegerField()
+    rows = models.IntegerField(default=0)
+    errors_count = models.IntegerField(default=0)
+    created = models.IntegerField(default=0)
+    updated = models.IntegerField(default=0)
+    # run of the import whose task reads the range
+    run = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = [["csv_import", "part"]]
+        ordering = ["csv_import", "part"]
+
+    @property
+    def done(self):
+        return self.offset >= self.end
+
+
+class CsvImportKey(models.Model):
+    """
+    Description: Position in the file of the last row of a parallel import
+    with a unique key, so the parts agree on which row wins
+    """
+
+    csv_import = models.ForeignKey(
+        "CsvImport", on_delete=models.CASCADE, related_name="keys")
+    unique_key = models.CharField(max_length=32)
+    position = models.BigIntegerField()
+
+    class Meta:
+        unique_together = [["csv_import", "unique_key"]]
+
 
 class Entry(models.Model):
     """
@@ -290,9 +701,18 @@ class Entry(models.Model):
         "Table", on_delete=models.CASCADE, related_name="entries")
     data = models.JSONField(encoder=DjangoJSONEncoder, null=True, blank=True)
     date_created = models.DateTimeField(auto_now_add=True)
+    unique_key = models.CharField(max_length=32, null=True, blank=True, editable=False)
+    search_vector = SearchVectorField(null=True, blank=True, editable=False)
 
     class Meta:
         verbose_name_plural = "Entries"
+        constraints = [
+            models.UniqueConstraint(fields=["table", "unique_key"], name="api_entry_unique_key"),
+        ]
+        indexes = [
+            models.Index(fields=["table", "id"], name="api_entry_table_id_id_idx"),
+            GinIndex(fields=["search_vector"], name="api_entry_search_vector_idx"),
+        ]
 
     def __str__(self):
         return self.table.name
@@ -302,6 +722,31 @@ class Entry(models.Model):
 
 
 
+class TypedValue(models.Model):
+    """
+    Description: Native copy of an int, float or date value, or the code of
+    an enum value, of an entry
+    """
+
+    # a partitioned api_entry has a composite primary key, which a database
+    # foreign key on entry id alone can not reference
+    entry = models.ForeignKey(
+        "Entry", on_delete=models.CASCADE, related_name="typed_values", db_constraint=False)
+    table_column = models.ForeignKey(
+        "TableColumn", on_delete=models.CASCADE, related_name="typed_values")
+    number = models.FloatField(null=True, blank=True)
+    date = models.DateTimeField(null=True, blank=True)
+    code = models.IntegerField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ["entry", "table_column"]
+        indexes = [
+            models.Index(fields=["table_column", "number"], name="api_typedvalue_number_idx"),
+            models.Index(fields=["table_column", "date"], name="api_typedvalue_date_idx"),
+            models.Index(fields=["table_column", "code"], name="api_typedvalue_code_idx"),
+        ]
+
+
 class FilterJoinTable(models.Model):
     """
     Description: Model Description
@@ -327,6 +772,16 @@ class FilterJoinTable(models.Model):
         )
 
 
+@receiver(post_save, sender=FilterJoinTable)
+@receiver(post_delete, sender=FilterJoinTable)
+def sync_join_field_indexes(sender, instance, **kwargs):
+    from api import indexes
+
+    column_id = instance.join_field_id
+    if column_id:
+        transaction.on_commit(lambda: indexes.sync_column_indexes(column_id))
+
+
 class Filter(models.Model):
     """
     Description: Model Description
@@ -365,6 +820,38 @@ class Filter(models.Model):
         super().save(*args, **kwargs)
 
 
+class ExportJob(models.Model):
+    """
+    Description: Export of a table or a filter written to the storage
+    in the background, reused by identical exports
+    """
+
+    kind = models.CharField(max_length=10, choices=export_kinds)
+    table = models.ForeignKey(
+        Table, null=True, blank=True, on_delete=models.CASCADE, related_name="export_jobs")
+    filter = models.ForeignKey(
+        Filter, null=True, blank=True, on_delete=models.CASCADE, related_name="export_jobs")
+    params = models.JSONField(default=dict)
+    file_format = models.CharField(max_length=10, choices=export_formats, default=export_formats[0][0])
+    fingerprint = models.CharField(max_length=64, db_index=True)
+    file = models.FileField(upload_to="exports/", null=True, blank=True)
+    status = models.CharField(max_length=20, choices=export_statuses, default=export_statuses[0][0])
+    error = models.TextField(null=True, blank=True)
+    owner = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL)
+    date_created = models.DateTimeField(auto_now_add=True)
+    date_started = models.DateTimeField(null=True, blank=True)
+    date_finished = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-id"]
+
+
+@receiver(post_delete, sender=ExportJob)
+def delete_export_file(sender, instance, **kwargs):
+    if instance.file:
+        instance.file.delete(save=False)
+
+
 class Chart(models.Model):
     """
     Description: Model for representing a table chart
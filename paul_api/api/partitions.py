@@ -0,0 +1,146 @@
+"""
+List partitioning of api_entry on table_id.
+
+Once ``manage.py partition-entries`` has converted api_entry into a
+partitioned table, every Table owns a partition named ``api_entry_p<id>``.
+Partitions are created together with the table and dropped after it,
+so deleting a table no longer deletes its entries row by row, and the
+vacuum and index maintenance of a large synced table stays in its own
+partition. The entries of a deleted table are truncated with its
+partition, which only locks that partition, in the transaction of the
+delete; the empty partition is detached and dropped in a transaction of
+its own once the delete commits, since detaching locks all of api_entry.
+Rows of tables that do not have a partition yet land in the
+``api_entry_default`` partition until ``ensure_partition`` moves them out.
+"""
+
+from django.db import connection, transaction
+
+from api import models
+
+DEFAULT_PARTITION = "api_entry_default"
+
+# api_entry is never turned back into a plain table, so once it is seen
+# partitioned the catalog is not queried again
+partitioned = False
+
+
+def entry_table():
+    return models.Entry._meta.db_table
+
+
+def partition_name(table_id):
+    return "api_entry_p{}".format(int(table_id))
+
+
+def is_partitioned(relation=None):
+    global partitioned
+
+    if relation is None and partitioned:
+        return True
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)",
+            [relation or entry_table()],
+        )
+        result = cursor.fetchone() is not None
+    if relation is None:
+        partitioned = result
+    return result
+
+
+def partition_exists(table_id):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s)", [partition_name(table_id)])
+        return cursor.fetchone()[0] is not None
+
+
+def has_default_partition(relation=None):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT 1 FROM pg_inherits
+            WHERE inhparent = to_regclass(%s) AND inhrelid = to_regclass(%s)
+            """,
+            [relation or entry_table(), DEFAULT_PARTITION],
+        )
+        return cursor.fetchone() is not None
+
+
+def create_partition(table_id, relation=None):
+    """
+    Create the partition of a table that has no rows in the default
+    partition, e.g. a table that was just created.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS {partition} PARTITION OF {relation} FOR VALUES IN ({table_id})".format(
+                partition=connection.ops.quote_name(partition_name(table_id)),
+                relation=connection.ops.quote_name(relation or entry_table()),
+                table_id=int(table_id),
+            )
+        )
+
+
+def ensure_partition(table_id, relation=None):
+    """
+    Create the partition of a table, moving its rows out of the default
+    partition first. Must run inside a transaction.
+    """
+    if partition_exists(table_id):
+        return
+    relation = relation or entry_table()
+    if not has_default_partition(relation):
+        create_partition(table_id, relation)
+        return
+
+    quoted_relation = connection.ops.quote_name(relation)
+    default = connection.ops.quote_name(DEFAULT_PARTITION)
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM {} WHERE table_id = %s LIMIT 1".format(default), [table_id])
+        if cursor.fetchone() is None:
+            create_partition(table_id, relation)
+            return
+
+        # a partition can not be created while the default partition holds
+        # rows for it, so detach the default partition while they are moved
+        cursor.execute("ALTER TABLE {} DETACH PARTITION {}".format(quoted_relation, default))
+        create_partition(table_id, relation)
+        cursor.execute(
+            "INSERT INTO {} SELECT * FROM {} WHERE table_id = %s".format(quoted_relation, default), [table_id]
+        )
+        cursor.execute("DELETE FROM {} WHERE table_id = %s".format(default), [table_id])
+        cursor.execute("ALTER TABLE {} ATTACH PARTITION {} DEFAULT".format(quoted_relation, default))
+
+
+def discard_entries(table_id):
+    """
+    Delete the entries of a table in one statement: a truncate of its
+    partition, or a single DELETE while api_entry is not partitioned.
+    """
+    with connection.cursor() as cursor:
+        if is_partitioned() and partition_exists(table_id):
+            cursor.execute("TRUNCATE {}".format(connection.ops.quote_name(partition_name(table_id))))
+            # rows written before the partition existed
+            if has_default_partition():
+                cursor.execute(
+                    "DELETE FROM {} WHERE table_id = %s".format(connection.ops.quote_name(DEFAULT_PARTITION)),
+                    [table_id],
+                )
+        else:
+            cursor.execute(
+                "DELETE FROM {} WHERE table_id = %s".format(connection.ops.quote_name(entry_table())), [table_id]
+            )
+
+
+def drop_partition(table_id):
+    """
+    Detach and drop the partition of a deleted table in a transaction of
+    its own, so the lock it takes on api_entry is held only briefly.
+    """
+    if not is_partitioned() or not partition_exists(table_id):
+        return
+    partition = connection.ops.quote_name(partition_name(table_id))
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute("ALTER TABLE {} DETACH PARTITION {}".format(connection.ops.quote_name(entry_table()), partition))
+        cursor.execute("DROP TABLE {}".format(partition))
@@ -17,6 +17,16 @@ class BaseModelPermissions(permissions.DjangoObjectPermissions):
     }
 
 
+def request_user(request):
+    """
+    The authenticated user of a request, or the owner of its ?token=.
+    """
+    if request.user.is_authenticated:
+        return request.user
+    token = Token.objects.filter(key=request.GET.get("token")).select_related("user").first()
+    return token.user if token else request.user
+
+
 class IsAuthenticatedOrGetToken(permissions.BasePermission):
     """
     Object-level permission to only allow owners of an object to edit it.
@@ -0,0 +1,212 @@
+"""
+Typed projection of int, float, date and enum columns.
+
+Entry.data only holds JSON, so numeric and date lookups used to cast
+``data ->> 'column'`` on every row. Tables with ``typed_projection`` enabled
+keep a native copy of those values in TypedValue (one row per entry and
+column, indexed by column and value), and the filter, ordering and
+aggregation builders read from it instead. Enum values are projected as
+their dictionary codes (see ``api.enums``), which charts group on.
+"""
+
+from datetime import datetime, timedelta
+
+from dateutil.parser import isoparse
+from django.db import connection
+from django.db.models import FilteredRelation, Q
+from django.utils import timezone
+
+from api import enums, models
+
+PROJECTED_TYPES = {
+    "int": "number",
+    "float": "number",
+    "date": "date",
+    "enum": "code",
+}
+
+
+def is_projected(column):
+    return column.field_type in PROJECTED_TYPES and column.table.typed_projection
+
+
+def projected_columns(table, columns=None, with_enums=False):
+    """
+    Return the projected columns of a table, keyed by column name. Enum
+    codes only make sense for grouping, so enum columns are left out unless
+    ``with_enums`` is set.
+    """
+    if not table.typed_projection:
+        return {}
+    if columns is None:
+        columns = table.fields.all()
+    return {x.name: x for x in columns if x.field_type in PROJECTED_TYPES and (with_enums or x.field_type != "enum")}
+
+
+def to_number(value):
+    if value is None or value == "" or isinstance(value, bool):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def to_date(value):
+    if not value:
+        return None
+    try:
+        value = isoparse(str(value))
+    except (TypeError, ValueError):
+        return None
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value, timezone.utc)
+    return value
+
+
+def sync_entries(table, entries, columns=None):
+    """
+    Refresh the typed values of the given entries.
+    """
+    columns = projected_columns(table, columns, with_enums=True)
+    if not columns or not entries:
+        return
+
+    dictionary = None
+    if any(x.field_type == "enum" for x in columns.values()):
+        dictionary = enums.EnumDictionary(table, columns.values())
+        for name in dictionary.columns:
+            dictionary.add_many(name, [(entry.data or {}).get(name) for entry in entries])
+        dictionary.flush()
+
+    typed_values = []
+    for entry in entries:
+        data = entry.data or {}
+        for name, column in columns.items():
+            target = PROJECTED_TYPES[column.field_type]
+            if target == "number":
+                value = to_number(data.get(name))
+            elif target == "code":
+                value = dictionary.code(name, data.get(name))
+            else:
+                value = to_date(data.get(name))
+            if value is not None:
+                typed_values.append(models.TypedValue(entry_id=entry.pk, table_column_id=column.pk, **{target: value}))
+
+    models.TypedValue.objects.filter(
+        entry__in=[entry.pk for entry in entries],
+        table_column__in=columns.values(),
+    ).delete()
+    models.TypedValue.objects.bulk_create(typed_values)
+
+
+def rebuild_column(column):
+    """
+    Recompute the typed values of a column with one set based statement.
+    """
+    models.TypedValue.objects.filter(table_column=column).delete()
+    if not is_projected(column):
+        return
+
+    target = PROJECTED_TYPES[column.field_type]
+    if target == "code":
+        rebuild_enum_column(column)
+        return
+
+    cast = "api_try_float" if target == "number" else "api_try_timestamptz"
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            INSERT INTO {typed_values} (entry_id, table_column_id, {target})
+            SELECT id, %s, value FROM (
+                SELECT id, {cast}(data ->> %s) AS value
+                FROM {entries}
+                WHERE table_id = %s AND data ? %s
+            ) AS converted
+            WHERE value IS NOT NULL
+            """.format(
+                typed_values=connection.ops.quote_name(models.TypedValue._meta.db_table),
+                entries=connection.ops.quote_name(models.Entry._meta.db_table),
+                target=target,
+                cast=cast,
+            ),
+            [column.pk, column.name, column.table_id, column.name],
+        )
+
+
+def rebuild_enum_column(column):
+    enums.register_column(column)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            INSERT INTO {typed_values} (entry_id, table_column_id, code)
+            SELECT entries.id, %s, enum_values.code
+            FROM {entries} AS entries
+            JOIN {enum_values} AS enum_values
+                ON enum_values.table_column_id = %s AND enum_values.value = entries.data ->> %s
+            WHERE entries.table_id = %s AND entries.data ? %s
+            """.format(
+                typed_values=connection.ops.quote_name(models.TypedValue._meta.db_table),
+                entries=connection.ops.quote_name(models.Entry._meta.db_table),
+                enum_values=connection.ops.quote_name(models.EnumValue._meta.db_table),
+            ),
+            [column.pk, column.pk, column.name, column.table_id, column.name],
+        )
+
+
+def rebuild_table(table):
+    if not table.typed_projection:
+        models.TypedValue.objects.filter(table_column__table=table).delete()
+        return
+    for column in table.fields.all():
+        rebuild_column(column)
+
+
+def typed_field(queryset, column, alias):
+    """
+    Join the typed values of ``column`` under ``alias``. Returns the queryset
+    and the lookup path of the native value, e.g. ``typed_x__number``, or of
+    the code of an enum value.
+    """
+    queryset = queryset.annotate(
+        **{alias: FilteredRelation("typed_values", condition=Q(typed_values__table_column=column))}
+    )
+    return queryset, "{}__{}".format(alias, PROJECTED_TYPES[column.field_type])
+
+
+def typed_filter(column, lookup, value):
+    """
+    Build a Q on entry ids for a lookup against the typed value of a column,
+    served by the (table_column, value) index.
+    """
+    target = PROJECTED_TYPES[column.field_type]
+    typed_values = models.TypedValue.objects.filter(table_column=column)
+
+    if target == "number":
+        if isinstance(value, list):
+            value = [float(x) for x in value]
+        else:
+            value = float(value)
+        typed_values = typed_values.filter(**{"number__{}".format(lookup): value})
+    else:
+        if isinstance(value, list):
+            # values that are not dates match nothing, as on the data lookups
+            days = [start for start in map(to_date, value) if start is not None]
+            if not days:
+                return Q(pk__in=[])
+            day_filter = Q()
+            for start in days:
+                day_filter |= Q(date__gte=start, date__lt=start + timedelta(days=1))
+            typed_values = typed_values.filter(day_filter)
+        elif isinstance(value, datetime):
+            typed_values = typed_values.filter(**{"date__{}".format(lookup): value})
+        else:
+            start = to_date(value)
+            if start is None:
+                return Q(pk__in=[])
+            if lookup == "exact":
+                typed_values = typed_values.filter(date__gte=start, date__lt=start + timedelta(days=1))
+            else:
+                typed_values = typed_values.filter(**{"date__{}".format(lookup): start})
+
+    return Q(pk__in=typed_values.values("entry_id"))
@@ -0,0 +1,276 @@
+"""
+Column renames, deletions and type changes applied to the entries of a
+table as background jobs.
+
+Every change is a SchemaChange row, run by ``tasks.run_schema_changes``
+with set based UPDATE statements over chunks of entry ids, so the request
+that changed the column returns right away and no statement locks more
+than one chunk. The table stays readable while a job runs:
+
+- rename copies the values under the new key, then switches the column
+  name, then moves the values left under the old key, keeping the values
+  written under the new name since the switch;
+- delete removes the column first and strips the key afterwards;
+- retype converts the values, then switches the column type and converts
+  the rows written in the meantime.
+
+Every pass only touches the rows it still has to change, so a job can be
+run again from the start: a failed job is resumed with ``resume``, and a
+running job that has not moved for ``STALLED_AFTER``, e.g. because its
+worker died, is taken over by the next ``run_pending``.
+"""
+
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from api import enums, models, unique_keys
+from api.utils import chunks
+
+STALLED_AFTER = timedelta(minutes=10)
+
+# SQL expressions converting the text value of a key to the json value of
+# the target type, NULL when the value can not be converted
+CONVERSIONS = {
+    "text": "to_jsonb(data ->> %(key)s)",
+    "enum": "to_jsonb(data ->> %(key)s)",
+    "int": "to_jsonb(trunc(api_try_float(data ->> %(key)s))::bigint)",
+    "float": "to_jsonb(api_try_float(data ->> %(key)s))",
+    "date": "to_jsonb(to_char(api_try_timestamptz(data ->> %(key)s) AT TIME ZONE 'UTC', 'YYYY-MM-DD'))",
+}
+
+# values already stored in the shape of the target type are left alone
+CONVERTED = {
+    "text": "jsonb_typeof(data -> %(key)s) = 'string'",
+    "enum": "jsonb_typeof(data -> %(key)s) = 'string'",
+    "int": "jsonb_typeof(data -> %(key)s) = 'number'",
+    "float": "jsonb_typeof(data -> %(key)s) = 'number'",
+    "date": "data ->> %(key)s ~ '^\\d{4}-\\d{2}-\\d{2}$'",
+}
+
+
+def create(table, kind, old_name, column=None, new_name=None, old_type=None, new_type=None, owner=None):
+    """
+    Record a schema change and queue it once the current transaction
+    commits.
+    """
+    from api import tasks
+
+    job = models.SchemaChange.objects.create(
+        table=table,
+        table_column=column,
+        kind=kind,
+        old_name=old_name,
+        new_name=new_name,
+        old_type=old_type,
+        new_type=new_type,
+        owner=owner,
+    )
+    table_id = table.pk
+    transaction.on_commit(lambda: tasks.run_schema_changes.delay(table_id))
+    return job
+
+
+def pending_names(table):
+    """
+    Keys of the table that are still being renamed or deleted.
+    """
+    return set(
+        models.SchemaChange.objects.filter(
+            table=table, kind__in=["rename", "delete"], status__in=["pending", "running"]
+        ).values_list("old_name", flat=True)
+    )
+
+
+def update_chunks(job, assignment, condition, params, failed_condition="false"):
+    """
+    Run ``UPDATE ... SET data = <assignment> WHERE <condition>`` over the
+    entries of the job's table, one chunk per transaction, counting the
+    updated rows that match ``failed_condition`` as failed.
+    """
+    statement = """
+        UPDATE {entries} SET data = {assignment}
+        WHERE table_id = %(table_id)s AND id > %(after_id)s AND id <= %(last_id)s AND {condition}
+        RETURNING {failed_condition}
+    """.format(
+        entries=models.Entry._meta.db_table,
+        assignment=assignment,
+        condition=condition,
+        failed_condition=failed_condition,
+    )
+
+    for after_id, last_id in chunks(job.table_id):
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(statement, dict(params, table_id=job.table_id, after_id=after_id, last_id=last_id))
+            results = [row[0] for row in cursor.fetchall()]
+            models.SchemaChange.objects.filter(pk=job.pk).update(
+                rows_done=F("rows_done") + len(results),
+                rows_failed=F("rows_failed") + sum(1 for failed in results if failed),
+                date_updated=timezone.now(),
+            )
+            if results:
+                job.table.bump_revision()
+
+
+def count_rows(job, condition, params):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT count(*) FROM {entries} WHERE table_id = %(table_id)s AND {condition}".format(
+                entries=models.Entry._meta.db_table, condition=condition
+            ),
+            dict(params, table_id=job.table_id),
+        )
+        return cursor.fetchone()[0]
+
+
+def rename(job):
+    params = {"key": job.old_name, "new_key": job.new_name}
+    condition = "data ? %(key)s"
+    # every row is visited by both passes
+    models.SchemaChange.objects.filter(pk=job.pk).update(rows_total=2 * count_rows(job, condition, params))
+
+    # Entries are written whole, so a row written under the old name before
+    # the switch has lost its copy under the new one, and a value under the
+    # new name is either that copy or was written after the switch. Both
+    # passes keep it.
+    moved = "jsonb_build_object(%(new_key)s, coalesce(data -> %(new_key)s, data -> %(key)s))"
+    # copy, so readers using the old name still find the values
+    update_chunks(job, "data || " + moved, condition, params)
+    if job.table_column and job.table_column.name != job.new_name:
+        job.table_column.name = job.new_name
+        job.table_column.save()
+        job.table.bump_revision()
+    # move, picking up the values written under the old name meanwhile
+    update_chunks(job, "(data - %(key)s) || " + moved, condition, params)
+
+
+def delete(job):
+    params = {"key": job.old_name}
+    condition = "data ? %(key)s"
+    models.SchemaChange.objects.filter(pk=job.pk).update(rows_total=count_rows(job, condition, params))
+    update_chunks(job, "data - %(key)s", condition, params)
+
+
+def retype(job):
+    params = {"key": job.old_name}
+    assignment = "jsonb_set(data, ARRAY[%(key)s], coalesce({}, 'null'::jsonb))".format(CONVERSIONS[job.new_type])
+    condition = "data ? %(key)s AND jsonb_typeof(data -> %(key)s) <> 'null' AND NOT ({})".format(
+        CONVERTED[job.new_type]
+    )
+    failed_condition = "jsonb_typeof(data -> %(key)s) = 'null'"
+    models.SchemaChange.objects.filter(pk=job.pk).update(rows_total=count_rows(job, condition, params))
+
+    update_chunks(job, assignment, condition, params, failed_condition)
+
+    column = job.table_column
+    if column:
+        column.field_type = job.new_type
+        if job.new_type == "enum":
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    """
+                    SELECT DISTINCT data ->> %s FROM {entries}
+                    WHERE table_id = %s AND jsonb_typeof(data -> %s) = 'string'
+                    """.format(entries=models.Entry._meta.db_table),
+                    [job.old_name, job.table_id, job.old_name],
+                )
+                column.choices = sorted(row[0] for row in cursor.fetchall() if row[0])
+        column.save()
+        if job.new_type == "enum":
+            enums.register(column, column.choices)
+        else:
+            column.enum_values.all().delete()
+        job.table.bump_revision()
+
+    # rows written with the old type while the first pass ran
+    update_chunks(job, assignment, condition, params, failed_condition)
+
+
+RUNNERS = {
+    "rename": rename,
+    "delete": delete,
+    "retype": retype,
+}
+
+
+def run(job):
+    """
+    Run one claimed job to completion.
+    """
+    jobs = models.SchemaChange.objects.filter(pk=job.pk)
+    error = None
+    try:
+        RUNNERS[job.kind](job)
+        if job.kind == "retype" and job.table_column and job.table_column.unique:
+            # converted values may normalize differently; the heartbeat keeps
+            # a long rebuild from being taken over as stalled
+            duplicates = unique_keys.rebuild_table(job.table, progress=lambda: jobs.update(date_updated=timezone.now()))
+            if duplicates:
+                error = unique_keys.duplicates_message(duplicates)
+    except Exception as e:
+        jobs.update(status="failed", error=str(e), date_updated=timezone.now())
+        return
+
+    jobs.update(status="done", error=error, date_updated=timezone.now())
+
+
+def run_pending(table_id):
+    """
+    Run the pending jobs of a table in the order they were created. Jobs of
+    the same table never run concurrently: a worker that finds another job
+    of the table running leaves the pending ones to that worker, unless that
+    job has stalled, in which case it is run again.
+    """
+    while True:
+        stalled = timezone.now() - STALLED_AFTER
+        jobs = models.SchemaChange.objects.filter(table_id=table_id)
+        if jobs.filter(status="running", date_updated__gte=stalled).exists():
+            return
+        job = jobs.filter(Q(status="pending") | Q(status="running", date_updated__lt=stalled)).first()
+        if not job:
+            return
+        # matching the last update keeps two workers from taking over the same job
+        claimed = models.SchemaChange.objects.filter(
+            pk=job.pk, status=job.status, date_updated=job.date_updated
+        ).update(status="running", error=None, rows_done=0, rows_failed=0, date_updated=timezone.now())
+        if not claimed:
+            continue
+        job.status = "running"
+        run(job)
+
+
+def resume(job):
+    """
+    Queue a failed job to run again once the current transaction commits.
+    Returns False when the job did not fail.
+    """
+    from api import tasks
+
+    if not models.SchemaChange.objects.filter(pk=job.pk, status="failed").update(
+        status="pending", error=None, date_updated=timezone.now()
+    ):
+        return False
+    job.refresh_from_db()
+    table_id = job.table_id
+    transaction.on_commit(lambda: tasks.run_schema_changes.delay(table_id))
+    return True
+
+
+def resume_stalled():
+    """
+    Queue the tables whose running job stalled, so the job is taken over
+    even when no other change of the table comes along.
+    """
+    from api import tasks
+
+    stalled = timezone.now() - STALLED_AFTER
+    table_ids = set(
+        models.SchemaChange.objects.filter(status="running", date_updated__lt=stalled).values_list(
+            "table_id", flat=True
+        )
+    )
+    for table_id in table_ids:
+        tasks.run_schema_changes.delay(table_id)
+    return len(table_ids)
@@ -0,0 +1,86 @@
+"""
+Full text search over the text and enum columns of entries.
+
+Every entry keeps a ``search_vector`` built from the values of the text and
+enum columns of its table, served by a GIN index. Writers, bulk ones
+included, refresh the vectors of the entries they touched with
+``sync_entries``, column changes rebuild the whole table in chunks.
+"""
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection, transaction
+from django.db.models import F
+
+from api import models
+from api.utils import chunks
+
+SEARCHED_TYPES = ("text", "enum")
+
+
+def searched_columns(table, columns=None):
+    """
+    Return the names of the searched columns of a table, in a stable order.
+    """
+    if columns is None:
+        columns = table.fields.all()
+    return [x.name for x in sorted(columns, key=lambda x: x.pk) if x.field_type in SEARCHED_TYPES]
+
+
+def document(column_names):
+    """
+    Return the SQL expression of the search vector of an entry and its
+    parameters.
+    """
+    if not column_names:
+        return "NULL", []
+    values = ", ".join("data ->> %s" for x in column_names)
+    return "to_tsvector(%s::regconfig, concat_ws(' ', {}))".format(values), [settings.SEARCH_CONFIG] + column_names
+
+
+def update_entries(table, condition, params, columns=None):
+    expression, expression_params = document(searched_columns(table, columns))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "UPDATE {entries} SET search_vector = {expression} WHERE table_id = %s AND {condition}".format(
+                entries=connection.ops.quote_name(models.Entry._meta.db_table),
+                expression=expression,
+                condition=condition,
+            ),
+            expression_params + [table.pk] + params,
+        )
+
+
+def sync_entries(table, entries, columns=None):
+    """
+    Refresh the search vectors of the given entries.
+    """
+    if not entries:
+        return
+    update_entries(table, "id = ANY(%s)", [[entry.pk for entry in entries]], columns)
+
+
+def rebuild_table(table):
+    """
+    Recompute the search vectors of a table, one chunk of entries per
+    transaction.
+    """
+    columns = list(table.fields.all())
+    for after_id, last_id in chunks(table.pk):
+        with transaction.atomic():
+            update_entries(table, "id > %s AND id <= %s", [after_id, last_id], columns)
+
+
+def query(text):
+    return SearchQuery(text, config=settings.SEARCH_CONFIG, search_type="websearch")
+
+
+def search(queryset, text):
+    """
+    Filter a queryset of entries on a web search style query, annotating
+    the rank of every entry as ``search_rank``.
+    """
+    search_query = query(text)
+    return queryset.filter(search_vector=search_query).annotate(
+        search_rank=SearchRank(F("search_vector"), search_query)
+    )
@@ -6,7 +6,7 @@ class CsvImportListSerializer(serializers.ModelSerializer):
     class Meta:
         model = models.CsvImport
         fields = ["url", "table", "id",
-                  "file", "errors_count", "import_count_created", "import_count_updated"]
+                  "file", "status", "errors_count", "import_count_created", "import_count_updated"]
 
 
 class CsvFieldMapSerializer(serializers.ModelSerializer):
@@ -35,6 +35,10 @@ class CsvImportSerializer(serializers.ModelSerializer):
             "file",
             "filename",
             "delimiter",
+            "file_format",
+            "status",
+            "error",
+            "rows_processed",
             "errors_count",
             "import_count_created",
             "import_count_updated",
@@ -43,4 +47,37 @@ class CsvImportSerializer(serializers.ModelSerializer):
         ]
 
     def get_filename(self, obj):
-        return obj.file.name.split('/')[-1]
\ No newline at end of file
+        return obj.file.name.split('/')[-1]
+
+
+class CsvImportErrorSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = models.CsvImportError
+        fields = ["row_number", "row", "errors"]
+
+
+class CsvImportProgressSerializer(serializers.ModelSerializer):
+    rows_per_second = serializers.FloatField(read_only=True)
+    eta_seconds = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = models.CsvImport
+        fields = [
+            "id",
+            "table",
+            "status",
+            "error",
+            "rows_processed",
+            "bytes_read",
+            "bytes_total",
+            "parts_total",
+            "parts_done",
+            "errors_count",
+            "import_count_created",
+            "import_count_updated",
+            "rows_per_second",
+            "eta_seconds",
+            "date_started",
+            "date_updated",
+            "date_finished",
+        ]
@@ -11,13 +11,14 @@ class DatabaseTableListDataSerializer(serializers.ModelSerializer):
     last_edit_user = OwnerSerializer()
 
     def get_entries(self, obj):
-        return obj.entries.count()
+        return obj.entries_count
 
     class Meta:
         model = models.Table
         fields = [
             "name",
             "entries",
+            "revision",
             "last_edit_date",
             "last_edit_user",
         ]
@@ -34,7 +35,7 @@ class DatabaseTableListSerializer(serializers.ModelSerializer):
 
     def get_user_permissions(self, obj):
         user = self.context["request"].user
-        checker = ObjectPermissionChecker(user)
+        checker = self.context.get("permission_checker") or ObjectPermissionChecker(user)
 
         user_perms = checker.get_perms(obj)
         return user_perms
@@ -62,24 +63,28 @@ class DatabaseSerializer(serializers.HyperlinkedModelSerializer):
         user = self.context['request'].user
         checker = ObjectPermissionChecker(user)
 
-        tables = obj.active_tables()
+        tables = list(obj.active_tables())
+        checker.prefetch_perms(tables)
         queryset = []
         for table in tables:
             user_perms = checker.get_perms(table)
             if 'view_table' in user_perms:
                 queryset.append(table)
-        serializer = DatabaseTableListSerializer(queryset, many=True, read_only=True, context=self.context)
+        serializer = DatabaseTableListSerializer(
+            queryset, many=True, read_only=True, context=dict(self.context, permission_checker=checker))
         return serializer.data
 
     def get_archived_tables(self, obj):
         user = self.context['request'].user
         checker = ObjectPermissionChecker(user)
 
-        tables = obj.archived_tables()
+        tables = list(obj.archived_tables())
+        checker.prefetch_perms(tables)
         queryset = []
         for table in tables:
             user_perms = checker.get_perms(table)
             if 'view_table' in user_perms:
                 queryset.append(table)
-        serializer = DatabaseTableListSerializer(queryset, many=True, read_only=True, context=self.context)
+        serializer = DatabaseTableListSerializer(
+            queryset, many=True, read_only=True, context=dict(self.context, permission_checker=checker))
         return serializer.data
\ No newline at end of file
@@ -1,5 +1,6 @@
 from rest_framework import serializers
-from api import models
+from api import models, projections, search, unique_keys
+from django.db import IntegrityError, transaction
 from django.urls import reverse
 from datetime import datetime
 from dateutil.parser import isoparse
@@ -118,19 +119,7 @@ class EntrySerializer(serializers.ModelSerializer):
         validated_data["table"] = table
 
         fields = {x.name: x for x in table.fields.all()}
-        unique_fields = [x.name for x in table.fields.all() if x.unique==True]
-        if unique_fields:
-            data_query = {}
-            for field in unique_fields:
-                if validated_data['data'].get(field, None):
-                    data_query[field] = validated_data['data'].get(field, None)
-            if models.Entry.objects.filter(data__contains=data_query).exists():
-                if len(unique_fields) > 1:
-                    msg = f"Câmpurile {', '.join(unique_fields)} trebuie sa fie unice împreuna"
-                else:
-                    msg = f"Câmpul {unique_fields[0]} trebuie sa fie unic în tabel"
-
-                raise serializers.ValidationError(msg)
+        unique_fields = unique_keys.unique_columns(table, fields.values())
         for field, field_obj in fields.items():
             value = validated_data['data'].get(field, None)
             if field_obj.required:
@@ -148,11 +137,21 @@ class EntrySerializer(serializers.ModelSerializer):
             elif value and field_obj.field_type == "int":
                 validated_data['data'][field] = int(validated_data['data'][field])
 
-
-        
-        instance = models.Entry.objects.create(**validated_data)
-        instance.clean_fields()
-        instance.save()
+        validated_data["unique_key"] = unique_keys.compute(validated_data["data"], unique_fields)
+        if validated_data["unique_key"] and table.entries.filter(unique_key=validated_data["unique_key"]).exists():
+            raise serializers.ValidationError(unique_keys.error_message(unique_fields))
+
+        try:
+            with transaction.atomic():
+                instance = models.Entry.objects.create(**validated_data)
+                instance.clean_fields()
+                instance.save()
+                instance.table.bump_revision(entries_delta=1)
+        except IntegrityError:
+            # a concurrent write took the key
+            raise serializers.ValidationError(unique_keys.error_message(unique_fields))
+        projections.sync_entries(instance.table, [instance])
+        search.sync_entries(instance.table, [instance])
         instance.table.last_edit_user = self.context["request"].user
         instance.table.last_edit_date = datetime.now()
         instance.table.save()
@@ -162,19 +161,7 @@ class EntrySerializer(serializers.ModelSerializer):
         table = instance.table
 
         fields = {x.name: x for x in table.fields.all()}
-        unique_fields = [x.name for x in table.fields.all() if x.unique==True]
-        if unique_fields:
-            data_query = {}
-            for field in unique_fields:
-                if self.initial_data.get(field, None):
-                    data_query[field] = self.initial_data.get(field, None)
-            if models.Entry.objects.filter(data__contains=data_query).exclude(pk=instance.pk).exists():
-                if len(unique_fields) > 1:
-                    msg = f"Câmpurile {', '.join(unique_fields)} trebuie sa fie unice împreuna"
-                else:
-                    msg = f"Câmpul {unique_fields[0]} trebuie sa fie unic în tabel"
-
-                raise serializers.ValidationError(msg)
+        unique_fields = unique_keys.unique_columns(table, fields.values())
         for field, field_obj in fields.items():
             value = self.initial_data.get(field, None)
             if field_obj.required:
@@ -193,10 +180,22 @@ class EntrySerializer(serializers.ModelSerializer):
                 self.initial_data[field] = int(self.initial_data[field])
 
         instance.data = self.initial_data
+        instance.unique_key = unique_keys.compute(instance.data, unique_fields)
+        if instance.unique_key and table.entries.filter(unique_key=instance.unique_key).exclude(pk=instance.pk).exists():
+            raise serializers.ValidationError(unique_keys.error_message(unique_fields))
+
         instance.table.last_edit_user = self.context["request"].user
         instance.table.last_edit_date = datetime.now()
-        instance.table.save()
-        instance.save()
+        try:
+            with transaction.atomic():
+                instance.table.save()
+                instance.save()
+        except IntegrityError:
+            # a concurrent write took the key
+            raise serializers.ValidationError(unique_keys.error_message(unique_fields))
+        projections.sync_entries(instance.table, [instance])
+        search.sync_entries(instance.table, [instance])
+        instance.table.bump_revision()
         return instance
 
     def get_url(self, obj):
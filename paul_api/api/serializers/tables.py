@@ -6,7 +6,7 @@ from rest_framework import serializers
 from rest_framework_guardian.serializers import ObjectPermissionsAssignmentMixin
 
 from api.serializers.users import OwnerSerializer, UserSerializer
-from api import models, utils
+from api import models, schema_changes, unique_keys, utils
 from pprint import pprint
 
 
@@ -61,6 +61,7 @@ class TableCreateSerializer(ObjectPermissionsAssignmentMixin, serializers.ModelS
             "last_edit_user",
             "last_edit_date",
             "active",
+            "typed_projection",
         ]
         validators = [
             serializers.UniqueTogetherValidator(
@@ -75,19 +76,48 @@ class TableCreateSerializer(ObjectPermissionsAssignmentMixin, serializers.ModelS
             table = models.Table.objects.get(pk=data["id"])
             if table.entries.exists():
                 if "fields" in data.keys():
-                    for field in data.get("fields"):
-                        if "id" in field.keys():
-                            field_obj = models.TableColumn.objects.get(pk=field["id"])
-                            if field_obj.field_type != field["field_type"]:
-                                raise serializers.ValidationError(
-                                    {
-                                        "fields-{}".format(
-                                            field["id"]
-                                        ): "Changing field type is not permited on a table with entries"
-                                    }
-                                )
+                    self.validate_pending_names(table, data["fields"])
+                    self.validate_unique_columns(table, data["fields"])
         return data
 
+    def validate_pending_names(self, table, fields):
+        """
+        Refuse to reuse a column name whose values are still being moved or
+        removed by a schema change.
+        """
+        pending_names = schema_changes.pending_names(table)
+        errors = {}
+        for field in fields:
+            name = field.get("name") or utils.snake_case(field.get("display_name", ""))
+            if name in pending_names:
+                key = "fields-{}".format(field["id"]) if "id" in field else "fields"
+                errors[key] = "Coloana {} este în curs de modificare".format(name)
+        if errors:
+            raise serializers.ValidationError(errors)
+
+    def validate_unique_columns(self, table, fields):
+        """
+        Refuse to mark columns as unique when the existing entries collide.
+        """
+        columns = {x.pk: x for x in table.fields.all()}
+        old_unique = unique_keys.unique_columns(table, columns.values())
+        new_columns = [
+            columns[field["id"]] for field in fields
+            if field.get("unique") and field.get("id") in columns
+        ]
+        new_unique = [x.name for x in sorted(new_columns, key=lambda x: x.pk)]
+        # adding columns to an existing unique set can not create collisions
+        if not new_unique or (old_unique and set(new_unique) >= set(old_unique)):
+            return
+        if unique_keys.has_duplicates(table, new_unique):
+            changed_columns = [x for x in new_columns if x.name not in old_unique] or new_columns
+            raise serializers.ValidationError(
+                {
+                    "fields-{}".format(column.pk): "Câmpul {} conține valori duplicate".format(column.name)
+                    for column in changed_columns
+                }
+            )
+
     def create(self, validated_data):
         temp_fields = []
         if "fields" in validated_data.keys():
@@ -106,6 +136,7 @@ class TableCreateSerializer(ObjectPermissionsAssignmentMixin, serializers.ModelS
         return new_table
 
     def update(self, instance, validated_data):
+        self.schema_changes = []
         if self.partial:
             if validated_data.get('filters'):
                 filters = validated_data.pop('filters')
@@ -116,13 +147,21 @@ class TableCreateSerializer(ObjectPermissionsAssignmentMixin, serializers.ModelS
                 if default_fields:
                     for field in default_fields:
                         instance.default_fields.add(field)
+            if "typed_projection" in validated_data:
+                instance.typed_projection = validated_data["typed_projection"]
+                instance.save()
             instance.refresh_from_db()
         else:
             instance.name = validated_data.get("name")
             instance.active = validated_data.get("active")
             instance.database = validated_data.get("database")
+            instance.typed_projection = validated_data.get("typed_projection", instance.typed_projection)
             instance.last_edit_user = self.context["request"].user
             if "fields" in validated_data.keys():
+                # Entries are migrated by background schema changes, the
+                # column name and type switch once their values are moved
+                has_entries = instance.entries.exists()
+                owner = self.context["request"].user
                 # Check to see if we need to delete any field
                 old_fields_ids = set(instance.fields.values_list("id", flat=True))
                 new_fields_ids = set([x.get("id") for x in validated_data.get("fields")])
@@ -130,21 +169,27 @@ class TableCreateSerializer(ObjectPermissionsAssignmentMixin, serializers.ModelS
                     field = models.TableColumn.objects.get(pk=id_to_remove)
                     field_name = field.name
                     field.delete()
-                    for entry in instance.entries.all():
-                        del entry.data[field_name]
-                        entry.save()
+                    if has_entries:
+                        self.schema_changes.append(schema_changes.create(
+                            instance, "delete", field_name, owner=owner))
                 # Create or update fields
                 for field in validated_data.pop("fields"):
                     if "id" in field.keys():
                         field_obj = models.TableColumn.objects.get(pk=field["id"])
                         old_name = field_obj.name
                         new_name = field["name"]
-                        if old_name != new_name:
-
-                            for entry in instance.entries.all():
-                                entry.data[new_name] = entry.data[old_name]
-                                del entry.data[old_name]
-                                entry.save()
+                        old_type = field_obj.field_type
+                        new_type = field.get("field_type", old_type)
+                        if has_entries and old_type != new_type:
+                            field["field_type"] = old_type
+                            self.schema_changes.append(schema_changes.create(
+                                instance, "retype", old_name, column=field_obj,
+                                old_type=old_type, new_type=new_type, owner=owner))
+                        if has_entries and old_name != new_name:
+                            field["name"] = old_name
+                            self.schema_changes.append(schema_changes.create(
+                                instance, "rename", old_name, column=field_obj,
+                                new_name=new_name, owner=owner))
                         field_obj.__dict__.update(field)
                         field_obj.save()
                     else:
@@ -152,6 +197,7 @@ class TableCreateSerializer(ObjectPermissionsAssignmentMixin, serializers.ModelS
                         field["table"] = instance
                         field["name"] = utils.snake_case(field["display_name"])
                         models.TableColumn.objects.create(**field)
+                instance.bump_revision()
 
             instance.save()
         return instance
@@ -190,6 +236,8 @@ class TableSerializer(serializers.ModelSerializer):
             "last_edit_date",
             "date_created",
             "active",
+            "typed_projection",
+            "revision",
             "default_fields",
             "fields",
             "filters"
@@ -205,3 +253,46 @@ class TableSerializer(serializers.ModelSerializer):
 
 
 
+
+
+class SchemaChangeSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = models.SchemaChange
+        fields = [
+            "url",
+            "id",
+            "table",
+            "table_column",
+            "kind",
+            "old_name",
+            "new_name",
+            "old_type",
+            "new_type",
+            "status",
+            "error",
+            "rows_total",
+            "rows_done",
+            "rows_failed",
+            "date_created",
+            "date_updated",
+        ]
+
+
+class ExportJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = models.ExportJob
+        fields = [
+            "url",
+            "id",
+            "kind",
+            "table",
+            "filter",
+            "params",
+            "file_format",
+            "status",
+            "error",
+            "file",
+            "date_created",
+            "date_started",
+            "date_finished",
+        ]
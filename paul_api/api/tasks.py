@@ -0,0 +1,93 @@
+from celery import shared_task
+from django.db.models import Count, F
+
+from api import export_jobs, imports, indexes, models, projections, schema_changes, search, unique_keys
+
+
+@shared_task
+def build_column_index(column_index_id):
+    indexes.build_index(column_index_id)
+
+
+@shared_task
+def drop_column_index(name):
+    indexes.drop_index(name)
+
+
+@shared_task
+def rebuild_column_projection(column_id):
+    column = models.TableColumn.objects.filter(pk=column_id).first()
+    if column:
+        projections.rebuild_column(column)
+
+
+@shared_task
+def rebuild_table_projection(table_id):
+    table = models.Table.objects.filter(pk=table_id).first()
+    if table:
+        projections.rebuild_table(table)
+
+
+@shared_task
+def rebuild_unique_keys(table_id):
+    table = models.Table.objects.filter(pk=table_id).first()
+    if table:
+        return unique_keys.rebuild_table(table)
+
+
+@shared_task
+def rebuild_search_vectors(table_id):
+    table = models.Table.objects.filter(pk=table_id).first()
+    if table:
+        search.rebuild_table(table)
+
+
+@shared_task
+def run_csv_import(csv_import_id):
+    imports.run(csv_import_id)
+
+
+@shared_task
+def run_csv_import_part(checkpoint_id, run=0):
+    return imports.run_part(checkpoint_id, run)
+
+
+@shared_task
+def finish_csv_import(results, csv_import_id, run=0):
+    imports.finish(results, csv_import_id, run)
+
+
+@shared_task
+def run_export_job(job_id):
+    export_jobs.run(job_id)
+
+
+@shared_task
+def delete_expired_export_jobs():
+    export_jobs.delete_expired()
+
+
+@shared_task
+def run_schema_changes(table_id):
+    schema_changes.run_pending(table_id)
+
+
+@shared_task
+def resume_stalled_schema_changes():
+    return schema_changes.resume_stalled()
+
+
+@shared_task
+def reconcile_entries_count():
+    """
+    Fix the entries count of tables that drifted, e.g. after an import that
+    was interrupted.
+    """
+    tables = models.Table.objects.annotate(actual_count=Count("entries")).exclude(entries_count=F("actual_count"))
+    fixed = 0
+    for table in tables:
+        # a count changed since it was read belongs to a concurrent write
+        fixed += models.Table.objects.filter(pk=table.pk, entries_count=table.entries_count).update(
+            entries_count=table.actual_count
+        )
+    return fixed
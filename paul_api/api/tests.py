@@ -1,3 +1,148 @@
-from django.test import TestCase
+import datetime
+import io
+import shutil
+import tempfile
 
-# Create your tests here.
+import openpyxl
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+
+from api import import_sources, imports, models, partitions
+
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(
+    DEFAULT_FILE_STORAGE="django.core.files.storage.FileSystemStorage",
+    MEDIA_ROOT=MEDIA_ROOT,
+    CSV_IMPORT_WORKERS=1,
+)
+class XlsxImportTest(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def upload(self, rows):
+        workbook = openpyxl.Workbook()
+        for row in rows:
+            workbook.active.append(row)
+        content = io.BytesIO()
+        workbook.save(content)
+        return SimpleUploadedFile("rows.xlsx", content.getvalue())
+
+    def test_import_reads_the_converted_csv(self):
+        owner = User.objects.create(username="owner")
+        database = models.Database.objects.create(name="Database")
+        table = models.Table.objects.create(name="Rows", database=database, owner=owner)
+        columns = [("name", "text", None), ("count", "int", None), ("day", "date", "%Y-%m-%d")]
+
+        csv_import = models.CsvImport.objects.create(
+            file=self.upload([
+                ["name", "count", "day"],
+                ["first", 1, datetime.datetime(2020, 1, 2)],
+                ["second", 2, datetime.datetime(2020, 1, 3)],
+            ]),
+            file_format="xlsx",
+            table=table,
+        )
+        for name, field_type, field_format in columns:
+            column = models.TableColumn.objects.create(table=table, name=name, field_type=field_type)
+            models.CsvFieldMap.objects.create(
+                csv_import=csv_import, original_name=name, field_type=field_type, field_format=field_format,
+                table_column=column)
+
+        imports.start(csv_import, table)
+        imports.run(csv_import.pk)
+
+        csv_import.refresh_from_db()
+        self.assertEqual(csv_import.status, "done", csv_import.error)
+        self.assertEqual(csv_import.file_format, "csv")
+        self.assertTrue(csv_import.file.name.endswith(".csv"))
+        self.assertEqual(csv_import.errors_count, 0)
+        self.assertEqual(csv_import.import_count_created, 2)
+        self.assertEqual(
+            sorted(table.entries.values_list("data", flat=True), key=lambda data: data["name"]),
+            [
+                {"name": "first", "count": 1, "day": "2020-01-02"},
+                {"name": "second", "count": 2, "day": "2020-01-03"},
+            ],
+        )
+
+    def test_ndjson_import_reports_invalid_lines(self):
+        owner = User.objects.create(username="owner")
+        database = models.Database.objects.create(name="Database")
+        table = models.Table.objects.create(name="Rows", database=database, owner=owner)
+        content = b'{"name": "first"}\nnot json\n{"name": "second", "count": 2}\n'
+
+        csv_import = models.CsvImport.objects.create(
+            file=SimpleUploadedFile("rows.ndjson", content), file_format="ndjson", table=table)
+        for name, field_type in [("name", "text"), ("count", "int")]:
+            column = models.TableColumn.objects.create(table=table, name=name, field_type=field_type)
+            models.CsvFieldMap.objects.create(
+                csv_import=csv_import, original_name=name, field_type=field_type, table_column=column)
+
+        imports.start(csv_import, table)
+        imports.run(csv_import.pk)
+
+        csv_import.refresh_from_db()
+        self.assertEqual(csv_import.status, "done", csv_import.error)
+        self.assertEqual(csv_import.import_count_created, 2)
+        self.assertEqual(csv_import.errors_count, 1)
+        self.assertEqual(csv_import.checkpoints.get().fieldnames, ["name", "count"])
+        fieldnames, rows = imports.error_export(csv_import)
+        self.assertEqual(fieldnames, ["name", "count", import_sources.INVALID_LINE, imports.ERRORS_COLUMN])
+        self.assertEqual(
+            list(rows),
+            [{import_sources.INVALID_LINE: "not json", imports.ERRORS_COLUMN: import_sources.INVALID_LINE_ERROR}],
+        )
+
+
+@override_settings(
+    DEFAULT_FILE_STORAGE="django.core.files.storage.FileSystemStorage",
+    MEDIA_ROOT=MEDIA_ROOT,
+    CSV_IMPORT_WORKERS=1,
+)
+class PartitionedUpsertImportTest(TestCase):
+    def setUp(self):
+        call_command("partition-entries")
+
+    def tearDown(self):
+        # the partitioning is rolled back with the test, the cached flag is not
+        partitions.partitioned = False
+
+    def run_import(self, table, content):
+        csv_import = models.CsvImport.objects.create(
+            file=SimpleUploadedFile("rows.csv", content), file_format="csv", table=table)
+        for column in table.fields.all():
+            models.CsvFieldMap.objects.create(
+                csv_import=csv_import, original_name=column.name, field_type=column.field_type,
+                table_column=column)
+        imports.start(csv_import, table)
+        imports.run(csv_import.pk)
+        csv_import.refresh_from_db()
+        return csv_import
+
+    def test_upsert_import_into_a_partition(self):
+        self.assertTrue(partitions.is_partitioned())
+        owner = User.objects.create(username="owner")
+        database = models.Database.objects.create(name="Database")
+        table = models.Table.objects.create(name="Rows", database=database, owner=owner)
+        models.TableColumn.objects.create(table=table, name="code", field_type="text", unique=True)
+        models.TableColumn.objects.create(table=table, name="name", field_type="text")
+        self.assertTrue(partitions.partition_exists(table.pk))
+
+        first = self.run_import(table, b"code,name\na,first\nb,second\n")
+        self.assertEqual(first.status, "done", first.error)
+        self.assertEqual((first.import_count_created, first.import_count_updated, first.errors_count), (2, 0, 0))
+
+        second = self.run_import(table, b"code,name\na,changed\nc,third\n")
+        self.assertEqual(second.status, "done", second.error)
+        self.assertEqual((second.import_count_created, second.import_count_updated, second.errors_count), (1, 1, 0))
+        self.assertEqual(
+            dict(table.entries.values_list("data__code", "data__name")),
+            {"a": "changed", "b": "second", "c": "third"},
+        )
@@ -0,0 +1,122 @@
+"""
+Proposed column types of an upload, from a sample of its first rows.
+
+The non-empty values of a column are converted with the converters of the
+import for each candidate type, from the most to the least specific: int,
+float, then date in each of ``DATE_FORMATS``. The first type that fails on
+at most ``MAX_FAILURE_RATE`` of the values is proposed, along with its
+confidence and the sample rows it would fail on. Columns no candidate fits
+are text, or enum when they have few distinct values.
+
+Values with leading zeros or more than ``MAX_NUMBER_DIGITS`` digits are
+codes, phone numbers or identifiers that a number would mangle, so a
+column holding any of them is never proposed as int or float. The upload
+stores a proposed type as the default of its mapping only when no sample
+value fails it (see ``stored_type``), the proposal itself is returned for
+the client to offer.
+"""
+
+from api import imports
+
+SAMPLE_ROWS = 2000
+MAX_FAILURE_RATE = 0.01
+DATE_FORMATS = [
+    "%Y-%m-%d",
+    "%d.%m.%Y",
+    "%d/%m/%Y",
+    "%m/%d/%Y",
+    "%d-%m-%Y",
+    "%Y/%m/%d",
+    "%d.%m.%y",
+    "%d/%m/%y",
+    "%Y-%m-%d %H:%M:%S",
+    "%d.%m.%Y %H:%M",
+]
+ENUM_MAX_VALUES = 20
+# at most one distinct value for this many values
+ENUM_MIN_REPEATS = 5
+# digits a float holds exactly
+MAX_NUMBER_DIGITS = 15
+NUMBER_TYPES = ("int", "float")
+
+
+def failures(values, convert, limit):
+    """
+    Count the values ``convert`` fails on, or return None past ``limit``.
+    """
+    count = 0
+    for value in values:
+        try:
+            convert(value)
+        except Exception:
+            count += 1
+            if count > limit:
+                return None
+    return count
+
+
+def is_code(value):
+    """
+    Whether a numeric looking value would lose its leading zeros or digits
+    as a number.
+    """
+    digits = value.strip().lstrip("+-")
+    integral = digits.split(".")[0]
+    if len(integral) > 1 and integral.startswith("0"):
+        return True
+    return sum(x.isdigit() for x in digits) > MAX_NUMBER_DIGITS
+
+
+def infer_column(values):
+    values = [value for value in values if value]
+    distinct = len(set(values))
+    proposal = {
+        "field_type": "text",
+        "field_format": None,
+        "confidence": 1.0 if values else 0.0,
+        "failing_rows": 0,
+        "enum_candidate": 0 < distinct <= ENUM_MAX_VALUES and distinct * ENUM_MIN_REPEATS <= len(values),
+        "sample_size": len(values),
+    }
+    if not values:
+        return proposal
+
+    limit = int(len(values) * MAX_FAILURE_RATE)
+    candidates = [("int", None, int), ("float", None, float)] + [
+        ("date", field_format, imports.date_converter(field_format)) for field_format in DATE_FORMATS
+    ]
+    if any(is_code(value) for value in values):
+        candidates = [x for x in candidates if x[0] not in NUMBER_TYPES]
+    for field_type, field_format, convert in candidates:
+        count = failures(values, convert, limit)
+        if count is not None:
+            proposal.update(
+                field_type=field_type,
+                field_format=field_format,
+                confidence=round(1 - count / len(values), 3),
+                failing_rows=count,
+            )
+            return proposal
+
+    if proposal["enum_candidate"]:
+        proposal["field_type"] = "enum"
+    return proposal
+
+
+def stored_type(proposal):
+    """
+    Field type and format to store for a proposal: text unless no sample
+    value fails the proposed type.
+    """
+    if proposal["failing_rows"]:
+        return "text", None
+    return proposal["field_type"], proposal["field_format"]
+
+
+def infer(fieldnames, rows):
+    """
+    Return a proposal per column of a sample of rows: the field type and
+    date format, the confidence, the number of sample rows that would fail
+    and whether the column looks like an enum.
+    """
+    return {name: infer_column([row.get(name) for row in rows]) for name in fieldnames}
@@ -0,0 +1,162 @@
+"""
+Digest of the unique columns of an entry.
+
+Entries of a table with ``unique=True`` columns store an md5 digest of the
+values of those columns in ``Entry.unique_key``. The (table, unique_key)
+unique constraint turns uniqueness checks into index lookups and makes
+concurrent writers fail on the constraint instead of racing a containment
+scan. Entries whose unique columns are all empty get no key and are not
+constrained.
+
+``has_duplicates`` checks the existing entries with a single GROUP BY
+query on the values normalized as ``normalize`` does.
+"""
+
+import hashlib
+
+from django.db import connection, transaction
+
+from api import models, utils
+
+SEPARATOR = "\x1f"
+REBUILD_BATCH_SIZE = 2000
+
+# SQL counterpart of normalize for the value of a key
+NORMALIZED_SQL = """
+CASE jsonb_typeof(data -> {key})
+    WHEN 'number' THEN CASE WHEN (data ->> {key})::numeric %% 1 = 0
+        THEN trunc((data ->> {key})::numeric)::text
+        ELSE (data ->> {key})::float8::text END
+    WHEN 'boolean' THEN initcap(data ->> {key})
+    ELSE coalesce(data ->> {key}, '')
+END
+"""
+
+
+def unique_columns(table, columns=None):
+    """
+    Return the names of the unique columns of a table, in a stable order.
+    """
+    if columns is None:
+        columns = table.fields.all()
+    return [x.name for x in sorted(columns, key=lambda x: x.pk) if x.unique]
+
+
+def normalize(value):
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        # 3 and 3.0 are the same value of a float column
+        value = int(value)
+    return str(value)
+
+
+def compute(data, column_names):
+    if not column_names:
+        return None
+    values = [normalize((data or {}).get(name)) for name in column_names]
+    if not any(values):
+        return None
+    return hashlib.md5(SEPARATOR.join(values).encode("utf-8")).hexdigest()
+
+
+def error_message(column_names):
+    if len(column_names) > 1:
+        return f"Câmpurile {', '.join(column_names)} trebuie sa fie unice împreuna"
+    return f"Câmpul {column_names[0]} trebuie sa fie unic în tabel"
+
+
+def duplicates_message(count):
+    return f"{count} înregistrări au valori duplicate în câmpurile unice și nu sunt verificate"
+
+
+def has_duplicates(table, column_names):
+    """
+    Check if the entries of a table would collide on the given columns.
+    """
+    values = [
+        "{} AS value_{}".format(NORMALIZED_SQL.format(key="%(key_{})s".format(i)), i) for i in range(len(column_names))
+    ]
+    names = ", ".join("value_{}".format(i) for i in range(len(column_names)))
+    params = {"key_{}".format(i): name for i, name in enumerate(column_names)}
+    params["table_id"] = table.pk
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT 1 FROM (
+                SELECT {values} FROM {entries} WHERE table_id = %(table_id)s
+            ) AS normalized
+            WHERE concat({names}) <> ''
+            GROUP BY {names}
+            HAVING count(*) > 1
+            LIMIT 1
+            """.format(
+                values=", ".join(values),
+                names=names,
+                entries=connection.ops.quote_name(models.Entry._meta.db_table),
+            ),
+            params,
+        )
+        return cursor.fetchone() is not None
+
+
+def chunk_entries(table, after_id, last_id):
+    return table.entries.filter(id__gt=after_id, id__lte=last_id).only("id", "data", "unique_key").order_by("id")
+
+
+def rebuild_table(table, progress=None):
+    """
+    Recompute the unique keys of all the entries of a table, one chunk of
+    entries per transaction, calling ``progress`` after every chunk. When
+    entries collide, the oldest one keeps the key. Returns the number of
+    entries left without a key because of a collision, which callers
+    report.
+
+    A first pass clears the keys that change or collide, so keys moving
+    between rows never collide midway, and a second one writes the new
+    keys. Entries whose key does not change are not written.
+    """
+    column_names = unique_columns(table)
+    seen = set()
+    for after_id, last_id in utils.chunks(table.pk):
+        with transaction.atomic():
+            cleared = []
+            for entry in chunk_entries(table, after_id, last_id):
+                key = compute(entry.data, column_names)
+                if entry.unique_key and (entry.unique_key != key or key in seen):
+                    cleared.append(entry.pk)
+                if key:
+                    seen.add(key)
+            models.Entry.objects.filter(pk__in=cleared).update(unique_key=None)
+        if progress:
+            progress()
+    if not column_names:
+        return 0
+
+    duplicates = 0
+    seen = set()
+    for after_id, last_id in utils.chunks(table.pk):
+        with transaction.atomic():
+            batch = []
+            for entry in chunk_entries(table, after_id, last_id):
+                key = compute(entry.data, column_names)
+                if key is None:
+                    continue
+                if key in seen:
+                    duplicates += 1
+                    continue
+                seen.add(key)
+                if entry.unique_key != key:
+                    entry.unique_key = key
+                    batch.append(entry)
+            # keys taken by rows written since the first pass stay with them
+            taken = set(
+                table.entries.filter(unique_key__in=[x.unique_key for x in batch]).values_list("unique_key", flat=True)
+            )
+            duplicates += sum(1 for x in batch if x.unique_key in taken)
+            models.Entry.objects.bulk_update(
+                [x for x in batch if x.unique_key not in taken], ["unique_key"], batch_size=REBUILD_BATCH_SIZE
+            )
+        if progress:
+            progress()
+    return duplicates
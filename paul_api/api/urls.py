@@ -15,7 +15,9 @@ router.register(r"users", views.UserViewSet)
 router.register(r"databases", views.DatabaseViewSet)
 router.register(r"filters", views.FilterViewSet)
 router.register(r"tables", views.TableViewSet, basename="table")
+router.register(r"schema-changes", views.SchemaChangeViewSet)
 router.register(r"csv-imports", views.CsvImportViewSet)
+router.register(r"export-jobs", views.ExportJobViewSet)
 router.register(r"charts", views.ChartViewSet)
 router.register(r"cards", views.CardViewSet)
 
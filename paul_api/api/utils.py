@@ -1,6 +1,7 @@
+from django.db import connection
 from django.db.models import (
     Count, Sum, Min, Max, Avg,
-    DateTimeField, CharField, FloatField, IntegerField, Q)
+    DateTimeField, CharField, FloatField, IntegerField, F, Q)
 from django.db.models.functions import Trunc, Cast
 from django.contrib.postgres.fields.jsonb import KeyTextTransform
 from django.urls import reverse
@@ -14,7 +15,7 @@ from collections import OrderedDict
 import inflection
 
 # from api.views import FilterViewSet
-from . import models
+from . import enums, models, projections
 
 from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
@@ -22,6 +23,9 @@ import requests
 import re
 from pprint import pprint
 
+# entries per chunk of the set based statements run over a whole table
+CHUNK_SIZE = 5000
+
 DB_FUNCTIONS = {
     "Count": Count,
     "Sum": Sum,
@@ -31,6 +35,28 @@ DB_FUNCTIONS = {
 }
 
 
+def chunks(table_id):
+    """
+    Yield (after_id, last_id) ranges of CHUNK_SIZE entries of a table.
+    """
+    after_id = 0
+    while True:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT max(id), count(*) FROM (
+                    SELECT id FROM {entries} WHERE table_id = %s AND id > %s ORDER BY id LIMIT %s
+                ) AS chunk
+                """.format(entries=models.Entry._meta.db_table),
+                [table_id, after_id, CHUNK_SIZE],
+            )
+            last_id, count = cursor.fetchone()
+        if not count:
+            return
+        yield after_id, last_id
+        after_id = last_id
+
+
 def send_email(template, context, subject, to):
     html = get_template(template)
     html_content = html.render(context)
@@ -47,138 +73,63 @@ def snake_case(text):
     return re.sub('_+', '_', value)
 
 
-def import_csv(reader, table, csv_import=None):
-    errors_count = 0
-    import_count_created = 0
-    import_count_updated = 0
-    errors = []
-    if csv_import:
-        csv_field_mapping = {x.original_name: x for x in csv_import.csv_field_mapping.exclude(table_column=None)}
-    else:
-        csv_field_mapping = {x.original_name: x for x in table.csv_field_mapping.all()}
-    table_fields = {x.name: x for x in table.fields.all()}
-    field_choices = {x.name: x.choices for x in table.fields.all()}
-    i = 0
-    unique_fields = {field_map.table_column.name:field_map.original_name for field, field_map in csv_field_mapping.items() if field_map.unique==True}
-    for row in reader:
-        i += 1
-        entry_dict = {}
-        error_in_row = False
-        errors_in_row = {}
-        
-        try:
-            for key, field in csv_field_mapping.items():
-                if csv_import:
-                    if field.table_column:
-                        field_name = field.table_column.name
-                        field_type = field.table_column.field_type
-                else:
-                    field_name = snake_case(field.display_name)
-                    field_type = field.field_type
-                try:
-                    if row[key]:
-                        if field_type == "int":
-                            entry_dict[field_name] = int(row[key])
-                        elif field_type == "float":
-                            entry_dict[field_name] = float(row[key])
-                        elif field_type == "date":
-                            value = datetime.strptime(row[key], field.field_format)
-                            entry_dict[field_name] = value.strftime('%Y-%m-%d')
-                        elif field_type == "enum":
-                            value = row[key]
-                            if not field_choices[field_name]:
-                                field_choices[field_name] = []
-                            if value not in field_choices[field_name]:
-                                field_choices[field_name].append(value)
-                                table_fields[field_name].choices = list(set(field_choices[field_name]))
-                                table_fields[field_name].save()
-                            entry_dict[field_name] = value
-                        else:
-                            entry_dict[field_name] = row[key]
-                    else:
-                        print(table_fields)
-                        print(csv_field_mapping)
-                        if table_fields[field_name].required or csv_field_mapping[key].required:
-                            error_in_row = True
-                            errors_in_row[key] = "Acest câmp este obligatoriu"
-                        entry_dict[field_name] = None
-                except Exception as e:
-                    # print(e)
-                    error_in_row = True
-                    errors_in_row[key] = e.__class__.__name__
-                    # errors_in_row[key] = str(e)
-            if not error_in_row:
-                entry = None
-                if unique_fields:
-                    # print('check unique')
-                    data = {}
-                    for field in unique_fields:
-                        data[field] = entry_dict[field]
-                    # print(data)
-                    try:
-                        entry, created = models.Entry.objects.get_or_create(table=table, data__contains=data)
-                        if created:
-                            import_count_created += 1
-                        else:
-                            import_count_updated += 1
-                    except:
-                        error_in_row = True
-                        for field in unique_fields:
-                            errors_in_row[unique_fields[field]] = 'Acest camp trebuie sa fie unic în tabel'
-                        errors.append({"row": row, "errors": errors_in_row})
-                        errors_count += 1
-                else:
-                    entry = models.Entry.objects.create(table=table)
-                    import_count_created += 1
-
-                if entry:
-                    entry.data = entry_dict
-                    entry.save()
-            else:
-                errors.append({"row": row, "errors": errors_in_row})
-                errors_count += 1
-
-        except Exception as e:
-            # print(e)
-            errors_count += 1
+def import_csv(reader, table, csv_import=None, progress=None):
+    from api import imports
 
-    # print("errors: {} import_count_created: {} import_count_updated: {}".format(errors_count, import_count_created, import_count_updated))
-    return errors, errors_count, import_count_created, import_count_updated
+    return imports.CsvImporter(table, csv_import, progress=progress).run(reader)
 
 
 def get_chart_data(request, chart, table, preview=False):
     y_axis_function = DB_FUNCTIONS[chart.y_axis_function]
 
-    table_fields = {x.name: x.field_type for x in table.fields.all()}
-    filter_dict = request_get_to_filter(request.GET, table_fields, Q(), False)
+    columns = list(table.fields.all())
+    table_fields = {x.name: x.field_type for x in columns}
+    typed_columns = projections.projected_columns(table, columns)
+    filter_dict = request_get_to_filter(request.GET, table_fields, Q(), False, typed_columns)
 
     chart_data = models.Entry.objects \
         .filter(table=chart.table) \
         .filter(filter_dict)
+
+    timeline_field = None
+    if chart.timeline_field and chart.timeline_field.name in typed_columns:
+        chart_data, timeline_field = projections.typed_field(chart_data, chart.timeline_field, "typed_timeline")
+    y_axis_field = None
+    if chart.y_axis_field and chart.y_axis_field.name in typed_columns:
+        chart_data, y_axis_field = projections.typed_field(chart_data, chart.y_axis_field, "typed_y_axis")
+    # enum series of projected tables are grouped on their codes
+    series_fields = {}
+    for alias, column in (("series", chart.x_axis_field), ("series_group", chart.x_axis_field_2)):
+        if column and column.field_type == "enum" and projections.is_projected(column):
+            chart_data, series_fields[alias] = projections.typed_field(chart_data, column, "typed_" + alias)
+
     if preview:
         chart_data = chart_data[:100]
 
     if chart.timeline_field:
+        if timeline_field is None:
+            chart_data = chart_data.annotate(date_field=Cast(
+                    KeyTextTransform(chart.timeline_field.name, "data"), DateTimeField()
+                ))
+            timeline_field = 'date_field'
 
-        chart_data = chart_data.annotate(date_field=Cast(
-                KeyTextTransform(chart.timeline_field.name, "data"), DateTimeField()
-            )) \
-            .annotate(time=Trunc('date_field', chart.timeline_period.lower(), is_dst=False)) \
+        chart_data = chart_data \
+            .annotate(time=Trunc(timeline_field, chart.timeline_period.lower(), is_dst=False)) \
             .values('time')
     else:
         chart_data = chart_data \
-            .annotate(series=Cast(
-                KeyTextTransform(chart.x_axis_field.name, "data"), CharField()))
+            .annotate(series=series_field(chart.x_axis_field, "series", series_fields))
         if chart.x_axis_field_2:
             chart_data = chart_data \
-                .annotate(series_group=Cast(
-                    KeyTextTransform(chart.x_axis_field_2.name, "data"), CharField()))\
+                .annotate(series_group=series_field(chart.x_axis_field_2, "series_group", series_fields))\
                 .values('series', 'series_group')
         else:
             chart_data = chart_data.values('series')
 
     # if we have Y axis field
-    if chart.y_axis_field:
+    if y_axis_field:
+        chart_data = chart_data.annotate(value=y_axis_function(y_axis_field))
+    elif chart.y_axis_field:
         chart_data = chart_data \
             .annotate(value=y_axis_function(Cast(
                 KeyTextTransform(chart.y_axis_field.name, "data"), FloatField()
@@ -189,13 +140,10 @@ def get_chart_data(request, chart, table, preview=False):
     # if we have X axis field
     if chart.x_axis_field and chart.timeline_field:
         chart_data = chart_data \
-            .annotate(series=Cast(
-                KeyTextTransform(chart.x_axis_field.name, "data"), CharField()
-            ))
+            .annotate(series=series_field(chart.x_axis_field, "series", series_fields))
         if chart.x_axis_field_2:
             chart_data = chart_data \
-                .annotate(series_group=Cast(
-                    KeyTextTransform(chart.x_axis_field_2.name, "data"), CharField()))\
+                .annotate(series_group=series_field(chart.x_axis_field_2, "series_group", series_fields))\
                 .values('time', 'series', 'series_group', 'value')
         else:
             chart_data = chart_data.values('time', 'value', 'series')
@@ -207,7 +155,13 @@ def get_chart_data(request, chart, table, preview=False):
 
     if chart.timeline_field:
         chart_data = chart_data.order_by('time')
+        if series_fields:
+            chart_data = decode_series(chart, chart_data, series_fields)
         data = prepare_chart_data(chart, chart_data, timeline=True)
+    elif series_fields:
+        chart_data = decode_series(chart, chart_data.order_by(), series_fields)
+        chart_data.sort(key=lambda x: (x['series'] is None, x['series'] or ''))
+        data = prepare_chart_data(chart, chart_data, timeline=False)
     else:
         chart_data = chart_data.order_by('data__' +  chart.x_axis_field.name)
         data = prepare_chart_data(chart, chart_data, timeline=False)
@@ -215,6 +169,30 @@ def get_chart_data(request, chart, table, preview=False):
     return data
 
 
+def series_field(column, alias, series_fields):
+    if alias in series_fields:
+        return F(series_fields[alias])
+    return Cast(KeyTextTransform(column.name, "data"), CharField())
+
+
+def decode_series(chart, chart_data, series_fields):
+    """
+    Replace the enum codes of the chart series with their values.
+    """
+    columns = {"series": chart.x_axis_field, "series_group": chart.x_axis_field_2}
+    labels = {
+        alias: {code: value for value, code in enums.load(columns[alias]).items()}
+        for alias in series_fields
+    }
+    rows = []
+    for row in chart_data:
+        row = dict(row)
+        for alias, column_labels in labels.items():
+            row[alias] = column_labels.get(row[alias])
+        rows.append(row)
+    return rows
+
+
 def get_strftime(date, period):
     if not date:
         return None
@@ -413,8 +391,10 @@ def prepare_chart_data(chart, chart_data, timeline=True):
     return data
 
 
-def request_get_to_filter(request, table_fields, filter_dict=Q(), is_filter=False):
-    # print(request)
+def request_get_to_filter(request, table_fields, filter_dict=Q(), is_filter=False, typed_columns=None):
+    # typed_columns maps the same keys as table_fields to projected columns,
+    # whose lookups are served by the typed values instead of casting data
+    typed_columns = typed_columns or {}
     for key in request:
         if is_filter:
             table = key.split("__")[0]
@@ -436,11 +416,13 @@ def request_get_to_filter(request, table_fields, filter_dict=Q(), is_filter=Fals
                 column_type = table_fields[column]
                 value = request.get(key).split(",")
             key_lookup = key.split("__")[-1]
+            typed_column = typed_columns.get(filter_table_field if is_filter else column)
 
             if len(value) == 1:
                 value = value[0]
             else:
                 key = key + "__in"
+            typed_lookup = key.split("__")[1] if "__" in key else "exact"
 
             if value == '__BLANK':
                 filter_dict_table = filter_dict_table & Q(
@@ -453,8 +435,12 @@ def request_get_to_filter(request, table_fields, filter_dict=Q(), is_filter=Fals
                     "float",
                     "int",
                 ]:
-                    filter_dict_table = filter_dict_table & Q(
-                        **{"data__{}".format(key): float(value)})
+                    if typed_column:
+                        filter_dict_table = filter_dict_table & projections.typed_filter(
+                            typed_column, typed_lookup, value)
+                    else:
+                        filter_dict_table = filter_dict_table & Q(
+                            **{"data__{}".format(key): float(value)})
                 else:
                     if column_type == 'date':
                         if key_lookup == 'relative':
@@ -473,21 +459,30 @@ def request_get_to_filter(request, table_fields, filter_dict=Q(), is_filter=Fals
                                 date_start = today - relativedelta(**relative_increment_dict)
 
                             if relative_period == 'weeks':
-                                date_start = date_start.replace(hour=0, minute=0, second=0, microsecond=0)
-                                date_start = date_start - relativedelta(
-                                    days=(date_start.isoweekday()-1) % 7, hours=2)
+                                period_start = date_start - relativedelta(days=(date_start.isoweekday()-1) % 7)
                             elif relative_period == 'months':
-                                date_start = date_start.replace(day=1) - relativedelta(hours=2)
+                                period_start = date_start.replace(day=1)
                             elif relative_period == 'years':
-                                date_start = date_start.replace(month=1, day=1) - relativedelta(hours=2)
-                            elif relative_period == 'days':
-                                date_start = date_start - relativedelta(hours=2)
-
-
-                            filter_dict_table = filter_dict_table & Q(
-                                **{"data__{}__gte".format(column): date_start})
-                            filter_dict_table = filter_dict_table & Q(
-                                **{"data__{}__lt".format(column): date_start + relativedelta(**{relative_period:1})})
+                                period_start = date_start.replace(month=1, day=1)
+                            else:
+                                period_start = date_start
+                            date_start = period_start - relativedelta(hours=2)
+
+                            if typed_column:
+                                # the same shifted window as the data lookups below
+                                date_start = timezone.make_aware(date_start, timezone.utc)
+                                filter_dict_table = filter_dict_table & projections.typed_filter(
+                                    typed_column, "gte", date_start)
+                                filter_dict_table = filter_dict_table & projections.typed_filter(
+                                    typed_column, "lt", date_start + relativedelta(**{relative_period: 1}))
+                            else:
+                                filter_dict_table = filter_dict_table & Q(
+                                    **{"data__{}__gte".format(column): date_start})
+                                filter_dict_table = filter_dict_table & Q(
+                                    **{"data__{}__lt".format(column): date_start + relativedelta(**{relative_period:1})})
+                        elif typed_column:
+                            filter_dict_table = filter_dict_table & projections.typed_filter(
+                                typed_column, typed_lookup, value)
                         else:
                             # filter_dict_table["data__{}".format(key)] = value
                             filter_dict_table = filter_dict_table & Q(
@@ -511,16 +506,24 @@ def request_get_to_filter(request, table_fields, filter_dict=Q(), is_filter=Fals
 def get_card_data(request, card, table, preview=False):
     data_column_function = DB_FUNCTIONS[card.data_column_function]
 
-    table_fields = {x.name: x.field_type for x in table.fields.all()}
-    filter_dict = request_get_to_filter(request.GET, table_fields, Q(), False)
+    columns = list(table.fields.all())
+    table_fields = {x.name: x.field_type for x in columns}
+    typed_columns = projections.projected_columns(table, columns)
+    filter_dict = request_get_to_filter(request.GET, table_fields, Q(), False, typed_columns)
 
     card_data = models.Entry.objects \
         .filter(table=card.table) \
         .filter(filter_dict)
 
+    data_column_field = None
+    if card.data_column and card.data_column.name in typed_columns:
+        card_data, data_column_field = projections.typed_field(card_data, card.data_column, "typed_data_column")
+
     if preview:
         card_data = card_data[:100]
-    if card.data_column:
+    if data_column_field:
+        data = card_data.aggregate(value=data_column_function(data_column_field))
+    elif card.data_column:
         data = card_data \
             .aggregate(value=data_column_function(Cast(
                 KeyTextTransform(card.data_column.name, "data"), FloatField()
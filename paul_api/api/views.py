@@ -1,9 +1,10 @@
+from django.db import transaction
 from django.db.models import (
     Q, Count, Sum, Min, Max, Avg, StdDev,
     DateTimeField, DateField, CharField, FloatField, IntegerField)
 from django.db.models.functions import Trunc, Cast
 from django.contrib.auth.models import User, Group
-from django.http import HttpResponse
+from django.shortcuts import get_object_or_404
 from django.core.paginator import Paginator
 from django.core.serializers.json import DjangoJSONEncoder
 from django.contrib.postgres.fields.jsonb import KeyTextTransform
@@ -20,22 +21,20 @@ from rest_framework_guardian.filters import ObjectPermissionsFilter
 from guardian.shortcuts import get_objects_for_user
 from guardian.core import ObjectPermissionChecker
 
-from rest_framework import filters as drf_filters
 from django_filters import rest_framework as filters
 from rest_framework_tricks.filters import OrderingFilter
 
 
 
-import csv
 import json
 from io import StringIO
-import os
-from datetime import datetime
 
 from api import serializers, models
 from . import permissions as api_permissions
 from .permissions import BaseModelPermissions
-from . import utils
+from . import (
+    column_values, export_jobs, exports, import_sources, imports, indexes, projections, schema_changes, search,
+    type_inference, utils)
 from pprint import pprint
 
 
@@ -165,7 +164,8 @@ class MyFilterBackend(filters.DjangoFilterBackend):
 
 
 class TableViewSet(viewsets.ModelViewSet):
-    queryset = models.Table.objects.all().prefetch_related("fields").select_related("database").order_by("id")
+    queryset = models.Table.objects.all().prefetch_related("fields").select_related(
+        "database", "owner", "last_edit_user").order_by("id")
     pagination_class = EntriesPagination
     # permission_classes = (BaseModelPermissions, api_permissions.IsAuthenticatedOrGetToken )
     permission_classes = [BaseModelPermissions]
@@ -181,10 +181,63 @@ class TableViewSet(viewsets.ModelViewSet):
 
     def get_permissions(self):
         base_permissions = super(self.__class__, self).get_permissions()
-        if self.action == "csv_export":
+        if self.action in ["csv_export", "ndjson_export", "parquet_export", "csv_export_job"]:
             base_permissions = (api_permissions.IsAuthenticatedOrGetToken(),)
         return base_permissions
 
+    @action(
+        detail=False,
+        methods=["get"],
+        name="Table revisions",
+        url_path="revisions",
+    )
+    def revisions(self, request):
+        """
+        Current revision of every table the user can view, or of the tables
+        given as ?ids=1,2,3. Cheap enough to poll for cache invalidation.
+        """
+        queryset = self.filter_queryset(models.Table.objects.all())
+        ids = request.GET.get("ids")
+        if ids:
+            queryset = queryset.filter(pk__in=[x for x in ids.split(",") if x.isdigit()])
+        return Response({str(pk): revision for pk, revision in queryset.values_list("id", "revision")})
+
+    @action(
+        detail=True,
+        methods=["get"],
+        name="Column values",
+        url_path=r"columns/(?P<column>[^/]+)/values",
+    )
+    def values(self, request, pk, column):
+        """
+        Most frequent values of a column, for filter suggestions. Takes
+        ?prefix=, ?fuzzy=1 to match similar values instead of the prefix and
+        ?limit=.
+        """
+        table = self.get_object()
+        table_column = get_object_or_404(table.fields.all(), name=column)
+        prefix = request.GET.get("prefix", "").strip()
+        fuzzy = request.GET.get("fuzzy") in ("1", "true")
+        try:
+            limit = int(request.GET.get("limit", column_values.DEFAULT_LIMIT))
+        except ValueError:
+            limit = column_values.DEFAULT_LIMIT
+
+        if prefix:
+            indexes.track_value_lookups(table_column)
+        values = column_values.top_values(table_column, prefix, fuzzy, limit)
+        return Response({"results": [{"value": value, "count": count} for value, count in values]})
+
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        self.schema_changes = getattr(serializer, "schema_changes", [])
+
+    def update(self, request, *args, **kwargs):
+        response = super().update(request, *args, **kwargs)
+        response.data["schema_changes"] = serializers.tables.SchemaChangeSerializer(
+            self.schema_changes, many=True, context={"request": request}).data
+        return response
+
     def create(self, request):
         fields = request.data.get("fields")
         csv_import_pk = request.data.get("import_id")
@@ -226,34 +279,17 @@ class TableViewSet(viewsets.ModelViewSet):
             csv_field_map.unique = field.get('unique', False)
             csv_field_map.save()
 
-        try:
-            file_content = csv_import.file.read().decode("utf-8")
-        except:
-            csv_import.file.seek(0)
-            file_content = csv_import.file.read().decode("windows-1252")
-        decoded_file = file_content.splitlines()
-        if not csv_import.delimiter:
-            csv_import.file.seek(0)
-            dialect = csv.Sniffer().sniff(file_content[:2000])
-            reader = csv.DictReader(decoded_file, delimiter=dialect.delimiter)
-        else:
-            reader = csv.DictReader(decoded_file, delimiter=csv_import.delimiter)
-
-        errors, errors_count, import_count_created, import_count_updated = utils.import_csv(reader, table)
-        csv_import.errors = errors
-        csv_import.errors_count = errors_count
-        csv_import.import_count_created = import_count_created
-        csv_import.import_count_updated = import_count_updated
-        csv_import.table = table
-        csv_import.save()
+        imports.start(csv_import, table, use_table_mapping=True)
         response = {
-            "errors_count": errors_count,
-            "import_count_created": import_count_created,
-            "import_count_updated": import_count_updated,
-            "errors": errors,
+            "errors_count": 0,
+            "import_count_created": 0,
+            "import_count_updated": 0,
+            "errors": [],
             "id": table.id,
+            "import_id": csv_import.pk,
+            "status": csv_import.status,
         }
-        return Response(response)
+        return Response(response, status=status.HTTP_202_ACCEPTED)
 
     @action(
         detail=True,
@@ -284,37 +320,17 @@ class TableViewSet(viewsets.ModelViewSet):
             csv_field_map.save()
 
 
-        try:
-            file_content = csv_import.file.read().decode("utf-8")
-        except:
-            csv_import.file.seek(0)
-            file_content = csv_import.file.read().decode("windows-1252")
-        decoded_file = file_content.splitlines()
-        if not csv_import.delimiter:
-            csv_import.file.seek(0)
-            dialect = csv.Sniffer().sniff(file_content[:2000])
-            reader = csv.DictReader(decoded_file, delimiter=dialect.delimiter)
-        else:
-            reader = csv.DictReader(decoded_file, delimiter=csv_import.delimiter)
-
-
-        errors, errors_count, import_count_created, import_count_updated = utils.import_csv(reader, table, csv_import)
-
-        csv_import.errors = errors
-        csv_import.errors_count = errors_count
-        csv_import.import_count_created = import_count_created
-        csv_import.import_count_updated = import_count_updated
-        csv_import.table = table
-        csv_import.save()
+        imports.start(csv_import, table)
         response = {
-            "errors_count": errors_count,
-            "import_count_created": import_count_created,
-            "import_count_updated": import_count_updated,
-            "errors": errors,
+            "errors_count": 0,
+            "import_count_created": 0,
+            "import_count_updated": 0,
+            "errors": [],
             "id": table.id,
             "import_id": csv_import.pk,
+            "status": csv_import.status,
         }
-        return Response(response)
+        return Response(response, status=status.HTTP_202_ACCEPTED)
 
     # @permission_classes([api_permissions.IsAuthenticatedOrGetToken])
     @action(
@@ -325,27 +341,51 @@ class TableViewSet(viewsets.ModelViewSet):
     )
     def csv_export(self, request, pk):
         table = models.Table.objects.get(pk=pk)
-        table_fields = {x.name: x for x in table.fields.all()}
+        return exports.table_export(table, request.GET).response()
+
+    @action(
+        detail=True,
+        methods=["get"],
+        name="NDJSON Export",
+        url_path="ndjson-export",
+    )
+    def ndjson_export(self, request, pk):
+        table = models.Table.objects.get(pk=pk)
+        return exports.table_export(table, request.GET).response("ndjson")
 
-        filter_dict = utils.request_get_to_filter(request.GET, table_fields, Q(), False)
+    @action(
+        detail=True,
+        methods=["get"],
+        name="Parquet Export",
+        url_path="parquet-export",
+    )
+    def parquet_export(self, request, pk):
+        table = models.Table.objects.get(pk=pk)
+        return exports.table_export(table, request.GET).response("parquet")
 
-        file_name = "{}__{}.csv".format(table.name, datetime.now().strftime("%d.%m.%Y"))
-        with open("/tmp/{}".format(file_name), "w", encoding="utf-8-sig") as csv_export_file:
-            writer = csv.DictWriter(
-                csv_export_file,
-                delimiter=",",
-                quoting=csv.QUOTE_MINIMAL,
-                fieldnames=table.fields.values_list("name", flat=True),
-            )
-            writer.writeheader()
-            for row in table.entries.filter(filter_dict):
-                writer.writerow(row.data)
-
-        with open("/tmp/{}".format(file_name), "rb") as csv_export_file:
-            response = HttpResponse(csv_export_file.read(), content_type="application/vnd.ms-excel")
-            response["Content-Disposition"] = 'attachment; filename="{}"'.format(file_name)
-        os.remove("/tmp/{}".format(file_name))
-        return response
+    @action(
+        detail=True,
+        methods=["post"],
+        name="CSV export job",
+        url_path="csv-export-job",
+    )
+    def csv_export_job(self, request, pk):
+        """
+        Export the entries matching the filters of the query string to the
+        storage in the background, as ?file_format=csv, ndjson or parquet.
+        Poll the returned job until its file is ready; identical exports of
+        an unchanged table get the same job.
+        """
+        table = get_object_or_404(models.Table, pk=pk)
+        file_format = request.GET.get("file_format", "csv")
+        if file_format not in dict(models.export_formats):
+            return Response({"detail": "Unknown export format"}, status=status.HTTP_400_BAD_REQUEST)
+        owner = api_permissions.request_user(request)
+        owner = owner if owner.is_authenticated else None
+        job, created = export_jobs.request("table", table, request.GET, owner=owner, file_format=file_format)
+        serializer = serializers.tables.ExportJobSerializer(job, context={"request": request})
+        return Response(
+            serializer.data, status=status.HTTP_200_OK if job.status == "done" else status.HTTP_202_ACCEPTED)
 
     @action(
         detail=False,
@@ -451,7 +491,7 @@ class TableViewSet(viewsets.ModelViewSet):
         filter_dict[secondary_table_slug]["data__{}__in".format(secondary_table_join_field)] = join_values
 
         result_values = (
-            models.Entry.objects.filter(table__slug=secondary_table_slug)
+            models.Entry.objects.filter(table=secondary_table.table)
             .filter(**filter_dict[secondary_table_slug])
             .values(*secondary_table_fields)
             .order_by("data__{}".format(secondary_table_join_field))
@@ -464,6 +504,7 @@ class TableViewSet(viewsets.ModelViewSet):
             fields += [x.replace("data__", "{}__".format(secondary_table_slug)) for x in secondary_table_fields]
         queryset_count = queryset.count()
         paginator = Paginator(queryset, 1000)  # Show 100 objects per page, you can choose any other value
+        table_columns = list(table.fields.all())
 
         
         for i in paginator.page_range:  # A 1-based range iterator of page numbers, e.g. yielding [1, 2, 3, 4].
@@ -500,12 +541,64 @@ class TableViewSet(viewsets.ModelViewSet):
                 entry = models.Entry(table=table, data=final_entry)
                 entries.append(entry)
             models.Entry.objects.bulk_create(entries)
+            projections.sync_entries(table, entries, table_columns)
+            search.sync_entries(table, entries, table_columns)
+        table.refresh_entries_count()
+        table.bump_revision()
         response = {
             'id': table.id
         }
         return Response(response)
 
 
+class SchemaChangeViewSet(viewsets.ReadOnlyModelViewSet):
+    queryset = models.SchemaChange.objects.all()
+    serializer_class = serializers.tables.SchemaChangeSerializer
+    pagination_class = EntriesPagination
+
+    def get_queryset(self):
+        user = self.request.user
+        queryset = self.queryset.filter(table__in=get_objects_for_user(user, "api.view_table"))
+        table_id = self.request.GET.get("table")
+        if table_id:
+            queryset = queryset.filter(table_id=table_id)
+        job_status = self.request.GET.get("status")
+        if job_status:
+            queryset = queryset.filter(status=job_status)
+        return queryset
+
+    @action(
+        detail=True,
+        methods=["post"],
+        name="Schema change resume",
+        url_path="resume",
+    )
+    def resume(self, request, pk):
+        """
+        Run a failed schema change again from the start.
+        """
+        job = self.get_object()
+        if not schema_changes.resume(job):
+            return Response({"detail": "Only failed schema changes can be resumed"}, status=status.HTTP_409_CONFLICT)
+        serializer = self.get_serializer(job)
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+
+
+class ExportJobViewSet(viewsets.ReadOnlyModelViewSet):
+    queryset = models.ExportJob.objects.all()
+    serializer_class = serializers.tables.ExportJobSerializer
+    pagination_class = EntriesPagination
+
+    def get_permissions(self):
+        # clients of the token exports poll their jobs with the same token
+        return (api_permissions.IsAuthenticatedOrGetToken(),)
+
+    def get_queryset(self):
+        user = api_permissions.request_user(self.request)
+        tables = get_objects_for_user(user, "api.view_table")
+        return self.queryset.filter(Q(table__in=tables) | Q(filter__primary_table__table__in=tables))
+
+
 class FilterViewSet(viewsets.ModelViewSet):
     queryset = models.Filter.objects.all()
     pagination_class = EntriesPagination
@@ -547,7 +640,7 @@ class FilterViewSet(viewsets.ModelViewSet):
 
     def get_permissions(self):
         base_permissions = super(self.__class__, self).get_permissions()
-        if self.action == "csv_export":
+        if self.action in ["csv_export", "ndjson_export", "parquet_export", "csv_export_job"]:
             base_permissions = (api_permissions.IsAuthenticatedOrGetToken(),)
         return base_permissions
 
@@ -584,6 +677,7 @@ class FilterViewSet(viewsets.ModelViewSet):
         obj = models.Filter.objects.filter(pk=pk).prefetch_related("primary_table", "join_tables")[0]
         str_fields = request.GET.get("__fields", "") if request else None
         str_order = request.GET.get("__order", "") if request else None
+        search_text = request.GET.get("search", "").strip()
 
         primary_table = obj.primary_table
         primary_table_slug = primary_table.table.slug
@@ -664,18 +758,47 @@ class FilterViewSet(viewsets.ModelViewSet):
         if is_two_tables_filter:
             filter_dict[secondary_table_slug] = Q()
 
-        filter_dict = utils.request_get_to_filter(request.GET, field_types, filter_dict, True)
+        filter_columns = {"{}__{}".format(primary_table_slug, x.name): x for x in primary_table.table.fields.all()}
+        typed_tables = {primary_table.table.pk} if primary_table.table.typed_projection else set()
+        if is_two_tables_filter:
+            filter_columns.update(
+                {"{}__{}".format(secondary_table_slug, x.name): x for x in secondary_table.table.fields.all()})
+            if secondary_table.table.typed_projection:
+                typed_tables.add(secondary_table.table.pk)
+        typed_columns = {
+            key: column for key, column in filter_columns.items()
+            if column.table_id in typed_tables and column.field_type in projections.PROJECTED_TYPES}
+
+        # the search text is not a column lookup
+        query_params = request.GET.copy()
+        query_params.pop("search", None)
+        filter_dict = utils.request_get_to_filter(query_params, field_types, filter_dict, True, typed_columns)
+
+        used_columns = {"__".join(key.split("__")[:2]) for key in request.GET}
+        substring_columns = {
+            "__".join(key.split("__")[:2]) for key in request.GET
+            if key.split("__")[-1] in indexes.TRIGRAM_LOOKUPS}
+        if str_order:
+            used_columns.add("{}__{}".format(order_table, str_order.replace("-", "")))
+        indexes.track_usage(
+            [column for key, column in filter_columns.items() if key in used_columns],
+            [column for key, column in filter_columns.items() if key in substring_columns])
 
         # If filter has only primary_table
         if not is_two_tables_filter:
             if order_table == primary_table_slug:
                 table_order_by = order_by
+            entries = models.Entry.objects.filter(table=primary_table.table)
+            if search_text:
+                entries = search.search(entries, search_text)
             result_values = (
-                models.Entry.objects.filter(table__slug=primary_table_slug)
+                entries
                 .filter(filter_dict[primary_table_slug])
                 .values(*primary_table_fields)
                 .order_by(table_order_by)
             )
+            if search_text and not str_order:
+                result_values = result_values.order_by("-search_rank", "id")
             queryset = result_values
             if not fields:
                 fields = [x.replace("data__", "{}__".format(primary_table_slug)) for x in primary_table_fields]
@@ -705,12 +828,21 @@ class FilterViewSet(viewsets.ModelViewSet):
             # filter_dict[secondary_table_slug]["data__{}__in".format(secondary_table_join_field)] = join_values
             filter_dict[secondary_table_slug] = filter_dict[secondary_table_slug] & Q(
                 **{"data__{}__in".format(secondary_table_join_field) :join_values})
+            if search_text:
+                # rows matching the search in either table
+                search_query = search.query(search_text)
+                primary_matches = models.Entry.objects.filter(
+                    table=primary_table.table, search_vector=search_query
+                ).values("data__{}".format(primary_table.join_field.name))
+                filter_dict[secondary_table_slug] = filter_dict[secondary_table_slug] & (
+                    Q(search_vector=search_query)
+                    | Q(**{"data__{}__in".format(secondary_table_join_field): primary_matches}))
             table_order_by = "id"
             if order_table == secondary_table_slug:
                 table_order_by = order_by
 
             result_values = (
-                models.Entry.objects.filter(table__slug=secondary_table_slug)
+                models.Entry.objects.filter(table=secondary_table.table)
                 .filter(filter_dict[secondary_table_slug])
                 .values(*secondary_table_fields)
                 .order_by(table_order_by)
@@ -767,216 +899,52 @@ class FilterViewSet(viewsets.ModelViewSet):
         url_name="csv-export")
     def csv_export(self, request, pk):
         obj = models.Filter.objects.filter(pk=pk).prefetch_related("primary_table", "join_tables")[0]
-        str_fields = request.GET.get("__fields", "") if request else None
-        str_order = request.GET.get("__order", "") if request else None
-
-        primary_table = obj.primary_table
-        primary_table_slug = primary_table.table.slug
-
-        is_two_tables_filter = False
-
-        if obj.join_tables.all():
-            primary_table_join_field = primary_table.join_field.name
-            secondary_table = obj.join_tables.all()[0]
-            secondary_table_slug = secondary_table.table.slug
-            secondary_table_join_field = secondary_table.join_field.name
-            is_two_tables_filter = True
-
-        # Get all fields and display fields
-        all_fields = []
-        field_types = {}
-        for field in primary_table.fields.all().order_by("id"):
-            if obj.default_fields.all():
-                if field in obj.default_fields.all():
-                    field_key = "{}__{}".format(primary_table.table.slug, field.name)
-                    all_fields.append(field_key)
-                    field_types[field_key] = field.field_type
-            else:
-                field_key = "{}__{}".format(primary_table.table.slug, field.name)
-                all_fields.append(field_key)
-                field_types[field_key] = field.field_type
-
-        if is_two_tables_filter:
-            for field in secondary_table.fields.all().order_by("id"):
-                if obj.default_fields.all():
-                    if field in obj.default_fields.all():
-                        field_key = "{}__{}".format(secondary_table.table.slug, field.name)
-                        all_fields.append(field_key)
-                        field_types[field_key] = field.field_type
-                else:
-                    field_key = "{}__{}".format(secondary_table.table.slug, field.name)
-                    all_fields.append(field_key)
-                    field_types[field_key] = field.field_type
-
-        fields = all_fields
-        if str_fields:
-            if str_fields == "ALL":
-                fields = all_fields
-            else:
-                fields = str_fields.split(",") if str_fields else None
-
-        primary_table_fields = []
-        secondary_table_fields = []
-
-        for field in fields:
-            if field.startswith(primary_table_slug):
-                primary_table_fields.append(field.replace(primary_table_slug + "__", "data__"))
-            else:
-                secondary_table_fields.append(field.replace(secondary_table_slug + "__", "data__"))
-
-        if is_two_tables_filter:
-            secondary_table_fields.append("data__{}".format(secondary_table_join_field))
-
-        # order_table = str_order.replace("-", "").split("__")[0]
-        order_table = str_order.split("__")[0]
-        str_order = str_order.replace(order_table + "__", "")
-
-        if str_order:
-            if str_order.startswith("-"):
-                order_by = "-data__{}".format(str_order[1:])
-            else:
-                order_by = "data__{}".format(str_order)
-        else:
-            order_by = "id"
-
-        table_order_by = "id"
-
-        if order_table == primary_table_slug:
-            table_order_by = order_by
-
-        # Create filters dict
-        filter_dict = {
-            primary_table_slug: Q(),
-        }
-        if is_two_tables_filter:
-            filter_dict[secondary_table_slug] = Q()
-
-        filter_dict = utils.request_get_to_filter(request.GET, field_types, filter_dict, True)
-
-        # If filter has only primary_table
-        if not is_two_tables_filter:
-            result_values = (
-                models.Entry.objects.filter(table__slug=primary_table_slug)
-                .filter(filter_dict[primary_table_slug])
-                .values(*primary_table_fields)
-                .order_by(table_order_by)
-            )
-            queryset = result_values
-
-            if not fields:
-                fields = [x.replace("data__", "{}__".format(primary_table_slug)) for x in primary_table_fields]
-
-            paginator = Paginator(queryset, 1000)  # Show 100 objects per page, you can choose any other value
-
-            file_name = "{}__{}.csv".format(obj.slug, datetime.now().strftime("%d_%m_%Y__%H_%M"))
-            with open("/tmp/{}".format(file_name), "w", encoding="utf-8-sig") as csv_export_file:
-                writer = csv.DictWriter(
-                    csv_export_file,
-                    delimiter=",",
-                    quoting=csv.QUOTE_MINIMAL,
-                    fieldnames=fields,
-                )
-                writer.writeheader()
-                for i in paginator.page_range:  # A 1-based range iterator of page numbers, e.g. yielding [1, 2, 3, 4].
-                    # print("Writing page:", i)
-                    data = paginator.get_page(i)
-                    page = data.object_list
+        return exports.filter_export(obj, request.GET).response()
 
-                    for entry in page:
-                        final_entry = {}
-                        final_entry_primary_table_values = {}
-
-                        for key in entry:
-                            final_entry[key.replace("data__", "{}__".format(primary_table_slug))] = entry[key]
-                        
-                        writer.writerow({k: v for k, v in final_entry.items() if k in fields})
-
-        else:
-            join_values = (
-                models.Entry.objects.filter(table=primary_table.table)
-                .filter(filter_dict[primary_table_slug])
-                .values("data__{}".format(primary_table.join_field.name))
-                .order_by(table_order_by)
-            )
-
-            filter_dict[secondary_table_slug] = filter_dict[secondary_table_slug] & Q(
-                **{"data__{}__in".format(secondary_table_join_field): join_values})
-            # filter_dict[secondary_table_slug]["data__{}__in".format(secondary_table_join_field)] = join_values
-
-            table_order_by = "id"
-            if order_table == secondary_table_slug:
-                table_order_by = order_by
+    @action(
+        methods=["get"],
+        detail=True,
+        url_path="ndjson-export",
+        url_name="ndjson-export")
+    def ndjson_export(self, request, pk):
+        obj = models.Filter.objects.filter(pk=pk).prefetch_related("primary_table", "join_tables")[0]
+        return exports.filter_export(obj, request.GET).response("ndjson")
 
-            result_values = (
-                models.Entry.objects.filter(table__slug=secondary_table_slug)
-                .filter(filter_dict[secondary_table_slug])
-                .values(*secondary_table_fields)
-                .order_by(table_order_by)
-            )
+    @action(
+        methods=["get"],
+        detail=True,
+        url_path="parquet-export",
+        url_name="parquet-export")
+    def parquet_export(self, request, pk):
+        obj = models.Filter.objects.filter(pk=pk).prefetch_related("primary_table", "join_tables")[0]
+        return exports.filter_export(obj, request.GET).response("parquet")
 
-            queryset = result_values
-            if not fields:
-                fields = [x.replace("data__", "{}__".format(primary_table_slug)) for x in primary_table_fields]
-                fields += [x.replace("data__", "{}__".format(secondary_table_slug)) for x in secondary_table_fields]
-            queryset_count = queryset.count()
-            paginator = Paginator(queryset, 1000)  # Show 100 objects per page, you can choose any other value
-
-            file_name = "{}__{}.csv".format(obj.slug, datetime.now().strftime("%d_%m_%Y__%H_%M"))
-            with open("/tmp/{}".format(file_name), "w", encoding="utf-8-sig") as csv_export_file:
-                writer = csv.DictWriter(
-                    csv_export_file,
-                    delimiter=",",
-                    quoting=csv.QUOTE_MINIMAL,
-                    fieldnames=fields,
-                )
-                writer.writeheader()
-                for i in paginator.page_range:  # A 1-based range iterator of page numbers, e.g. yielding [1, 2, 3, 4].
-                    # print("Writing page:", i)
-                    data = paginator.get_page(i)
-                    page = data.object_list
-
-                    page_join_values = [x["data__{}".format(secondary_table_join_field)] for x in page]
-                    filter_dict[primary_table_slug] = filter_dict[primary_table_slug] & Q(
-                        **{"data__{}__in".format(primary_table_join_field): page_join_values})
-                    # filter_dict[primary_table_slug]["data__{}__in".format(primary_table_join_field)] = page_join_values
-                    primary_table_values = {
-                        x.data[primary_table_join_field]: {"data__" + key: value for key, value in x.data.items()}
-                        for x in models.Entry.objects.filter(table=primary_table.table)
-                        .filter(filter_dict[primary_table_slug])
-                        .exclude(data=None)
-                    }
-
-                    for entry in page:
-                        final_entry = {}
-                        final_entry_primary_table_values = {}
-
-                        entry_primary_table_values = primary_table_values[
-                            entry["data__{}".format(secondary_table_join_field)]
-                        ]
-
-                        for key in entry:
-                            final_entry[key.replace("data__", "{}__".format(secondary_table_slug))] = entry[key]
-                        for key in entry_primary_table_values:
-                            final_entry_primary_table_values[
-                                key.replace("data__", "{}__".format(primary_table_slug))
-                            ] = entry_primary_table_values[key]
-
-                        final_entry.update(final_entry_primary_table_values)
-                        writer.writerow({k: v for k, v in final_entry.items() if k in fields})
-
-        with open("/tmp/{}".format(file_name), "rb") as csv_export_file:
-            # response = HttpResponse(FileWrapper(csv_export_file), content_type='application/vnd.ms-excel')
-            response = HttpResponse(csv_export_file.read(), content_type="application/vnd.ms-excel")
-            response["Content-Disposition"] = 'attachment; filename="{}"'.format(file_name)
-        os.remove("/tmp/{}".format(file_name))
-        return response
+    @action(
+        methods=["post"],
+        detail=True,
+        url_path="csv-export-job",
+        url_name="csv-export-job")
+    def csv_export_job(self, request, pk):
+        """
+        Export the entries matching the filters of the query string to the
+        storage in the background, like the table csv-export-job.
+        """
+        obj = get_object_or_404(
+            models.Filter.objects.prefetch_related("primary_table", "join_tables"), pk=pk)
+        file_format = request.GET.get("file_format", "csv")
+        if file_format not in dict(models.export_formats):
+            return Response({"detail": "Unknown export format"}, status=status.HTTP_400_BAD_REQUEST)
+        owner = api_permissions.request_user(request)
+        owner = owner if owner.is_authenticated else None
+        job, created = export_jobs.request("filter", obj, request.GET, owner=owner, file_format=file_format)
+        serializer = serializers.tables.ExportJobSerializer(job, context={"request": request})
+        return Response(
+            serializer.data, status=status.HTTP_200_OK if job.status == "done" else status.HTTP_202_ACCEPTED)
 
 
 class EntryViewSet(viewsets.ModelViewSet):
     pagination_class = EntriesPagination
-    filter_backends = (drf_filters.SearchFilter,)
     serializer_class = serializers.entries.EntrySerializer
-    search_fields = ["data__nume"]
 
     def get_queryset(self):
         return models.Entry.objects.filter(table=self.kwargs["table_pk"])
@@ -985,7 +953,9 @@ class EntryViewSet(viewsets.ModelViewSet):
         table = models.Table.objects.get(pk=table_pk)
         str_fields = request.GET.get("__fields", "") if request else None
         str_order = request.GET.get("__order", "") if request else None
-        table_fields = {x.name: x.field_type for x in table.fields.all().order_by("id")}
+        search_text = request.GET.get("search", "").strip()
+        table_columns = {x.name: x for x in table.fields.all().order_by("id")}
+        table_fields = {name: column.field_type for name, column in table_columns.items()}
         default_fields = {x.name: x for x in table.default_fields.all().order_by("id")}
 
         if str_fields == "ALL":
@@ -999,15 +969,39 @@ class EntryViewSet(viewsets.ModelViewSet):
                     fields = [x for x in table_fields.keys()]
 
 
-        filter_dict = utils.request_get_to_filter(request.GET, table_fields, Q(), False)
+        query_params = request.GET.copy()
+        query_params.pop("search", None)
+        typed_columns = projections.projected_columns(table, table_columns.values())
+        filter_dict = utils.request_get_to_filter(query_params, table_fields, Q(), False, typed_columns)
 
+        used_columns = {key.split("__")[0] for key in query_params}
+        substring_columns = {
+            key.split("__")[0] for key in query_params if key.split("__")[-1] in indexes.TRIGRAM_LOOKUPS}
         if str_order and str_order.replace("-", "") in fields:
+            used_columns.add(str_order.replace("-", ""))
+        indexes.track_usage(
+            [column for name, column in table_columns.items() if name in used_columns],
+            [column for name, column in table_columns.items() if name in substring_columns])
+
+        entries = table.entries.all()
+        if search_text:
+            entries = search.search(entries, search_text)
+
+        if str_order and str_order.replace("-", "") in fields:
+            order_column = str_order.replace("-", "")
+            queryset = entries.filter(filter_dict)
+            if order_column in typed_columns:
+                queryset, order_field = projections.typed_field(queryset, typed_columns[order_column], "typed_order")
+            else:
+                order_field = "data__{}".format(order_column)
             if str_order.startswith("-"):
-                queryset = table.entries.filter(filter_dict).order_by("-data__{}".format(str_order[1:]))
+                queryset = queryset.order_by("-{}".format(order_field))
             else:
-                queryset = table.entries.filter(filter_dict).order_by("data__{}".format(str_order))
+                queryset = queryset.order_by(order_field)
+        elif search_text:
+            queryset = entries.filter(filter_dict).order_by("-search_rank", "id")
         else:
-            queryset = table.entries.filter(filter_dict).order_by("id")
+            queryset = entries.filter(filter_dict).order_by("id")
             # queryset = table.entries.annotate(date_field=Cast(KeyTextTransform('data_iesire', "data"), DateField())).filter(date_field__exact='2020-07-21').order_by("id")
 
         page = self.paginate_queryset(queryset)
@@ -1022,6 +1016,12 @@ class EntryViewSet(viewsets.ModelViewSet):
         serializer = serializers.entries.EntrySerializer(queryset, many=True)
         return Response(serializer.data)
 
+    def perform_destroy(self, instance):
+        table = instance.table
+        with transaction.atomic():
+            super().perform_destroy(instance)
+            table.bump_revision(entries_delta=-1)
+
     def retrieve(self, request, table_pk, pk):
         table = models.Table.objects.get(pk=table_pk)
         object = models.Entry.objects.get(pk=pk)
@@ -1085,6 +1085,53 @@ class CsvImportViewSet(viewsets.ModelViewSet):
             base_permissions = (api_permissions.IsAuthenticatedOrGetToken(),)
         return base_permissions
 
+    @action(
+        detail=True,
+        methods=["get"],
+        name="Csv import errors",
+        url_path="errors",
+    )
+    def errors(self, request, pk):
+        """
+        The failed rows of an import, in file order, a page at a time.
+        """
+        csv_import = self.get_object()
+        paginator = EntriesPagination()
+        page = paginator.paginate_queryset(csv_import.error_rows.order_by("part", "row_number"), request, view=self)
+        serializer = serializers.csvs.CsvImportErrorSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(
+        detail=True,
+        methods=["get"],
+        name="Csv import progress",
+        url_path="progress",
+    )
+    def progress(self, request, pk):
+        """
+        Status and progress of an import, cheap enough to poll.
+        """
+        csv_import = self.get_object()
+        serializer = serializers.csvs.CsvImportProgressSerializer(csv_import, context={"request": request})
+        return Response(serializer.data)
+
+    @action(
+        detail=True,
+        methods=["post"],
+        name="Csv import resume",
+        url_path="resume",
+    )
+    def resume(self, request, pk):
+        """
+        Continue a failed or stalled import from its last committed chunk.
+        """
+        csv_import = self.get_object()
+        if not imports.resume(csv_import):
+            return Response(
+                {"detail": "Only failed or stalled imports can be resumed"}, status=status.HTTP_409_CONFLICT)
+        serializer = serializers.csvs.CsvImportProgressSerializer(csv_import, context={"request": request})
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+
     @action(
         detail=True,
         methods=["get"],
@@ -1095,23 +1142,8 @@ class CsvImportViewSet(viewsets.ModelViewSet):
         csv_import = self.get_object()
 
         file_name = "errors__" + csv_import.file.name.split("/")[-1]
-        with open("/tmp/{}".format(file_name), "w", encoding="utf-8-sig") as csv_export_file:
-            writer = csv.DictWriter(
-                csv_export_file,
-                delimiter=",",
-                quoting=csv.QUOTE_MINIMAL,
-                fieldnames=csv_import.errors[0]["row"].keys(),
-            )
-            writer.writeheader()
-            for row in csv_import.errors:
-                writer.writerow(row["row"])
-
-        with open("/tmp/{}".format(file_name), "rb") as csv_export_file:
-            # response = HttpResponse(FileWrapper(csv_export_file), content_type='application/vnd.ms-excel')
-            response = HttpResponse(csv_export_file.read(), content_type="application/vnd.ms-excel")
-            response["Content-Disposition"] = 'attachment; filename="{}"'.format(file_name)
-        os.remove("/tmp/{}".format(file_name))
-        return response
+        fieldnames, rows = imports.error_export(csv_import)
+        return exports.csv_response(file_name, fieldnames, rows)
 
     def create(self, request):
         file = request.FILES["file"]
@@ -1121,34 +1153,33 @@ class CsvImportViewSet(viewsets.ModelViewSet):
             table = models.Table.objects.get(pk=table_id)
         fields = []
 
-        try:
-            file_content = file.read().decode("utf-8")
-        except:
-            try:
-                file.seek(0)
-                file_content = file.read().decode("windows-1252")
-            except:
-                response = {
-                    "success": False,
-                    "error_msg": 'Could not decode file',
-                }
-                return Response(response, status=status.HTTP_400_BAD_REQUEST)
-        decoded_file = file_content.splitlines()
-
         if delimiter == 'null':
             delimiter = None
-        if not delimiter:
-            file.seek(0)
-            dialect = csv.Sniffer().sniff(file_content[:2000])
-            reader = csv.DictReader(decoded_file, delimiter=dialect.delimiter)
-        else:
-            reader = csv.DictReader(decoded_file, delimiter=delimiter)
+        file_format = import_sources.detect_format(file.name)
+        try:
+            # only the header and a sample of rows are read here
+            fieldnames, sample_rows = import_sources.sample(
+                file, file_format, delimiter, type_inference.SAMPLE_ROWS)
+        except import_sources.SourceError:
+            response = {
+                "success": False,
+                "error_msg": 'Could not read file',
+            }
+            return Response(response, status=status.HTTP_400_BAD_REQUEST)
+        file.seek(0)
 
-        csv_import = models.CsvImport.objects.create(file=file, delimiter=delimiter)
+        csv_import = models.CsvImport.objects.create(file=file, delimiter=delimiter, file_format=file_format)
+        proposals = type_inference.infer(fieldnames, sample_rows)
 
-        for field in reader.fieldnames:
+        for field in fieldnames:
+            proposal = proposals[field]
+            field_type, field_format = type_inference.stored_type(proposal)
             csv_field_map = models.CsvFieldMap.objects.create(
-                csv_import=csv_import, original_name=field, display_name=field
+                csv_import=csv_import,
+                original_name=field,
+                display_name=field,
+                field_type=field_type,
+                field_format=field_format,
             )
             existing_table_field = None
             existing_table_format = None
@@ -1175,11 +1206,12 @@ class CsvImportViewSet(viewsets.ModelViewSet):
                 {
                     "original_name": field.encode(),
                     "display_name": field,
-                    "field_type": "text",
-                    "field_format": existing_table_format,
+                    "field_type": csv_field_map.field_type,
+                    "field_format": existing_table_format or csv_field_map.field_format,
                     "table_field": existing_table_field,
                     "required": csv_field_map.required,
                     "unique": csv_field_map.unique,
+                    "inference": proposal,
                 }
             )
 
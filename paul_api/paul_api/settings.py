@@ -15,6 +15,7 @@ from pathlib import Path
 from typing import Any, Dict
 
 import environ
+from celery.schedules import crontab
 from django.utils.translation import gettext_lazy as _
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -40,6 +41,7 @@ env = environ.Env(
     DEBUG=(bool, False),
     ALLOWED_HOSTS=(list, []),
     CELERY_BROKER_URL=(str, "redis://redis:6379/0"),
+    CELERY_TASK_ALWAYS_EAGER=(bool, False),
     EMAIL_BACKEND=(str, "django.core.mail.backends.console.EmailBackend"),
     EMAIL_HOST=(str, ""),
     EMAIL_PORT=(str, ""),
@@ -49,6 +51,11 @@ env = environ.Env(
     IS_CONTAINERIZED=(bool, True),
     LANGUAGE_CODE=(str, "ro"),
     SECRET_KEY=(str, "secret"),
+    SEARCH_CONFIG=(str, "simple"),
+    CSV_IMPORT_CHUNK_SIZE=(int, 2000),
+    CSV_IMPORT_WORKERS=(int, 4),
+    CSV_IMPORT_PARALLEL_MIN_BYTES=(int, 64 * 1024 * 1024),
+    EXPORT_JOB_RETENTION_DAYS=(int, 7),
 )
 environ.Env.read_env(f"{root}/.env")  # reading .env file
 
@@ -312,6 +319,22 @@ except environ.ImproperlyConfigured:
 CELERY_BROKER_URL = env("CELERY_BROKER_URL")
 CELERY_RESULT_BACKEND = "django-db"
 CELERY_BEAT_SCHEDULER = "django_celery_beat.schedulers.DatabaseScheduler"
+# Run tasks in-process when there is no worker (i.e. the "with-task-queue" profile is off)
+CELERY_TASK_ALWAYS_EAGER = env.bool("CELERY_TASK_ALWAYS_EAGER")
+CELERY_BEAT_SCHEDULE = {
+    "reconcile-entries-count": {
+        "task": "api.tasks.reconcile_entries_count",
+        "schedule": crontab(hour=3, minute=30),
+    },
+    "resume-stalled-schema-changes": {
+        "task": "api.tasks.resume_stalled_schema_changes",
+        "schedule": crontab(minute="*/10"),
+    },
+    "delete-expired-export-jobs": {
+        "task": "api.tasks.delete_expired_export_jobs",
+        "schedule": crontab(hour=4, minute=0),
+    },
+}
 
 # Admin config
 DJANGO_ADMIN_EMAIL = env("DJANGO_ADMIN_EMAIL")
@@ -320,6 +343,20 @@ FRONTEND_DOMAIN = env("FRONTEND_DOMAIN")
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
+# text search configuration of the entries search vectors, e.g. "romanian"
+SEARCH_CONFIG = env("SEARCH_CONFIG")
+
+# number of rows written per transaction by the CSV import
+CSV_IMPORT_CHUNK_SIZE = env("CSV_IMPORT_CHUNK_SIZE")
+
+# files of at least CSV_IMPORT_PARALLEL_MIN_BYTES are split in
+# CSV_IMPORT_WORKERS parts imported by parallel celery tasks
+CSV_IMPORT_WORKERS = env("CSV_IMPORT_WORKERS")
+CSV_IMPORT_PARALLEL_MIN_BYTES = env("CSV_IMPORT_PARALLEL_MIN_BYTES")
+
+# days after which export jobs and their files are deleted
+EXPORT_JOB_RETENTION_DAYS = env("EXPORT_JOB_RETENTION_DAYS")
+
 # django-jazzmin
 # -------------------------------------------------------------------------------
 # django-jazzmin - https://django-jazzmin.readthedocs.io/configuration/
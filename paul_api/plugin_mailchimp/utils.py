@@ -1,6 +1,7 @@
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.utils import timezone
-from api import models
+from api import enums, models, projections, search
 from mailchimp3 import MailChimp
 from pprint import pprint
 
@@ -39,6 +40,23 @@ def get_or_create_table(table_type, table_name):
     return table
 
 
+def sync_written(table, entries):
+    """
+    Refresh the typed values and search vectors of the written entries of
+    a table, by id, and forget them.
+    """
+    batch = list(entries.values())
+    projections.sync_entries(table, batch)
+    search.sync_entries(table, batch)
+    entries.clear()
+
+
+def add_written(table, entries, entry):
+    entries[entry.pk] = entry
+    if len(entries) >= settings.CSV_IMPORT_CHUNK_SIZE:
+        sync_written(table, entries)
+
+
 def check_tag_is_present(audience_tags_table_name, audience_id, audience_name, tag):
     user, _ = User.objects.get_or_create(username='paul-sync')
     tags_table, created = models.Table.objects.get_or_create(
@@ -56,6 +74,7 @@ def check_tag_is_present(audience_tags_table_name, audience_id, audience_name, t
         tag['audience_id'] = audience_id
         tag['audience_name'] = audience_name
         models.Entry.objects.create(table=tags_table, data=tag)
+        tags_table.bump_revision(entries_delta=1)
         return 'created'
     return 'updated'
 
@@ -120,6 +139,20 @@ def run_sync(key,
     audience_members_table_fields_defs = table_fields.TABLE_MAPPING['audience_members']
     segment_members_table_fields_defs = table_fields.TABLE_MAPPING['segment_members']
 
+    synced_tables = [
+        audiences_table,
+        audiences_stats_table,
+        audience_segments_table,
+        audience_members_table,
+        segment_members_table]
+    # entries written by the sync by id, their typed values and search
+    # vectors are refreshed a batch at a time
+    written = {table.pk: {} for table in synced_tables}
+
+    # new enum values are registered once per audience
+    segment_members_enums = enums.EnumDictionary(segment_members_table)
+    audience_members_enums = enums.EnumDictionary(audience_members_table)
+
     for list in lists['lists']:
         audience_exists = models.Entry.objects.filter(
             table=audiences_table, data__id=list['id'])
@@ -144,6 +177,7 @@ def run_sync(key,
                 audience_entry.data[field] = list[field_def['mailchimp_parent_key_name']][field_def['mailchimp_key_name']]
 
         audience_entry.save()
+        add_written(audiences_table, written[audiences_table.pk], audience_entry)
 
         # Sync list stats
         audience_stats_exists = models.Entry.objects.filter(
@@ -170,6 +204,7 @@ def run_sync(key,
                 pass
 
         audience_stats_entry.save()
+        add_written(audiences_stats_table, written[audiences_stats_table.pk], audience_stats_entry)
 
         # Sync list segments
         list_segments = client.lists.segments.all(list_id=list['id'], get_all=True)
@@ -200,6 +235,7 @@ def run_sync(key,
                     pass
 
             audience_segments_entry.save()
+            add_written(audience_segments_table, written[audience_segments_table.pk], audience_segments_entry)
 
             # Sync segment members
             segment_members = client.lists.segments.members.all(list_id=list['id'], segment_id=segment['id'], get_all=True)
@@ -225,19 +261,10 @@ def run_sync(key,
                     field_def = segment_members_table_fields_defs[field]
                     if field in member.keys():
                         if field_def['type'] == 'enum':
-                            # print(segment_members_table, field)
-                            table_column = models.TableColumn.objects.get(table=segment_members_table, name=field)
-                            if not table_column.choices:
-                                table_column.choices = []
                             if 'is_list' in field_def.keys():
-                                for item in member[field]:
-                                    if item not in table_column.choices:
-                                        table_column.choices.append(item)
-                                        table_column.save()
+                                segment_members_enums.add_many(field, member[field])
                             else:
-                                if member[field] not in table_column.choices:
-                                    table_column.choices.append(member[field])
-                                    table_column.save()
+                                segment_members_enums.add(field, member[field])
                         if 'is_list' in field_def.keys():
                             segment_members_entry.data[field] = ','.join(member[field])
                         else:
@@ -252,6 +279,7 @@ def run_sync(key,
                                 pass
 
                 segment_members_entry.save()
+                add_written(segment_members_table, written[segment_members_table.pk], segment_members_entry)
 
         # # Sync list members
         list_members = client.lists.members.all(list_id=list['id'], get_all=True)
@@ -277,20 +305,10 @@ def run_sync(key,
                 field_def = audience_members_table_fields_defs[field]
                 if field in member.keys():
                     if field_def['type'] == 'enum':
-                        table_column = models.TableColumn.objects.get(table=audience_members_table, name=field)
-                        if not table_column.choices:
-                            # print('no choices', table_column)
-                            table_column.choices = []
                         if 'is_list' in field_def.keys():
-                            for item in member[field]:
-                                if item['name'] not in table_column.choices:
-                                    table_column.choices.append(item['name'])
-                                    table_column.save()
+                            audience_members_enums.add_many(field, [item['name'] for item in member[field]])
                         else:
-                            if member[field] not in table_column.choices:
-                                table_column.choices.append(member[field])
-                                # print('append', member[field])
-                                table_column.save()
+                            audience_members_enums.add(field, member[field])
                     if 'is_list' in field_def.keys():
                         items = []
                         for item in member[field]:
@@ -310,6 +328,15 @@ def run_sync(key,
                         pass
 
             audience_members_entry.save()
+            add_written(audience_members_table, written[audience_members_table.pk], audience_members_entry)
+
+        segment_members_enums.flush()
+        audience_members_enums.flush()
+
+    for table in synced_tables:
+        sync_written(table, written[table.pk])
+        table.refresh_entries_count()
+        table.bump_revision()
     return success, stats
 
 
@@ -25,7 +25,8 @@ from typing import (
 from urllib import parse
 
 import requests
-from api import models
+from api import enums, models, projections, search
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.utils import timezone
 from requests.adapters import HTTPAdapter
@@ -1201,6 +1202,11 @@ def run_sync(
                 table_fields_def, map_tables[table_name]["name"]
             )
             json_table = json.load(open(table_name))
+            # new enum values are registered once per table
+            enum_dictionary = enums.EnumDictionary(table)
+            # entries written by the sync, their typed values and search
+            # vectors are refreshed a batch at a time
+            written = []
             i = 0
             for entry_json in json_table:
                 i += 1
@@ -1232,17 +1238,21 @@ def run_sync(
                         table_fields_def[entry_field_name]["display_name"], None
                     )
                     if table_fields_def[entry_field_name]["type"] == "enum":
-                        table_column = models.TableColumn.objects.get(
-                            table=table, name=entry_field_name
-                        )
-                        if not table_column.choices:
-                            table_column.choices = []
-                        if value and str(value) not in table_column.choices:
-                            table_column.choices.append(value)
-                            table_column.save()
+                        enum_dictionary.add(entry_field_name, value)
                     entry_data[entry_field_name] = value
 
                 models.Entry.objects.filter(**entry_filter).update(data=entry_data)
+                entry.data = entry_data
+                written.append(entry)
+                if len(written) >= settings.CSV_IMPORT_CHUNK_SIZE:
+                    projections.sync_entries(table, written)
+                    search.sync_entries(table, written)
+                    written = []
+            enum_dictionary.flush()
+            projections.sync_entries(table, written)
+            search.sync_entries(table, written)
+            table.refresh_entries_count()
+            table.bump_revision()
             # os.remove(table_name)
         stats = {"details": stats}
 